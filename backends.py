@@ -0,0 +1,553 @@
+"""モデルバックエンドモジュール
+
+ツールから呼び出すモデルAPIを抽象化し、Gemini APIを使うバックエンドと、
+実際のクォータを消費せずに負荷試験やベンチマークを行うための
+決定的なローカルのフェイクバックエンドを提供します。
+"""
+
+import asyncio
+import hashlib
+import random
+import threading
+import time
+from abc import ABC, abstractmethod
+from collections import deque
+from dataclasses import dataclass
+from typing import Any, AsyncIterator, Dict, List, Optional, Union
+
+
+@dataclass
+class GenerationResult:
+    """生成結果（ストリーミングでは各チャンク）と使用トークン数"""
+    text: str
+    input_tokens: Optional[int] = None
+    output_tokens: Optional[int] = None
+    # 生成が終了した理由（'STOP'・'MAX_TOKENS'など。ストリーミングでは最後のチャンクだけ）
+    finish_reason: Optional[str] = None
+
+
+@dataclass
+class CachedContentHandle:
+    """登録されたキャッシュ済みコンテンツ"""
+    name: str
+    expires_at: float
+
+
+@dataclass
+class BatchRequest:
+    """上流のバッチAPIに送る1件分のリクエスト"""
+    contents: Any
+    system_instruction: Optional[str] = None
+    temperature: Optional[float] = None
+
+
+class BatchJobError(Exception):
+    """バッチジョブ全体が失敗した場合のエラー"""
+
+
+class ModelBackend(ABC):
+    """ツールが利用するモデルAPIのインターフェース"""
+
+    name = "base"
+
+    @abstractmethod
+    async def generate(
+        self,
+        model: str,
+        contents: Any,
+        system_instruction: Optional[str] = None,
+        temperature: Optional[float] = None,
+        cached_content: Optional[str] = None,
+        max_output_tokens: Optional[int] = None
+    ) -> GenerationResult:
+        """応答全体を生成して返します"""
+
+    @abstractmethod
+    def generate_stream(
+        self,
+        model: str,
+        contents: Any,
+        system_instruction: Optional[str] = None,
+        temperature: Optional[float] = None,
+        cached_content: Optional[str] = None,
+        max_output_tokens: Optional[int] = None
+    ) -> AsyncIterator[GenerationResult]:
+        """生成された部分テキストを順に返す非同期イテレータを返します"""
+
+    @abstractmethod
+    async def create_cached_content(
+        self,
+        model: str,
+        system_instruction: str,
+        ttl_seconds: int
+    ) -> CachedContentHandle:
+        """システムプロンプトをキャッシュ済みコンテンツとして登録します"""
+
+    @abstractmethod
+    async def count_tokens(
+        self,
+        model: str,
+        contents: Any,
+        system_instruction: Optional[str] = None
+    ) -> int:
+        """モデルのトークナイザで入力のトークン数を数えます"""
+
+    @abstractmethod
+    async def generate_batch(
+        self,
+        model: str,
+        requests: List[BatchRequest],
+        poll_interval: float = 30.0,
+        timeout: Optional[float] = None
+    ) -> List[Union[GenerationResult, Exception]]:
+        """リクエストをまとめて上流のバッチAPIに送り、完了まで待って結果を返します
+
+        結果はrequestsと同じ順序で、失敗したリクエストには例外が入ります。
+        """
+
+
+class GeminiBackend(ModelBackend):
+    """google-genaiの非同期クライアントを使うバックエンド"""
+
+    name = "gemini"
+
+    def __init__(self, api_key: Optional[str] = None):
+        import google.genai as genai
+        from google.genai import types
+
+        self._types = types
+        self.client = genai.Client(api_key=api_key)
+
+    def _config(
+        self,
+        system_instruction: Optional[str],
+        temperature: Optional[float],
+        cached_content: Optional[str],
+        max_output_tokens: Optional[int] = None
+    ):
+        if cached_content is not None:
+            return self._types.GenerateContentConfig(
+                cached_content=cached_content,
+                temperature=temperature,
+                max_output_tokens=max_output_tokens,
+            )
+        return self._types.GenerateContentConfig(
+            system_instruction=system_instruction,
+            temperature=temperature,
+            max_output_tokens=max_output_tokens,
+        )
+
+    @staticmethod
+    def _result(response: Any) -> GenerationResult:
+        usage = getattr(response, 'usage_metadata', None)
+        candidates = getattr(response, 'candidates', None)
+        finish_reason = getattr(candidates[0], 'finish_reason', None) if candidates else None
+        return GenerationResult(
+            text=response.text or '',
+            input_tokens=getattr(usage, 'prompt_token_count', None),
+            output_tokens=getattr(usage, 'candidates_token_count', None),
+            finish_reason=(
+                None if finish_reason is None else getattr(finish_reason, 'name', str(finish_reason))
+            ),
+        )
+
+    async def generate(
+        self,
+        model: str,
+        contents: Any,
+        system_instruction: Optional[str] = None,
+        temperature: Optional[float] = None,
+        cached_content: Optional[str] = None,
+        max_output_tokens: Optional[int] = None
+    ) -> GenerationResult:
+        response = await self.client.aio.models.generate_content(
+            model=model,
+            contents=contents,
+            config=self._config(system_instruction, temperature, cached_content, max_output_tokens),
+        )
+        return self._result(response)
+
+    async def generate_stream(
+        self,
+        model: str,
+        contents: Any,
+        system_instruction: Optional[str] = None,
+        temperature: Optional[float] = None,
+        cached_content: Optional[str] = None,
+        max_output_tokens: Optional[int] = None
+    ) -> AsyncIterator[GenerationResult]:
+        async for chunk in await self.client.aio.models.generate_content_stream(
+            model=model,
+            contents=contents,
+            config=self._config(system_instruction, temperature, cached_content, max_output_tokens),
+        ):
+            yield self._result(chunk)
+
+    async def create_cached_content(
+        self,
+        model: str,
+        system_instruction: str,
+        ttl_seconds: int
+    ) -> CachedContentHandle:
+        registered_at = time.time()
+        cached = await self.client.aio.caches.create(
+            model=model,
+            config=self._types.CreateCachedContentConfig(
+                system_instruction=system_instruction,
+                ttl=f"{ttl_seconds}s",
+                display_name="dive-deep-system-prompt",
+            ),
+        )
+        expire_time = getattr(cached, 'expire_time', None)
+        expires_at = (
+            expire_time.timestamp() if expire_time is not None
+            else registered_at + ttl_seconds
+        )
+        return CachedContentHandle(name=cached.name, expires_at=expires_at)
+
+    async def count_tokens(
+        self,
+        model: str,
+        contents: Any,
+        system_instruction: Optional[str] = None
+    ) -> int:
+        # countTokensはシステムプロンプトを受け付けないため、コンテンツの先頭に含めて数える
+        if system_instruction:
+            contents = [system_instruction, contents]
+        response = await self.client.aio.models.count_tokens(model=model, contents=contents)
+        return response.total_tokens
+
+    async def generate_batch(
+        self,
+        model: str,
+        requests: List[BatchRequest],
+        poll_interval: float = 30.0,
+        timeout: Optional[float] = None
+    ) -> List[Union[GenerationResult, Exception]]:
+        job = await self.client.aio.batches.create(
+            model=model,
+            src=[
+                self._types.InlinedRequest(
+                    contents=request.contents,
+                    config=self._config(request.system_instruction, request.temperature, None),
+                )
+                for request in requests
+            ],
+            config=self._types.CreateBatchJobConfig(display_name="dive-deep-batch-review"),
+        )
+        deadline = None if timeout is None else time.monotonic() + timeout
+        terminal = {
+            'JOB_STATE_SUCCEEDED', 'JOB_STATE_PARTIALLY_SUCCEEDED', 'JOB_STATE_FAILED',
+            'JOB_STATE_CANCELLED', 'JOB_STATE_EXPIRED',
+        }
+        try:
+            while getattr(job.state, 'name', str(job.state)) not in terminal:
+                if deadline is not None and time.monotonic() >= deadline:
+                    await self.client.aio.batches.cancel(name=job.name)
+                    raise BatchJobError(f"Batch job {job.name} did not finish within {timeout}s")
+                await asyncio.sleep(poll_interval)
+                job = await self.client.aio.batches.get(name=job.name)
+        except asyncio.CancelledError:
+            # 呼び出しがキャンセルされた場合は上流のバッチジョブも取り消す
+            await asyncio.shield(self.client.aio.batches.cancel(name=job.name))
+            raise
+
+        state = getattr(job.state, 'name', str(job.state))
+        responses = getattr(job.dest, 'inlined_responses', None) or []
+        if state not in ('JOB_STATE_SUCCEEDED', 'JOB_STATE_PARTIALLY_SUCCEEDED') or not responses:
+            raise BatchJobError(f"Batch job {job.name} ended in {state}: {job.error}")
+        results: List[Union[GenerationResult, Exception]] = []
+        for item in responses:
+            if item.error is not None or item.response is None:
+                results.append(BatchJobError(f"Batch request failed: {item.error}"))
+            else:
+                results.append(self._result(item.response))
+        return results
+
+
+class FakeBackendError(Exception):
+    """フェイクバックエンドが注入するAPIエラー"""
+
+    def __init__(self, code: int, message: str):
+        super().__init__(f"{code} {message}")
+        self.code = code
+
+
+class FakeBackend(ModelBackend):
+    """決定的な応答を返すローカルのフェイクバックエンド
+
+    応答テキストはリクエスト内容のハッシュから決まり、所要時間は
+    latency（最初のトークンまでの秒数）とoutput_tokens / tokens_per_secondで決まります。
+    tail_rateの割合の呼び出しでは最初のトークンまでにtail_latency秒が加わります。
+    error_rateの割合で429または503のエラーを返します。乱数はseedで初期化されるため、
+    同じ順序のリクエストには同じ結果を返します。
+    """
+
+    name = "fake"
+
+    def __init__(
+        self,
+        latency: float = 0.5,
+        tokens_per_second: float = 200.0,
+        output_tokens: int = 300,
+        error_rate: float = 0.0,
+        seed: int = 0,
+        history_size: int = 1000,
+        tail_rate: float = 0.0,
+        tail_latency: float = 0.0
+    ):
+        self.latency = latency
+        self.tail_rate = tail_rate
+        self.tail_latency = tail_latency
+        self.tokens_per_second = tokens_per_second
+        self.output_tokens = output_tokens
+        self.error_rate = error_rate
+        self._random = random.Random(seed)
+        self._cached_contents: Dict[str, CachedContentHandle] = {}
+        # 直近の呼び出しを記録する（検証用）
+        self.calls: "deque[Dict[str, Any]]" = deque(maxlen=history_size)
+        self.call_count = 0
+
+    def _record(self, method: str, model: str, contents: Any, cached_content: Optional[str]) -> None:
+        self.call_count += 1
+        self.calls.append({
+            'method': method,
+            'model': model,
+            'cached_content': cached_content,
+            'input_chars': len(str(contents)),
+        })
+
+    def _check(self, cached_content: Optional[str]) -> None:
+        if cached_content is not None:
+            handle = self._cached_contents.get(cached_content)
+            if handle is None or handle.expires_at < time.time():
+                raise FakeBackendError(404, f"cached content {cached_content} not found")
+        if self.error_rate and self._random.random() < self.error_rate:
+            raise FakeBackendError(*self._random.choice(
+                [(429, "RESOURCE_EXHAUSTED"), (503, "UNAVAILABLE")]
+            ))
+
+    def _first_token_delay(self) -> float:
+        if self.tail_rate and self._random.random() < self.tail_rate:
+            return self.latency + self.tail_latency
+        return self.latency
+
+    def _words(self, model: str, contents: Any, system_instruction: Optional[str]):
+        digest = hashlib.sha256(
+            f"{model}\0{system_instruction}\0{contents}".encode("utf-8")
+        ).hexdigest()
+        return [f"token{digest[i % 56:i % 56 + 8]}" for i in range(self.output_tokens)]
+
+    @staticmethod
+    def _input_tokens(contents: Any, system_instruction: Optional[str]) -> int:
+        return (len(str(contents)) + len(system_instruction or '')) // 4
+
+    def _finish_reason(self, max_output_tokens: Optional[int]) -> str:
+        if max_output_tokens is not None and self.output_tokens > max_output_tokens:
+            return 'MAX_TOKENS'
+        return 'STOP'
+
+    async def generate(
+        self,
+        model: str,
+        contents: Any,
+        system_instruction: Optional[str] = None,
+        temperature: Optional[float] = None,
+        cached_content: Optional[str] = None,
+        max_output_tokens: Optional[int] = None
+    ) -> GenerationResult:
+        self._record('generate', model, contents, cached_content)
+        await asyncio.sleep(self._first_token_delay())
+        self._check(cached_content)
+        words = self._words(model, contents, system_instruction)[:max_output_tokens]
+        await asyncio.sleep(len(words) / self.tokens_per_second)
+        return GenerationResult(
+            text=' '.join(words),
+            input_tokens=self._input_tokens(contents, system_instruction),
+            output_tokens=len(words),
+            finish_reason=self._finish_reason(max_output_tokens),
+        )
+
+    async def generate_stream(
+        self,
+        model: str,
+        contents: Any,
+        system_instruction: Optional[str] = None,
+        temperature: Optional[float] = None,
+        cached_content: Optional[str] = None,
+        max_output_tokens: Optional[int] = None,
+        chunk_tokens: int = 20
+    ) -> AsyncIterator[GenerationResult]:
+        self._record('generate_stream', model, contents, cached_content)
+        await asyncio.sleep(self._first_token_delay())
+        self._check(cached_content)
+        words = self._words(model, contents, system_instruction)[:max_output_tokens]
+        for start in range(0, len(words), chunk_tokens):
+            chunk = words[start:start + chunk_tokens]
+            if start:
+                await asyncio.sleep(len(chunk) / self.tokens_per_second)
+            last = start + chunk_tokens >= len(words)
+            yield GenerationResult(
+                text=(' ' if start else '') + ' '.join(chunk),
+                input_tokens=self._input_tokens(contents, system_instruction) if last else None,
+                output_tokens=len(words) if last else None,
+                finish_reason=self._finish_reason(max_output_tokens) if last else None,
+            )
+
+    async def create_cached_content(
+        self,
+        model: str,
+        system_instruction: str,
+        ttl_seconds: int
+    ) -> CachedContentHandle:
+        self._record('create_cached_content', model, system_instruction, None)
+        handle = CachedContentHandle(
+            name=f"cachedContents/fake-{len(self._cached_contents) + 1}",
+            expires_at=time.time() + ttl_seconds,
+        )
+        self._cached_contents[handle.name] = handle
+        return handle
+
+    async def count_tokens(
+        self,
+        model: str,
+        contents: Any,
+        system_instruction: Optional[str] = None
+    ) -> int:
+        return self._input_tokens(contents, system_instruction)
+
+    async def generate_batch(
+        self,
+        model: str,
+        requests: List[BatchRequest],
+        poll_interval: float = 30.0,
+        timeout: Optional[float] = None
+    ) -> List[Union[GenerationResult, Exception]]:
+        # バッチジョブはlatencyの待ち時間の後にまとめて完了したものとして扱う
+        await asyncio.sleep(self.latency)
+        results: List[Union[GenerationResult, Exception]] = []
+        for request in requests:
+            self._record('generate_batch', model, request.contents, None)
+            try:
+                self._check(None)
+            except FakeBackendError as e:
+                results.append(e)
+                continue
+            words = self._words(model, request.contents, request.system_instruction)
+            results.append(GenerationResult(
+                text=' '.join(words),
+                input_tokens=self._input_tokens(request.contents, request.system_instruction),
+                output_tokens=len(words),
+                finish_reason='STOP',
+            ))
+        return results
+
+
+_BACKENDS = {
+    GeminiBackend.name: GeminiBackend,
+    FakeBackend.name: FakeBackend,
+}
+
+
+def create_backend(name: str, **options: Any) -> ModelBackend:
+    """名前からバックエンドを生成します"""
+    if name not in _BACKENDS:
+        raise ValueError(f"Unknown model backend: {name}")
+    return _BACKENDS[name](**options)
+
+
+class LazyBackend(ModelBackend):
+    """最初の呼び出しまで実際のバックエンドの生成を遅延するラッパー
+
+    google-genaiのインポートとクライアントの生成には数百ミリ秒かかるため、
+    サーバーの起動（MCPのハンドシェイク）を待たせないように最初の呼び出しで行います。
+    生成はスレッドで行い、イベントループをブロックしません。
+    """
+
+    def __init__(self, name: str, **options: Any):
+        if name not in _BACKENDS:
+            raise ValueError(f"Unknown model backend: {name}")
+        self.name = name
+        self._options = options
+        self._backend: Optional[ModelBackend] = None
+        self._lock = threading.Lock()
+
+    @property
+    def loaded(self) -> bool:
+        return self._backend is not None
+
+    def load(self) -> ModelBackend:
+        """実際のバックエンドを生成して返します（生成済みならそれを返します）"""
+        if self._backend is None:
+            with self._lock:
+                if self._backend is None:
+                    self._backend = create_backend(self.name, **self._options)
+        return self._backend
+
+    def warm_up(self) -> threading.Thread:
+        """バックグラウンドのスレッドでバックエンドを生成します"""
+        thread = threading.Thread(target=self.load, name='backend-warm-up', daemon=True)
+        thread.start()
+        return thread
+
+    async def _get(self) -> ModelBackend:
+        if self._backend is not None:
+            return self._backend
+        return await asyncio.to_thread(self.load)
+
+    async def generate(
+        self,
+        model: str,
+        contents: Any,
+        system_instruction: Optional[str] = None,
+        temperature: Optional[float] = None,
+        cached_content: Optional[str] = None,
+        max_output_tokens: Optional[int] = None
+    ) -> GenerationResult:
+        backend = await self._get()
+        return await backend.generate(
+            model, contents, system_instruction, temperature, cached_content, max_output_tokens
+        )
+
+    async def generate_stream(
+        self,
+        model: str,
+        contents: Any,
+        system_instruction: Optional[str] = None,
+        temperature: Optional[float] = None,
+        cached_content: Optional[str] = None,
+        max_output_tokens: Optional[int] = None
+    ) -> AsyncIterator[GenerationResult]:
+        backend = await self._get()
+        async for chunk in backend.generate_stream(
+            model, contents, system_instruction, temperature, cached_content, max_output_tokens
+        ):
+            yield chunk
+
+    async def create_cached_content(
+        self,
+        model: str,
+        system_instruction: str,
+        ttl_seconds: int
+    ) -> CachedContentHandle:
+        backend = await self._get()
+        return await backend.create_cached_content(model, system_instruction, ttl_seconds)
+
+    async def count_tokens(
+        self,
+        model: str,
+        contents: Any,
+        system_instruction: Optional[str] = None
+    ) -> int:
+        backend = await self._get()
+        return await backend.count_tokens(model, contents, system_instruction)
+
+    async def generate_batch(
+        self,
+        model: str,
+        requests: List[BatchRequest],
+        poll_interval: float = 30.0,
+        timeout: Optional[float] = None
+    ) -> List[Union[GenerationResult, Exception]]:
+        backend = await self._get()
+        return await backend.generate_batch(model, requests, poll_interval, timeout)
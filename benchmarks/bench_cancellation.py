@@ -0,0 +1,154 @@
+"""キャンセルと期限による実行枠の解放の計測
+
+応答の遅いフェイクバックエンドを使うサーバーにインメモリのMCPクライアントで接続し、
+各ツールの呼び出しが上流で実行中になった時点で、MCPのキャンセル通知を送る場合と
+timeout_secondsの期限を過ぎる場合について、スケジューラの同時実行枠・セッションの
+実行枠・合流中の呼び出しがすべて解放されるまでの時間を計測します。
+キャンセル通知から解放までに--max-release-msより長くかかった場合と、期限を指定した
+呼び出しが期限のエラーにならなかった場合は終了コード1で終了します。
+
+使用例:
+    python benchmarks/bench_cancellation.py --calls 4 --latency 5 --output bench_cancellation.json
+"""
+
+import argparse
+import asyncio
+import os
+import sys
+import time
+from typing import Any, Dict, List
+
+from common import percentile, write_results
+
+from bench_tools import build_payloads
+
+TOOLS = ['deep_thinking_agent', 'enhancement_agent', 'final_review_agent']
+
+
+def released(server: Any) -> bool:
+    """上流の呼び出しが保持している実行枠がすべて解放されているかを返します"""
+    sessions = server.session_limiter.stats()['sessions']
+    return (
+        server.scheduler.running == 0
+        and server.request_coalescer.stats()['inflight'] == 0
+        and all(session['in_flight'] == 0 for session in sessions)
+    )
+
+
+async def wait_until(predicate, timeout: float) -> float:
+    """predicateが真になるまで待ち、待った秒数を返します"""
+    started = time.perf_counter()
+    while not predicate():
+        if time.perf_counter() - started > timeout:
+            raise TimeoutError("condition was not met")
+        await asyncio.sleep(0.0005)
+    return time.perf_counter() - started
+
+
+async def measure_cancel(server: Any, session: Any, tool: str, calls: int, latency: float) -> List[float]:
+    """呼び出しが実行中になった後にキャンセル通知を送り、枠の解放までの秒数を返します"""
+    from mcp import types
+
+    request_ids = []
+    tasks = []
+    for arguments in build_payloads(tool, calls, unique=True):
+        request_id = session._request_id
+        tasks.append(asyncio.create_task(session.call_tool(tool, arguments)))
+        await wait_until(lambda: session._request_id > request_id, latency)
+        request_ids.append(request_id)
+    await wait_until(lambda: server.scheduler.running == calls, latency)
+
+    started = time.perf_counter()
+    for request_id in request_ids:
+        await session.send_notification(types.ClientNotification(types.CancelledNotification(
+            params=types.CancelledNotificationParams(requestId=request_id, reason='benchmark'),
+        )))
+    await wait_until(lambda: released(server), latency)
+    release = time.perf_counter() - started
+    for task in tasks:
+        try:
+            await task
+        except Exception:
+            pass
+    return [release]
+
+
+async def measure_deadline(server: Any, session: Any, tool: str, calls: int, timeout: float) -> Dict[str, Any]:
+    """timeout_secondsを指定した呼び出しの枠が期限の何ミリ秒後に解放されたかを返します
+
+    期限の起点はクライアントが送信を始めた時刻とするため、値にはリクエストの転送と
+    プリフライトの時間も含まれます（実際の超過時間の上限）。
+    """
+    started = time.perf_counter()
+    tasks = [
+        asyncio.create_task(session.call_tool(tool, {**arguments, 'timeout_seconds': timeout}))
+        for arguments in build_payloads(tool, calls, unique=True)
+    ]
+    await wait_until(lambda: server.scheduler.running == calls, timeout)
+    await wait_until(lambda: released(server), 5.0)
+    overrun = time.perf_counter() - started - timeout
+    results = await asyncio.gather(*tasks)
+    return {
+        'overrun_ms': round(overrun * 1000, 2),
+        'errors': sum('Deadline' in result.content[0].text for result in results),
+    }
+
+
+async def run(args: argparse.Namespace) -> Dict[str, Any]:
+    import dive_deep_server as server
+    from mcp.shared.memory import create_connected_server_and_client_session
+
+    results: Dict[str, Any] = {}
+    async with create_connected_server_and_client_session(server.mcp._mcp_server) as session:
+        for tool in TOOLS:
+            releases: List[float] = []
+            for _ in range(args.rounds):
+                releases += await measure_cancel(server, session, tool, args.calls, args.latency)
+            deadline = await measure_deadline(server, session, tool, args.calls, args.deadline)
+            results[tool] = {
+                'cancel_release_ms': {
+                    'p50': round(percentile(releases, 50) * 1000, 2),
+                    'max': round(max(releases) * 1000, 2),
+                },
+                'deadline': deadline,
+            }
+            print(
+                f"{tool:<20} cancel -> slots free p50/max: {results[tool]['cancel_release_ms']['p50']}/"
+                f"{results[tool]['cancel_release_ms']['max']}ms, deadline {args.deadline}s -> "
+                f"slots free <= {deadline['overrun_ms']}ms after the deadline "
+                f"({deadline['errors']}/{args.calls} deadline errors)"
+            )
+        results['coalescing'] = server.request_coalescer.stats()
+    return results
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--calls', type=int, default=4, help='ツールごとに同時に実行中にする呼び出し数')
+    parser.add_argument('--rounds', type=int, default=5, help='キャンセルの計測回数')
+    parser.add_argument('--latency', type=float, default=5.0, help='フェイクバックエンドの応答時間（秒）')
+    parser.add_argument('--deadline', type=float, default=0.2, help='期限の計測で指定するtimeout_seconds')
+    parser.add_argument('--max-release-ms', type=float, default=50.0, help='許容する解放までの時間（ミリ秒）')
+    parser.add_argument('--output', default='bench_cancellation.json', help='結果を保存するJSONファイル')
+    args = parser.parse_args()
+
+    os.environ.update({
+        'DIVE_DEEP_BACKEND': 'fake',
+        'DIVE_DEEP_FAKE_LATENCY': str(args.latency),
+        'DIVE_DEEP_CACHE_ENABLED': '0',
+        'DIVE_DEEP_LOG_LEVEL': 'WARNING',
+    })
+    results = asyncio.run(run(args))
+    write_results(args.output, 'cancellation', vars(args), results)
+
+    slowest = max(results[tool]['cancel_release_ms']['max'] for tool in TOOLS)
+    if slowest > args.max_release_ms:
+        print(f"Slots were released {slowest}ms after cancellation (limit {args.max_release_ms}ms)")
+        sys.exit(1)
+    if any(results[tool]['deadline']['errors'] != args.calls for tool in TOOLS):
+        print("Some calls did not fail with a deadline error")
+        sys.exit(1)
+
+
+if __name__ == '__main__':
+    main()
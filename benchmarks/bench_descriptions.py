@@ -0,0 +1,105 @@
+"""説明文のプロファイルごとのツール一覧のトークン数の計測
+
+DIVE_DEEP_DESCRIPTION_PROFILEの各プロファイルでサーバーを読み込み、インメモリの
+MCPクライアントで取得したtools/listの応答（エディタのモデルのコンテキストに
+毎ターン入る部分）の文字数と推定トークン数を計測し、fullとの差を出力します。
+--liveを指定するとGemini APIのcount_tokensで実際のトークン数も数えます
+（GEMINI_API_KEYが必要です）。
+
+使用例:
+    python benchmarks/bench_descriptions.py --output bench_descriptions.json
+    python benchmarks/bench_descriptions.py --live --model gemini-2.0-flash
+"""
+
+import argparse
+import asyncio
+import json
+import os
+import subprocess
+import sys
+from typing import Any, Dict
+
+from common import ROOT_DIR, write_results
+
+from prompts import DESCRIPTION_PROFILES
+from token_budget import estimate_tokens
+
+
+async def list_tools() -> str:
+    """サーバーのtools/listの応答をJSON文字列で返します"""
+    import dive_deep_server as server
+    from mcp.shared.memory import create_connected_server_and_client_session
+
+    async with create_connected_server_and_client_session(server.mcp._mcp_server) as session:
+        result = await session.list_tools()
+    return json.dumps(result.model_dump(mode='json', exclude_none=True)['tools'], ensure_ascii=False)
+
+
+def listing_for(profile: str) -> str:
+    """プロファイルを指定した子プロセスでツール一覧を取得します
+
+    プロファイルはサーバーの読み込み時に決まるため、プロファイルごとに別のプロセスで読み込みます。
+    """
+    env = {
+        **os.environ,
+        'DIVE_DEEP_DESCRIPTION_PROFILE': profile,
+        'DIVE_DEEP_BACKEND': 'fake',
+        'DIVE_DEEP_LOG_LEVEL': 'WARNING',
+    }
+    completed = subprocess.run(
+        [sys.executable, os.path.abspath(__file__), '--child'],
+        cwd=ROOT_DIR, env=env, capture_output=True, text=True, check=True,
+    )
+    return completed.stdout
+
+
+async def count_live(model: str, text: str) -> int:
+    from backends import GeminiBackend
+
+    return await GeminiBackend(api_key=os.getenv("GEMINI_API_KEY")).count_tokens(model, text)
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--live', action='store_true', help='Gemini APIで実際のトークン数を数える')
+    parser.add_argument('--model', default='gemini-2.0-flash', help='--live時にトークン数を数えるモデル')
+    parser.add_argument('--output', default='bench_descriptions.json', help='結果を保存するJSONファイル')
+    parser.add_argument('--child', action='store_true', help=argparse.SUPPRESS)
+    args = parser.parse_args()
+
+    if args.child:
+        sys.stdout.write(asyncio.run(list_tools()))
+        return
+
+    results: Dict[str, Any] = {}
+    for profile in DESCRIPTION_PROFILES:
+        listing = listing_for(profile)
+        tools = json.loads(listing)
+        results[profile] = {
+            'tools': len(tools),
+            'chars': len(listing),
+            'estimated_tokens': estimate_tokens(listing),
+            # 残りは入力スキーマで、プロファイルによらず同じ
+            'description_estimated_tokens': sum(
+                estimate_tokens(tool.get('description', '')) for tool in tools
+            ),
+        }
+        if args.live:
+            results[profile]['tokens'] = asyncio.run(count_live(args.model, listing))
+
+    key = 'tokens' if args.live else 'estimated_tokens'
+    full = results['full'][key]
+    for profile in DESCRIPTION_PROFILES:
+        tokens = results[profile][key]
+        results[profile]['saved_tokens'] = full - tokens
+        results[profile]['saved_ratio'] = round(1 - tokens / full, 4)
+        print(
+            f"{profile:<8} {results[profile]['chars']:>6} chars, {tokens:>5} {key} "
+            f"({results[profile]['description_estimated_tokens']} in descriptions), "
+            f"saves {full - tokens} tokens ({results[profile]['saved_ratio']:.1%}) per listing"
+        )
+    write_results(args.output, 'descriptions', vars(args), results)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,107 @@
+"""コードペイロードのエンコーディングのベンチマーク
+
+tool_execution_result/case1 のサンプルについて、エンコーディングごとに
+ツールが送るコンテンツの文字数・推定トークン数とエンコードにかかる時間を計測します。
+--live を指定するとGemini APIで実際に生成し、入力トークン数（usage）と
+レイテンシも計測します（GEMINI_API_KEYが必要です）。
+
+使用例:
+    python benchmarks/bench_encoding.py --output bench_encoding.json
+    python benchmarks/bench_encoding.py --live --runs 3 --model gemini-2.0-flash
+"""
+
+import argparse
+import asyncio
+import os
+import time
+from typing import Any, Dict, List
+
+from common import latency_summary, load_samples, write_results
+
+from code_encoding import encode_code
+from prompts import DEEP_REVIEW_PROMPT
+from token_budget import estimate_tokens
+
+# (名前, エンコーディング, 行番号, minify)
+VARIANTS = [
+    ('json', 'json', False, False),
+    ('delimited', 'delimited', False, False),
+    ('delimited+line_numbers', 'delimited', True, False),
+    ('delimited+minify', 'delimited', False, True),
+    ('delimited+line_numbers+minify', 'delimited', True, True),
+]
+
+
+def build_content(instructions: str, files: List[Any], encoding: str, line_numbers: bool, minified: bool) -> str:
+    """サーバーの_build_code_contentと同じ形式のコンテンツを組み立てます"""
+    paths = [path for path, _ in files]
+    code = [text for _, text in files]
+    encoded = encode_code(code, paths, encoding, line_numbers, minified)
+    separator = ' ' if encoding == 'json' else '\n'
+    return f"instructions: {instructions}\ncode:{separator}{encoded}"
+
+
+async def measure_live(backend: Any, model: str, content: str, runs: int) -> Dict[str, Any]:
+    latencies = []
+    input_tokens = None
+    for _ in range(runs):
+        started = time.perf_counter()
+        result = await backend.generate(model, content, DEEP_REVIEW_PROMPT, 0.7)
+        latencies.append(time.perf_counter() - started)
+        input_tokens = result.input_tokens
+    summary = latency_summary(latencies, sum(latencies))
+    return {'input_tokens': input_tokens, 'latency_seconds': summary['latency_seconds']}
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--repeat', type=int, default=200, help='エンコード時間の計測回数')
+    parser.add_argument('--live', action='store_true', help='Gemini APIで実際に生成して計測する')
+    parser.add_argument('--runs', type=int, default=3, help='--live時のエンコーディングごとの生成回数')
+    parser.add_argument('--model', default=os.getenv("GEMINI_MODEL", "gemini-2.0-flash"))
+    parser.add_argument('--output', default='bench_encoding.json', help='結果を保存するJSONファイル')
+    args = parser.parse_args()
+
+    samples = load_samples()
+    backend = None
+    if args.live:
+        from backends import create_backend
+        backend = create_backend('gemini', api_key=os.getenv("GEMINI_API_KEY"))
+
+    results: Dict[str, Any] = {}
+    for variant, files in samples['variants'].items():
+        results[variant] = {}
+        for name, encoding, line_numbers, minified in VARIANTS:
+            content = build_content(samples['instructions'], files, encoding, line_numbers, minified)
+            started = time.perf_counter()
+            for _ in range(args.repeat):
+                build_content(samples['instructions'], files, encoding, line_numbers, minified)
+            encode_us = (time.perf_counter() - started) / args.repeat * 1e6
+            entry = {
+                'chars': len(content),
+                'estimated_tokens': estimate_tokens(content),
+                'encode_us': round(encode_us, 1),
+            }
+            if backend is not None:
+                entry['live'] = asyncio.run(measure_live(backend, args.model, content, args.runs))
+            results[variant][name] = entry
+
+    baseline = {v: r['json']['estimated_tokens'] for v, r in results.items()}
+    for name, *_ in VARIANTS:
+        tokens = sum(r[name]['estimated_tokens'] for r in results.values())
+        chars = sum(r[name]['chars'] for r in results.values())
+        ratio = tokens / sum(baseline.values())
+        line = f"{name:<31} chars: {chars:>7}, estimated tokens: {tokens:>7} ({ratio:.1%} of json)"
+        if args.live:
+            live = [r[name]['live'] for r in results.values()]
+            line += (
+                f", input tokens: {sum(l['input_tokens'] or 0 for l in live)}"
+                f", p50 latency: {[l['latency_seconds']['p50'] for l in live]}"
+            )
+        print(line)
+
+    write_results(args.output, 'encoding', vars(args), results)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,166 @@
+"""HTTPトランスポートの複数クライアント負荷試験
+
+フェイクバックエンドを使うサーバーを1つのHTTPサーバーとして起動し、それぞれが
+独立したMCPセッションを持つ複数のクライアントから同時にツールを呼び出します。
+レイテンシ・スループットに加えて、セッション間で共有されるレスポンスキャッシュ・
+リクエスト合流の統計と、セッションごとの呼び出し数を記録します。
+
+使用例:
+    python benchmarks/bench_http.py --clients 16 --requests 10 --repeat-payloads
+"""
+
+import argparse
+import asyncio
+import json
+import os
+import socket
+import subprocess
+import sys
+import time
+from contextlib import asynccontextmanager
+from typing import Any, AsyncIterator, Dict, List
+
+from mcp import ClientSession
+from mcp.client.sse import sse_client
+from mcp.client.streamable_http import streamablehttp_client
+
+from bench_tools import build_payloads
+from common import SERVER_PATH, latency_summary, peak_rss_kb, write_results
+
+TRANSPORTS = ['streamable-http', 'sse']
+
+
+def free_port() -> int:
+    with socket.socket() as sock:
+        sock.bind(('127.0.0.1', 0))
+        return sock.getsockname()[1]
+
+
+def wait_for_port(port: int, timeout: float = 30.0) -> None:
+    deadline = time.monotonic() + timeout
+    while time.monotonic() < deadline:
+        try:
+            with socket.create_connection(('127.0.0.1', port), timeout=0.5):
+                return
+        except OSError:
+            time.sleep(0.05)
+    raise RuntimeError(f"Server did not start listening on port {port}")
+
+
+@asynccontextmanager
+async def connect(transport: str, port: int) -> AsyncIterator[ClientSession]:
+    """HTTPトランスポートでサーバーに接続し、初期化済みのセッションを返します"""
+    if transport == 'sse':
+        client = sse_client(f'http://127.0.0.1:{port}/sse')
+    else:
+        client = streamablehttp_client(f'http://127.0.0.1:{port}/mcp')
+    async with client as streams:
+        async with ClientSession(streams[0], streams[1]) as session:
+            await session.initialize()
+            yield session
+
+
+async def read_json_resource(session: ClientSession, uri: str) -> Dict[str, Any]:
+    result = await session.read_resource(uri)
+    return json.loads(result.contents[0].text)
+
+
+async def run_load(args: argparse.Namespace, port: int) -> Dict[str, Any]:
+    payloads = build_payloads(args.tool, args.clients * args.requests, not args.repeat_payloads)
+    latencies: List[float] = []
+    errors = 0
+    finished = 0
+    all_finished = asyncio.Event()
+    # 統計を読み終えるまでクライアントのセッションを切断しない
+    stats_read = asyncio.Event()
+
+    async def client(index: int) -> None:
+        nonlocal errors, finished
+        async with connect(args.transport, port) as session:
+            for n in range(args.requests):
+                payload = payloads[index * args.requests + n]
+                started = time.perf_counter()
+                result = await session.call_tool(args.tool, payload)
+                if result.isError or '"isError": true' in result.content[0].text:
+                    errors += 1
+                else:
+                    latencies.append(time.perf_counter() - started)
+            finished += 1
+            if finished == args.clients:
+                all_finished.set()
+            await stats_read.wait()
+
+    async def collect_stats() -> Dict[str, Any]:
+        await all_finished.wait()
+        elapsed = time.perf_counter() - started
+        stats = {}
+        try:
+            async with connect(args.transport, port) as session:
+                for name in ('cache', 'coalescing', 'sessions'):
+                    stats[f'{name}_stats'] = await read_json_resource(
+                        session, f'dive-deep://{name}/stats'
+                    )
+        finally:
+            stats_read.set()
+        return {**latency_summary(latencies, elapsed, errors), **stats}
+
+    started = time.perf_counter()
+    *_, summary = await asyncio.gather(
+        *(client(i) for i in range(args.clients)), collect_stats()
+    )
+    return summary
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--transport', default='streamable-http', choices=TRANSPORTS)
+    parser.add_argument('--tool', default='final_review_agent')
+    parser.add_argument('--clients', type=int, default=8, help='同時に接続するクライアント（セッション）数')
+    parser.add_argument('--requests', type=int, default=10, help='クライアントごとのリクエスト数')
+    parser.add_argument('--latency', type=float, default=0.2, help='フェイクバックエンドの遅延（秒）')
+    parser.add_argument('--max-concurrency', type=int, default=8, help='サーバー全体の上流同時リクエスト数の上限')
+    parser.add_argument('--session-max-concurrency', type=int, default=0,
+                        help='セッションごとの上流同時リクエスト数の上限（0は無制限）')
+    parser.add_argument('--repeat-payloads', action='store_true',
+                        help='すべてのクライアントで同じペイロードを送信する（セッション間のキャッシュ共有を計測）')
+    parser.add_argument('--output', default='bench_http.json', help='結果を保存するJSONファイル')
+    args = parser.parse_args()
+
+    port = free_port()
+    env = dict(os.environ)
+    env.update({
+        'DIVE_DEEP_BACKEND': 'fake',
+        'DIVE_DEEP_FAKE_LATENCY': str(args.latency),
+        'DIVE_DEEP_FAKE_TOKENS_PER_SECOND': '2000',
+        'DIVE_DEEP_TRANSPORT': args.transport,
+        'DIVE_DEEP_HTTP_PORT': str(port),
+        'DIVE_DEEP_MAX_CONCURRENCY': str(args.max_concurrency),
+        'DIVE_DEEP_SESSION_MAX_CONCURRENCY': str(args.session_max_concurrency),
+    })
+    if not args.repeat_payloads:
+        env['DIVE_DEEP_CACHE_ENABLED'] = '0'
+
+    with open(os.devnull, 'w') as devnull:
+        server = subprocess.Popen(
+            [sys.executable, SERVER_PATH], env=env, stdout=devnull, stderr=devnull
+        )
+        try:
+            wait_for_port(port)
+            results = asyncio.run(run_load(args, port))
+            results['peak_rss_kb'] = peak_rss_kb(server.pid)
+        finally:
+            server.terminate()
+            server.wait(timeout=10)
+
+    latency = results['latency_seconds']
+    print(
+        f"{args.transport} {args.clients} clients: p50={latency['p50']}s p95={latency['p95']}s "
+        f"p99={latency['p99']}s throughput={results['throughput_rps']} req/s "
+        f"errors={results['errors']} cache_hits={results['cache_stats'].get('hits')} "
+        f"upstream_sessions={results['sessions_stats']['total_sessions']}"
+    )
+    write_results(args.output, 'http', vars(args), results)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,149 @@
+"""ロギングのマイクロベンチマーク
+
+ツール呼び出し1回分のログ出力（開始ログ、指示文、ファイル数）について、
+従来の設定（同期シンク・f-stringで全文を出力）と現在の logger_config の設定
+（バックグラウンドスレッドで書き込むシンク・切り詰めたペイロード・遅延フォーマット）の
+呼び出し側のオーバーヘッドを比較します。
+
+使用例:
+    python benchmarks/bench_logging.py --calls 2000 --payload-kb 50
+"""
+
+import argparse
+import os
+import sys
+import tempfile
+import time
+from datetime import datetime
+from typing import Any, Callable, Dict
+
+from loguru import logger
+
+from common import load_samples, write_results
+
+import logger_config
+
+
+def legacy_setup(log_dir: str) -> None:
+    """変更前の LoggerConfig.setup_logger と同じ設定（同期シンク）を行います"""
+    logger.remove()
+    logger.add(
+        sys.stderr,
+        format="<green>{time:YYYY-MM-DD HH:mm:ss}</green> | <level>{level: <8}</level> | <cyan>{name}</cyan>:<cyan>{function}</cyan>:<cyan>{line}</cyan> - <level>{message}</level>",
+        level="INFO"
+    )
+    logger.add(
+        os.path.join(log_dir, f"legacy_{datetime.now().strftime('%Y%m%d')}.log"),
+        rotation="00:00",
+        retention="30 days",
+        format="{time:YYYY-MM-DD HH:mm:ss} | {level: <8} | {name}:{function}:{line} - {message}",
+        level="DEBUG",
+        encoding="utf-8"
+    )
+
+
+def current_setup(log_dir: str) -> None:
+    """現在の logger_config の設定を行います"""
+    config = logger_config.LoggerConfig("current")
+    config.log_dir = log_dir
+    config.setup_logger()
+
+
+def legacy_call(model: str, instructions: str, code: list) -> None:
+    logger.info(f"Starting final_review_agent with model: {model}")
+    logger.debug(f"Instructions: {instructions}")
+    logger.debug(f"Number of code files: {len(code)}")
+
+
+def current_call(model: str, instructions: str, code: list) -> None:
+    logger.info("Starting final_review_agent with model: {}", model)
+    logger.debug("Instructions: {instructions}", instructions=logger_config.payload(instructions))
+    logger.debug("Number of code files: {}", len(code))
+
+
+def run(
+    setup: Callable[[str], None],
+    call: Callable[..., None],
+    calls: int,
+    instructions: str,
+    code: list
+) -> Dict[str, Any]:
+    with tempfile.TemporaryDirectory() as log_dir:
+        setup(log_dir)
+        started = time.perf_counter()
+        for _ in range(calls):
+            call("gemini-2.0-flash", instructions, code)
+        caller_seconds = time.perf_counter() - started
+        # キューに残っているログの書き込み完了まで待つ
+        logger.complete()
+        logger.remove()
+        total_seconds = time.perf_counter() - started
+        log_bytes = sum(
+            os.path.getsize(os.path.join(log_dir, name)) for name in os.listdir(log_dir)
+        )
+    return {
+        'per_call_us': round(caller_seconds / calls * 1e6, 2),
+        'total_seconds_including_drain': round(total_seconds, 4),
+        'log_bytes': log_bytes,
+    }
+
+
+def run_get_logger(calls: int) -> Dict[str, Any]:
+    """get_logger を繰り返し呼んだときの1回あたりのコストを計測します"""
+    results = {}
+    with tempfile.TemporaryDirectory() as log_dir:
+        started = time.perf_counter()
+        for _ in range(calls):
+            legacy_setup(log_dir)
+        results['legacy_per_call_us'] = round((time.perf_counter() - started) / calls * 1e6, 2)
+        logger.remove()
+
+        logger_config._configured_app = None
+        started = time.perf_counter()
+        for _ in range(calls):
+            logger_config.get_logger("bench_get_logger")
+        results['current_per_call_us'] = round((time.perf_counter() - started) / calls * 1e6, 2)
+        logger.complete()
+        logger.remove()
+    return results
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--calls', type=int, default=2000, help='ツール呼び出しの回数')
+    parser.add_argument('--payload-kb', type=int, default=50, help='指示文のサイズ（KB）')
+    parser.add_argument('--output', default='bench_logging.json', help='結果を保存するJSONファイル')
+    args = parser.parse_args()
+
+    samples = load_samples()
+    text = "\n".join(t for files in samples['variants'].values() for _, t in files)
+    instructions = (text * (args.payload_kb * 1024 // len(text) + 1))[:args.payload_kb * 1024]
+    code = [t for _, t in next(iter(samples['variants'].values()))]
+
+    stderr = sys.stderr
+    sys.stderr = open(os.devnull, 'w')
+    try:
+        results = {
+            'before': run(legacy_setup, legacy_call, args.calls, instructions, code),
+            'after': run(current_setup, current_call, args.calls, instructions, code),
+            'get_logger': run_get_logger(min(args.calls, 200)),
+        }
+    finally:
+        sys.stderr.close()
+        sys.stderr = stderr
+
+    for name in ('before', 'after'):
+        r = results[name]
+        print(
+            f"{name:<7} per call: {r['per_call_us']} us, "
+            f"total incl. drain: {r['total_seconds_including_drain']} s, log bytes: {r['log_bytes']}"
+        )
+    print(
+        f"get_logger per call: before {results['get_logger']['legacy_per_call_us']} us, "
+        f"after {results['get_logger']['current_per_call_us']} us"
+    )
+    write_results(args.output, 'logging', vars(args), results)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,120 @@
+"""モデルルーティングとヘッジリクエストのレイテンシの計測
+
+一定の割合で応答が大きく遅れるフェイクバックエンド（DIVE_DEEP_FAKE_TAIL_RATE）を使い、
+modelを省略したdeep_thinking_agentの呼び出しを、ヘッジなしのルートとヘッジありの
+ルートでそれぞれ実行してレイテンシのパーセンタイルを比較します。ヘッジありの
+計測では、ヘッジを送った割合と、ヘッジ側が先に応答した割合も出力します。
+
+使用例:
+    python benchmarks/bench_routing.py --requests 400 --tail-rate 0.03 --output bench_routing.json
+"""
+
+import argparse
+import asyncio
+import os
+import time
+from typing import Any, Dict, List
+
+from common import latency_summary, write_results
+
+from bench_tools import build_payloads
+
+TOOL = 'deep_thinking_agent'
+
+
+async def measure(server: Any, payloads: List[Dict[str, Any]], concurrency: int) -> Dict[str, Any]:
+    """payloadsを同時実行数concurrencyで実行し、レイテンシの集計を返します"""
+    semaphore = asyncio.Semaphore(concurrency)
+    latencies: List[float] = []
+    errors = 0
+
+    async def call(arguments: Dict[str, Any]) -> None:
+        nonlocal errors
+        async with semaphore:
+            started = time.perf_counter()
+            result = await server.deep_thinking_agent(**arguments)
+            if result.get('isError'):
+                errors += 1
+            else:
+                latencies.append(time.perf_counter() - started)
+
+    started = time.perf_counter()
+    await asyncio.gather(*(call(arguments) for arguments in payloads))
+    return latency_summary(latencies, time.perf_counter() - started, errors)
+
+
+async def run(args: argparse.Namespace) -> Dict[str, Any]:
+    import dive_deep_server as server
+    from model_router import ModelRouter, Route
+
+    payloads = build_payloads(TOOL, args.requests, unique=True)
+    scenarios = {
+        'single_model': [Route('thinking', args.model, tools=[TOOL])],
+        'hedged': [Route(
+            'thinking', args.model, tools=[TOOL],
+            hedge_model=args.hedge_model,
+            hedge_after=args.hedge_after,
+            hedge_quantile=args.hedge_quantile,
+            max_hedge_ratio=args.max_hedge_ratio,
+        )],
+    }
+    results: Dict[str, Any] = {}
+    for name, routes in scenarios.items():
+        server.model_router = ModelRouter(routes, server.DEFAULT_MODEL)
+        # 計測の前にルートのレイテンシを観測させ、分位点からヘッジまでの秒数を決められるようにする
+        warmup = [{**arguments, 'instructions': f"warmup {i}\n" + arguments['instructions']}
+                  for i, arguments in enumerate(payloads[:args.warmup])]
+        await measure(server, warmup, args.concurrency)
+        summary = await measure(server, payloads, args.concurrency)
+        route = server.model_router.stats()['routes'][0]
+        requests = route['requests'] - len(warmup)
+        summary['hedge_delay_seconds'] = route['hedge_delay_seconds']
+        summary['hedged_ratio'] = round(route['hedged'] / route['requests'], 4)
+        summary['hedge_win_ratio'] = round(route['hedge_wins'] / route['requests'], 4)
+        results[name] = summary
+        latency = summary['latency_seconds']
+        print(
+            f"{name:<13} {requests} requests: p50 {latency['p50']}s, p95 {latency['p95']}s, "
+            f"p99 {latency['p99']}s, max {latency['max']}s, hedged {summary['hedged_ratio']:.1%}, "
+            f"hedge won {summary['hedge_win_ratio']:.1%}"
+        )
+    baseline = results['single_model']['latency_seconds']['p99']
+    hedged = results['hedged']['latency_seconds']['p99']
+    results['p99_reduction'] = round(1 - hedged / baseline, 4) if baseline else None
+    print(f"p99 reduced by {results['p99_reduction']:.1%}")
+    return results
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--requests', type=int, default=400, help='シナリオごとのリクエスト数')
+    parser.add_argument('--warmup', type=int, default=40, help='計測前に実行するリクエスト数')
+    parser.add_argument('--concurrency', type=int, default=16, help='同時に実行するリクエスト数')
+    parser.add_argument('--latency', type=float, default=0.3, help='最初のトークンまでの通常の秒数')
+    parser.add_argument('--tail-rate', type=float, default=0.03, help='応答が遅れる呼び出しの割合')
+    parser.add_argument('--tail-latency', type=float, default=5.0, help='遅れる呼び出しに加わる秒数')
+    parser.add_argument('--model', default='gemini-2.0-flash', help='最初に送るモデル')
+    parser.add_argument('--hedge-model', default='gemini-2.0-flash-lite', help='ヘッジを送るモデル')
+    parser.add_argument('--hedge-after', type=float, default=1.0, help='観測値が揃うまでのヘッジまでの秒数')
+    parser.add_argument('--hedge-quantile', type=float, default=0.95, help='ヘッジまでの秒数に使う分位点')
+    parser.add_argument('--max-hedge-ratio', type=float, default=0.1, help='ヘッジを送る割合の上限')
+    parser.add_argument('--output', default='bench_routing.json', help='結果を保存するJSONファイル')
+    args = parser.parse_args()
+
+    os.environ.update({
+        'DIVE_DEEP_BACKEND': 'fake',
+        'DIVE_DEEP_FAKE_LATENCY': str(args.latency),
+        'DIVE_DEEP_FAKE_TAIL_RATE': str(args.tail_rate),
+        'DIVE_DEEP_FAKE_TAIL_LATENCY': str(args.tail_latency),
+        'DIVE_DEEP_FAKE_OUTPUT_TOKENS': '50',
+        'DIVE_DEEP_FAKE_TOKENS_PER_SECOND': '5000',
+        'DIVE_DEEP_MAX_CONCURRENCY': str(args.concurrency * 2),
+        'DIVE_DEEP_CACHE_ENABLED': '0',
+        'DIVE_DEEP_LOG_LEVEL': 'WARNING',
+    })
+    results = asyncio.run(run(args))
+    write_results(args.output, 'routing', vars(args), results)
+
+
+if __name__ == '__main__':
+    main()
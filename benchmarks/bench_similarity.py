@@ -0,0 +1,130 @@
+"""類似キャッシュのベンチマーク
+
+SimilarityCacheに合成したリクエスト（既定で10万件）を登録し、登録時間、
+数語だけ変えたリクエスト（ヒットするべき検索）と無関係なリクエスト
+（ミスするべき検索）の検索レイテンシ、再現率、誤ヒット率、メモリ使用量を計測します。
+署名の計算時間は検索とは別に計測します。
+
+使用例:
+    python benchmarks/bench_similarity.py --entries 100000 --output bench_similarity.json
+"""
+
+import argparse
+import random
+import time
+import tracemalloc
+from typing import Any, Dict, List
+
+from common import percentile, write_results
+
+from similarity_cache import SimilarityCache, signature
+
+SCOPE = "deep_thinking_agent"
+
+
+def make_text(rng: random.Random, vocabulary: List[str], words: int) -> str:
+    return ' '.join(rng.choice(vocabulary) for _ in range(words))
+
+
+def perturb(rng: random.Random, vocabulary: List[str], text: str, changes: int) -> str:
+    words = text.split()
+    for index in rng.sample(range(len(words)), changes):
+        words[index] = rng.choice(vocabulary)
+    return ' '.join(words)
+
+
+def summary_us(values: List[float]) -> Dict[str, Any]:
+    return {
+        name: round(percentile(values, pct) * 1e6, 1)
+        for name, pct in (('p50', 50), ('p95', 95), ('p99', 99), ('max', 100))
+    }
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--entries', type=int, default=100000, help='登録するエントリ数')
+    parser.add_argument('--queries', type=int, default=2000, help='ヒット・ミスそれぞれの検索回数')
+    parser.add_argument('--words', type=int, default=200, help='1リクエストあたりの単語数')
+    parser.add_argument('--changes', type=int, default=2, help='ヒットするべき検索で変更する単語数')
+    parser.add_argument('--threshold', type=float, default=0.9, help='類似度の閾値')
+    parser.add_argument('--seed', type=int, default=0)
+    parser.add_argument('--output', default='bench_similarity.json', help='結果を保存するJSONファイル')
+    args = parser.parse_args()
+
+    rng = random.Random(args.seed)
+    vocabulary = [f"word{i}" for i in range(20000)]
+    texts = [make_text(rng, vocabulary, args.words) for _ in range(args.entries)]
+
+    started = time.perf_counter()
+    signatures = [signature(text) for text in texts]
+    signature_us = (time.perf_counter() - started) / len(texts) * 1e6
+
+    def build() -> SimilarityCache:
+        cache = SimilarityCache(threshold=args.threshold, max_entries=args.entries, max_bytes=1 << 40)
+        for index, sig in enumerate(signatures):
+            cache.add_signature(SCOPE, sig, f"response {index}")
+        return cache
+
+    # 登録時間とメモリ使用量はtracemallocのオーバーヘッドを避けるため別々に計測する
+    tracemalloc.start()
+    measured = build()
+    memory_bytes, _ = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    del measured
+    started = time.perf_counter()
+    cache = build()
+    insert_us = (time.perf_counter() - started) / len(texts) * 1e6
+
+    near = [
+        (index, signature(perturb(rng, vocabulary, texts[index], args.changes)))
+        for index in rng.sample(range(args.entries), min(args.queries, args.entries))
+    ]
+    unrelated = [signature(make_text(rng, vocabulary, args.words)) for _ in range(args.queries)]
+
+    hit_latencies: List[float] = []
+    recalled = 0
+    for index, sig in near:
+        started = time.perf_counter()
+        hit = cache.lookup_signature(SCOPE, sig)
+        hit_latencies.append(time.perf_counter() - started)
+        if hit is not None and hit[0] == f"response {index}":
+            recalled += 1
+    miss_latencies: List[float] = []
+    false_hits = 0
+    for sig in unrelated:
+        started = time.perf_counter()
+        if cache.lookup_signature(SCOPE, sig) is not None:
+            false_hits += 1
+        miss_latencies.append(time.perf_counter() - started)
+
+    stats = cache.stats()
+    results = {
+        'signature_us': round(signature_us, 1),
+        'insert_us': round(insert_us, 1),
+        'index_memory_mb': round(memory_bytes / 1024 / 1024, 1),
+        'near_duplicate_lookup_us': summary_us(hit_latencies),
+        'unrelated_lookup_us': summary_us(miss_latencies),
+        'recall': round(recalled / len(near), 4),
+        'false_hit_rate': round(false_hits / len(unrelated), 4),
+        'mean_candidates': round(stats['mean_candidates'], 1),
+        'bands': stats['bands'],
+    }
+    print(
+        f"{args.entries} entries, threshold {args.threshold} ({stats['bands']} bands): "
+        f"signature {results['signature_us']}us, insert {results['insert_us']}us, "
+        f"index memory {results['index_memory_mb']}MB"
+    )
+    print(
+        f"near-duplicate lookup p50/p99: {results['near_duplicate_lookup_us']['p50']}/"
+        f"{results['near_duplicate_lookup_us']['p99']}us, recall {results['recall']:.1%}"
+    )
+    print(
+        f"unrelated lookup p50/p99: {results['unrelated_lookup_us']['p50']}/"
+        f"{results['unrelated_lookup_us']['p99']}us, false hits {results['false_hit_rate']:.2%}, "
+        f"mean candidates {results['mean_candidates']}"
+    )
+    write_results(args.output, 'similarity', vars(args), results)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,90 @@
+"""サーバーの起動時間のベンチマーク
+
+エディタがstdioのサブプロセスとしてサーバーを起動してから、initializeの応答を
+受け取るまでの時間を計測します。フェイクバックエンドでは、続けて最初のツール呼び出しが
+完了するまでの時間（バックエンドの遅延生成を含む）も計測します。
+
+geminiバックエンドはクライアントの生成だけを行うため、ダミーのAPIキーで計測でき、
+ツール呼び出しは行いません。
+
+使用例:
+    python benchmarks/bench_startup.py --runs 10 --backends gemini fake --output bench_startup.json
+"""
+
+import argparse
+import asyncio
+import os
+import sys
+import time
+from typing import Any, Dict, List
+
+from mcp import ClientSession, StdioServerParameters
+from mcp.client.stdio import stdio_client
+
+from common import SERVER_PATH, percentile, write_results
+
+BACKENDS = ['gemini', 'fake']
+
+
+async def measure_once(env: Dict[str, str], call_tool: bool) -> Dict[str, float]:
+    """サーバーを1回起動し、initializeと最初のツール呼び出しまでの時間を返します"""
+    params = StdioServerParameters(command=sys.executable, args=[SERVER_PATH], env=env)
+    timings = {}
+    with open(os.devnull, 'w') as errlog:
+        started = time.perf_counter()
+        async with stdio_client(params, errlog=errlog) as (read, write):
+            async with ClientSession(read, write) as session:
+                await session.initialize()
+                timings['initialize'] = time.perf_counter() - started
+                if call_tool:
+                    await session.call_tool(
+                        'deep_thinking_agent', {'instructions': 'startup', 'context': 'startup'}
+                    )
+                    timings['first_call'] = time.perf_counter() - started
+    return timings
+
+
+def summarize(values: List[float]) -> Dict[str, Any]:
+    return {
+        'mean': round(sum(values) / len(values), 4),
+        'p50': round(percentile(values, 50), 4),
+        'min': round(min(values), 4),
+        'max': round(max(values), 4),
+    }
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--backends', nargs='+', default=BACKENDS, choices=BACKENDS)
+    parser.add_argument('--runs', type=int, default=10, help='バックエンドごとの起動回数')
+    parser.add_argument('--warmup', action='store_true',
+                        help='DIVE_DEEP_WARMUP=1でバックグラウンドのウォームアップを有効にする')
+    parser.add_argument('--output', default='bench_startup.json', help='結果を保存するJSONファイル')
+    args = parser.parse_args()
+
+    results = {}
+    for backend in args.backends:
+        env = dict(os.environ)
+        env.update({
+            'DIVE_DEEP_BACKEND': backend,
+            'DIVE_DEEP_FAKE_LATENCY': '0',
+            'DIVE_DEEP_FAKE_TOKENS_PER_SECOND': '1000000',
+            'DIVE_DEEP_WARMUP': '1' if args.warmup else '0',
+        })
+        env.setdefault('GEMINI_API_KEY', 'bench-startup-dummy-key')
+        runs = [asyncio.run(measure_once(env, backend == 'fake')) for _ in range(args.runs)]
+        results[backend] = {
+            name: summarize([run[name] for run in runs])
+            for name in runs[0]
+        }
+        line = ' '.join(
+            f"{name}: p50={summary['p50']}s mean={summary['mean']}s"
+            for name, summary in results[backend].items()
+        )
+        print(f"{backend:<7} {line}")
+
+    write_results(args.output, 'startup', vars(args), results)
+
+
+if __name__ == '__main__':
+    main()
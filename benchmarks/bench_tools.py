@@ -0,0 +1,146 @@
+"""MCPツールのスループット・レイテンシのベンチマーク
+
+サーバーをstdioのサブプロセスとして起動し、フェイクのモデルバックエンドに対して
+複数の同時クライアントからツールを呼び出します。ペイロードは
+tool_execution_result/case1 のサンプルファイルから生成し、ツールごとに
+p50/p95/p99レイテンシ、スループット、サーバーのピークRSSを計測して
+JSONで保存します。
+
+使用例:
+    python benchmarks/bench_tools.py --clients 16 --requests 20 --output bench_tools.json
+"""
+
+import argparse
+import asyncio
+import os
+import sys
+import time
+from typing import Any, Dict, List
+
+from mcp import ClientSession, StdioServerParameters
+from mcp.client.stdio import stdio_client
+
+from common import (
+    SERVER_PATH,
+    latency_summary,
+    load_samples,
+    find_child_pids,
+    peak_rss_kb,
+    write_results,
+)
+
+TOOLS = [
+    'deep_thinking_agent', 'enhancement_agent', 'final_review_agent', 'dive_deep_pipeline',
+    'batch_review',
+]
+
+
+def build_payloads(tool: str, count: int, unique: bool) -> List[Dict[str, Any]]:
+    """サンプルファイルからツールの引数を生成します
+
+    uniqueがTrueの場合は指示文に連番を付け、キャッシュや合流が効かないようにします。
+    """
+    samples = load_samples()
+    variants = list(samples['variants'].items())
+    payloads = []
+    for i in range(count):
+        variant, files = variants[i % len(variants)]
+        instructions = samples['instructions']
+        if unique:
+            instructions += f"\n(request {i})"
+        code = [text for _, text in files]
+        context = (
+            f"Plan for '{variant}': build the page from these files: "
+            + ", ".join(path for path, _ in files)
+        )
+        if tool == 'deep_thinking_agent':
+            payloads.append({'instructions': instructions, 'context': context})
+        elif tool == 'dive_deep_pipeline':
+            payloads.append({'instructions': instructions, 'code': code, 'context': context})
+        elif tool == 'batch_review':
+            # 1ファイルを1ジョブとして、バリアントのファイルをまとめてレビューする
+            payloads.append({'jobs': [
+                {'id': path, 'instructions': instructions, 'code': [text]} for path, text in files
+            ]})
+        else:
+            payloads.append({'instructions': instructions, 'code': code})
+    return payloads
+
+
+async def bench_tool(tool: str, args: argparse.Namespace, env: Dict[str, str]) -> Dict[str, Any]:
+    """1つのツールについてサーバーを起動し、同時クライアントから呼び出します"""
+    params = StdioServerParameters(command=sys.executable, args=[SERVER_PATH], env=env)
+    payloads = build_payloads(tool, args.clients * args.requests, not args.repeat_payloads)
+    latencies: List[float] = []
+    errors = 0
+
+    with open(os.devnull, 'w') as errlog:
+        async with stdio_client(params, errlog=errlog) as (read, write):
+            async with ClientSession(read, write) as session:
+                await session.initialize()
+                server_pids = find_child_pids(SERVER_PATH)
+
+                async def client(index: int) -> None:
+                    nonlocal errors
+                    for n in range(args.requests):
+                        payload = payloads[index * args.requests + n]
+                        started = time.perf_counter()
+                        result = await session.call_tool(tool, payload)
+                        if result.isError or '"isError": true' in result.content[0].text:
+                            errors += 1
+                        else:
+                            latencies.append(time.perf_counter() - started)
+
+                started = time.perf_counter()
+                await asyncio.gather(*(client(i) for i in range(args.clients)))
+                elapsed = time.perf_counter() - started
+                rss = [peak_rss_kb(pid) for pid in server_pids]
+
+    summary = latency_summary(latencies, elapsed, errors)
+    summary['peak_rss_kb'] = max((r for r in rss if r is not None), default=None)
+    return summary
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--tools', nargs='+', default=TOOLS, choices=TOOLS)
+    parser.add_argument('--clients', type=int, default=8, help='同時クライアント数')
+    parser.add_argument('--requests', type=int, default=10, help='クライアントごとのリクエスト数')
+    parser.add_argument('--latency', type=float, default=0.2, help='フェイクバックエンドの遅延（秒）')
+    parser.add_argument('--tokens-per-second', type=float, default=2000)
+    parser.add_argument('--output-tokens', type=int, default=300)
+    parser.add_argument('--error-rate', type=float, default=0.0)
+    parser.add_argument('--max-concurrency', type=int, default=8, help='サーバーの同時リクエスト数の上限')
+    parser.add_argument('--repeat-payloads', action='store_true',
+                        help='同じペイロードを繰り返し送信する（キャッシュ・合流を含めて計測）')
+    parser.add_argument('--output', default='bench_tools.json', help='結果を保存するJSONファイル')
+    args = parser.parse_args()
+
+    env = dict(os.environ)
+    env.update({
+        'DIVE_DEEP_BACKEND': 'fake',
+        'DIVE_DEEP_FAKE_LATENCY': str(args.latency),
+        'DIVE_DEEP_FAKE_TOKENS_PER_SECOND': str(args.tokens_per_second),
+        'DIVE_DEEP_FAKE_OUTPUT_TOKENS': str(args.output_tokens),
+        'DIVE_DEEP_FAKE_ERROR_RATE': str(args.error_rate),
+        'DIVE_DEEP_MAX_CONCURRENCY': str(args.max_concurrency),
+        'DIVE_DEEP_RETRY_BASE_DELAY': '0.05',
+    })
+    if not args.repeat_payloads:
+        env['DIVE_DEEP_CACHE_ENABLED'] = '0'
+
+    results = {}
+    for tool in args.tools:
+        results[tool] = asyncio.run(bench_tool(tool, args, env))
+        latency = results[tool]['latency_seconds']
+        print(
+            f"{tool:<22} p50={latency['p50']}s p95={latency['p95']}s p99={latency['p99']}s "
+            f"throughput={results[tool]['throughput_rps']} req/s "
+            f"errors={results[tool]['errors']} peak_rss={results[tool]['peak_rss_kb']} KB"
+        )
+
+    write_results(args.output, 'tools', vars(args), results)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,155 @@
+"""ベンチマーク共通ユーティリティ
+
+tool_execution_result のサンプルからのペイロード生成、パーセンタイル計算、
+子プロセスのピークRSS取得、結果のJSON保存をまとめています。
+"""
+
+import json
+import os
+import platform
+import subprocess
+import sys
+from datetime import datetime
+from typing import Any, Dict, List, Optional
+
+ROOT_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+SERVER_PATH = os.path.join(ROOT_DIR, "dive_deep_server.py")
+SAMPLES_DIR = os.path.join(ROOT_DIR, "tool_execution_result", "case1")
+
+if ROOT_DIR not in sys.path:
+    sys.path.insert(0, ROOT_DIR)
+
+
+def load_samples() -> Dict[str, Any]:
+    """サンプルのタスク説明と、実行結果フォルダごとのファイルを読み込みます
+
+    Returns:
+        instructions: test_info.txt の内容
+        variants: {フォルダ名: [(相対パス, ファイル内容), ...]}
+    """
+    with open(os.path.join(SAMPLES_DIR, "test_info.txt"), encoding="utf-8") as f:
+        instructions = f.read()
+
+    variants: Dict[str, List[Any]] = {}
+    for variant in sorted(os.listdir(SAMPLES_DIR)):
+        variant_dir = os.path.join(SAMPLES_DIR, variant)
+        if not os.path.isdir(variant_dir):
+            continue
+        files = []
+        for dirpath, _, filenames in os.walk(variant_dir):
+            for filename in sorted(filenames):
+                path = os.path.join(dirpath, filename)
+                with open(path, encoding="utf-8") as f:
+                    files.append((os.path.relpath(path, variant_dir), f.read()))
+        variants[variant] = sorted(files)
+    return {'instructions': instructions, 'variants': variants}
+
+
+def percentile(values: List[float], pct: float) -> Optional[float]:
+    """線形補間でパーセンタイルを計算します"""
+    if not values:
+        return None
+    ordered = sorted(values)
+    rank = (len(ordered) - 1) * pct / 100
+    lower = int(rank)
+    upper = min(lower + 1, len(ordered) - 1)
+    return ordered[lower] + (ordered[upper] - ordered[lower]) * (rank - lower)
+
+
+def latency_summary(latencies: List[float], elapsed: float, errors: int = 0) -> Dict[str, Any]:
+    """レイテンシのパーセンタイルとスループットをまとめます"""
+    return {
+        'requests': len(latencies) + errors,
+        'errors': errors,
+        'elapsed_seconds': round(elapsed, 4),
+        'throughput_rps': round(len(latencies) / elapsed, 3) if elapsed else None,
+        'latency_seconds': {
+            'mean': round(sum(latencies) / len(latencies), 4) if latencies else None,
+            'p50': _round(percentile(latencies, 50)),
+            'p95': _round(percentile(latencies, 95)),
+            'p99': _round(percentile(latencies, 99)),
+            'max': _round(max(latencies) if latencies else None),
+        },
+    }
+
+
+def _round(value: Optional[float]) -> Optional[float]:
+    return round(value, 4) if value is not None else None
+
+
+def find_child_pids(cmdline_fragment: str) -> List[int]:
+    """コマンドラインにcmdline_fragmentを含む、このプロセスの子孫プロセスを探します（Linuxのみ）"""
+    parents = {os.getpid()}
+    found: List[int] = []
+    try:
+        entries = [int(pid) for pid in os.listdir('/proc') if pid.isdigit()]
+    except OSError:
+        return found
+    # /proc/<pid>/stat の4番目のフィールドが親プロセスID
+    ppids: Dict[int, int] = {}
+    for pid in entries:
+        try:
+            with open(f'/proc/{pid}/stat') as f:
+                ppids[pid] = int(f.read().rsplit(')', 1)[1].split()[1])
+        except (OSError, IndexError, ValueError):
+            continue
+    changed = True
+    while changed:
+        changed = False
+        for pid, ppid in ppids.items():
+            if ppid in parents and pid not in parents:
+                parents.add(pid)
+                changed = True
+    for pid in parents - {os.getpid()}:
+        try:
+            with open(f'/proc/{pid}/cmdline', 'rb') as f:
+                cmdline = f.read().replace(b'\0', b' ').decode(errors='replace')
+        except OSError:
+            continue
+        if cmdline_fragment in cmdline:
+            found.append(pid)
+    return found
+
+
+def peak_rss_kb(pid: int) -> Optional[int]:
+    """プロセスのピークRSS（VmHWM, KB）を返します（Linuxのみ）"""
+    try:
+        with open(f'/proc/{pid}/status') as f:
+            for line in f:
+                if line.startswith('VmHWM:'):
+                    return int(line.split()[1])
+    except OSError:
+        return None
+    return None
+
+
+def environment_info() -> Dict[str, Any]:
+    """結果の比較に使う実行環境とリビジョンの情報を返します"""
+    try:
+        revision = subprocess.run(
+            ['git', 'rev-parse', '--short', 'HEAD'],
+            cwd=ROOT_DIR, capture_output=True, text=True, timeout=10,
+        ).stdout.strip() or None
+    except (OSError, subprocess.SubprocessError):
+        revision = None
+    return {
+        'timestamp': datetime.now().isoformat(timespec='seconds'),
+        'revision': revision,
+        'python': platform.python_version(),
+        'platform': platform.platform(),
+        'cpu_count': os.cpu_count(),
+    }
+
+
+def write_results(path: str, name: str, config: Dict[str, Any], results: Dict[str, Any]) -> None:
+    """ベンチマーク結果をJSONで保存します"""
+    directory = os.path.dirname(os.path.abspath(path))
+    os.makedirs(directory, exist_ok=True)
+    with open(path, 'w', encoding='utf-8') as f:
+        json.dump({
+            'benchmark': name,
+            'environment': environment_info(),
+            'config': config,
+            'results': results,
+        }, f, ensure_ascii=False, indent=2)
+    print(f"Results written to {path}")
@@ -0,0 +1,231 @@
+"""記録したトレースの再生
+
+DIVE_DEEP_TRACE_DIRに記録したツール呼び出しを、フェイクのモデルバックエンドを
+使うサーバーに対してインメモリのMCPクライアントから同じ引数で呼び出し、本番の
+負荷を再現します。既定では記録時の呼び出し間隔を保ち（--speedで速度を変更）、
+--speed 0では間隔を無視して同時実行数--concurrencyで実行します。同じsession_idの
+呼び出しは、いずれの場合も記録順に1つずつ実行します。`sha256:`の参照で指定された
+ファイルを解決できるよう、再生の前にトレース全体で全文が送られたファイルをサーバーの
+ブロブストアに登録します。ツールごとのレイテンシを記録時の所要時間と並べて出力します。
+--listでは再生せずにインデックスの内容（ブロックごとの時間範囲とツールごとの件数）を
+出力します。
+
+使用例:
+    python benchmarks/replay_traces.py ~/.dive-deep/traces --list
+    python benchmarks/replay_traces.py ~/.dive-deep/traces --since 2026-10-18T09:00 --speed 2
+    python benchmarks/replay_traces.py ~/.dive-deep/traces --tool final_review_agent --speed 0
+"""
+
+import argparse
+import asyncio
+import os
+import time
+from datetime import datetime
+from typing import Any, Dict, List, Optional
+
+from common import latency_summary, percentile, write_results
+
+from blob_store import is_blob_ref
+from trace_store import load_index, read_traces
+
+
+def parse_time(value: Optional[str]) -> Optional[float]:
+    """エポック秒またはISO 8601形式の日時をエポック秒に変換します"""
+    if value is None:
+        return None
+    try:
+        return float(value)
+    except ValueError:
+        return datetime.fromisoformat(value).timestamp()
+
+
+def list_blocks(directory: str) -> None:
+    blocks = load_index(directory)
+    tools: Dict[str, int] = {}
+    for block in blocks:
+        start = datetime.fromtimestamp(block.start).isoformat(timespec='seconds')
+        end = datetime.fromtimestamp(block.end).isoformat(timespec='seconds')
+        print(f"{block.segment} @{block.offset:<9} {start} - {end} {block.count:>5} records {block.tools}")
+        for tool, count in block.tools.items():
+            tools[tool] = tools.get(tool, 0) + count
+    print(f"{len(blocks)} blocks, {sum(tools.values())} records: {tools}")
+
+
+def recorded_code(record: Dict[str, Any]) -> List[str]:
+    """レコードの入力に含まれるファイル（batch_reviewのジョブを含む）を返します"""
+    inputs = record.get('inputs') or {}
+    code = list(inputs.get('code') or [])
+    for job in inputs.get('jobs') or []:
+        code.extend(job.get('code') or [])
+    return code
+
+
+def seed_blobs(server: Any, directory: str) -> int:
+    """トレース全体で全文が送られたファイルをブロブストアに登録し、登録した数を返します
+
+    再生する範囲より前の呼び出しで送られたファイルも、参照で指定した呼び出しから解決できます。
+    """
+    refs = set()
+    for record in read_traces(directory):
+        for text in recorded_code(record):
+            if isinstance(text, str) and not is_blob_ref(text):
+                refs.add(server.blob_store.put(text))
+    return len(refs)
+
+
+async def replay(records: List[Dict[str, Any]], speed: float, concurrency: int) -> Dict[str, Any]:
+    """レコードを再生し、ツールごとのレイテンシの集計を返します
+
+    同じsession_idのレコードは、直前のレコードの呼び出しが終わってから呼び出します。
+    """
+    import dive_deep_server as server
+    from mcp.shared.memory import create_connected_server_and_client_session
+
+    semaphore = asyncio.Semaphore(concurrency)
+    latencies: Dict[str, List[float]] = {}
+    errors: Dict[str, int] = {}
+    # 記録時の時刻に対して呼び出しが遅れた秒数（再生側が負荷に追いついているかの目安）
+    lags: List[float] = []
+
+    async with create_connected_server_and_client_session(server.mcp._mcp_server) as session:
+        async def call(
+            record: Dict[str, Any],
+            at: Optional[float],
+            after: Optional["asyncio.Future[None]"]
+        ) -> None:
+            tool = record['tool']
+            if at is not None:
+                await asyncio.sleep(max(at - time.perf_counter(), 0))
+            if after is not None:
+                # セッションの状態は前の呼び出しの結果に依存するため、記録順を保つ
+                await asyncio.wait([after])
+            if at is not None:
+                lags.append(time.perf_counter() - at)
+                started = time.perf_counter()
+                result = await session.call_tool(tool, record['inputs'])
+            else:
+                async with semaphore:
+                    started = time.perf_counter()
+                    result = await session.call_tool(tool, record['inputs'])
+            if result.isError or '"isError": true' in result.content[0].text:
+                errors[tool] = errors.get(tool, 0) + 1
+            else:
+                latencies.setdefault(tool, []).append(time.perf_counter() - started)
+
+        started = time.perf_counter()
+        first = records[0]['ts']
+        tasks: List["asyncio.Future[None]"] = []
+        previous: Dict[str, "asyncio.Future[None]"] = {}
+        for record in records:
+            session_id = record['inputs'].get('session_id')
+            task = asyncio.ensure_future(call(
+                record,
+                started + (record['ts'] - first) / speed if speed > 0 else None,
+                previous.get(session_id) if session_id else None,
+            ))
+            if session_id:
+                previous[session_id] = task
+            tasks.append(task)
+        await asyncio.gather(*tasks)
+        elapsed = time.perf_counter() - started
+
+    results: Dict[str, Any] = {
+        'all': latency_summary(
+            [latency for values in latencies.values() for latency in values],
+            elapsed, sum(errors.values()),
+        ),
+    }
+    for tool in sorted(set(latencies) | set(errors)):
+        results[tool] = latency_summary(latencies.get(tool, []), elapsed, errors.get(tool, 0))
+    if lags:
+        results['all']['schedule_lag_seconds'] = {
+            'p50': round(percentile(lags, 50), 4),
+            'max': round(max(lags), 4),
+        }
+    return results
+
+
+def recorded_summary(records: List[Dict[str, Any]]) -> Dict[str, Any]:
+    """記録時のツールごとの所要時間とトークン数をまとめます"""
+    summary: Dict[str, Any] = {}
+    for tool in sorted({record['tool'] for record in records}):
+        matched = [record for record in records if record['tool'] == tool]
+        seconds = [record['seconds'] for record in matched]
+        summary[tool] = {
+            'requests': len(matched),
+            'errors': sum(1 for record in matched if record.get('outcome') != 'ok'),
+            'p50': round(percentile(seconds, 50), 4),
+            'p99': round(percentile(seconds, 99), 4),
+            'input_tokens': sum(record.get('input_tokens', 0) for record in matched),
+            'output_tokens': sum(record.get('output_tokens', 0) for record in matched),
+        }
+    return summary
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('trace_dir', help='DIVE_DEEP_TRACE_DIRに指定したディレクトリ')
+    parser.add_argument('--list', action='store_true', help='再生せずにインデックスの内容を出力する')
+    parser.add_argument('--since', help='この日時以降のレコードだけを再生する（エポック秒またはISO 8601）')
+    parser.add_argument('--until', help='この日時以前のレコードだけを再生する（エポック秒またはISO 8601）')
+    parser.add_argument('--tool', help='このツールのレコードだけを再生する')
+    parser.add_argument('--limit', type=int, help='再生するレコード数の上限')
+    parser.add_argument('--speed', type=float, default=1.0, help='再生速度の倍率（0は間隔を無視する）')
+    parser.add_argument('--concurrency', type=int, default=16, help='--speed 0での同時実行数')
+    parser.add_argument('--include-errors', action='store_true', help='記録時にエラーになった呼び出しも再生する')
+    parser.add_argument('--latency', type=float, default=0.5, help='フェイクバックエンドの最初のトークンまでの秒数')
+    parser.add_argument('--tokens-per-second', type=float, default=200, help='フェイクバックエンドの生成速度')
+    parser.add_argument('--output-tokens', type=int, default=300, help='フェイクバックエンドの出力トークン数')
+    parser.add_argument('--output', default='replay_traces.json', help='結果を保存するJSONファイル')
+    args = parser.parse_args()
+
+    if args.list:
+        list_blocks(args.trace_dir)
+        return
+
+    records = [
+        record for record in read_traces(
+            args.trace_dir, parse_time(args.since), parse_time(args.until), args.tool,
+        )
+        if args.include_errors or record.get('outcome') == 'ok'
+    ]
+    records.sort(key=lambda record: record['ts'])
+    records = records[:args.limit] if args.limit else records
+    if not records:
+        print("No matching traces")
+        return
+    print(
+        f"Replaying {len(records)} calls recorded over "
+        f"{records[-1]['ts'] - records[0]['ts']:.1f}s at speed {args.speed:g}"
+    )
+
+    os.environ.update({
+        'DIVE_DEEP_BACKEND': 'fake',
+        'DIVE_DEEP_FAKE_LATENCY': str(args.latency),
+        'DIVE_DEEP_FAKE_TOKENS_PER_SECOND': str(args.tokens_per_second),
+        'DIVE_DEEP_FAKE_OUTPUT_TOKENS': str(args.output_tokens),
+        # 再生した呼び出しを記録し直さず、キャッシュで負荷が消えないようにする
+        'DIVE_DEEP_TRACE_DIR': '',
+        'DIVE_DEEP_CACHE_ENABLED': '0',
+        'DIVE_DEEP_LOG_LEVEL': 'WARNING',
+    })
+    import dive_deep_server as server
+
+    print(f"Seeded {seed_blobs(server, args.trace_dir)} files into the blob store")
+    results = {
+        'replayed': asyncio.run(replay(records, args.speed, args.concurrency)),
+        'recorded': recorded_summary(records),
+    }
+    for tool, summary in results['replayed'].items():
+        latency = summary['latency_seconds']
+        recorded = results['recorded'].get(tool)
+        print(
+            f"{tool:<20} {summary['requests']:>5} calls, {summary['errors']} errors: "
+            f"p50 {latency['p50']}s, p99 {latency['p99']}s"
+            + (f" (recorded p50 {recorded['p50']}s, p99 {recorded['p99']}s)" if recorded else "")
+        )
+    write_results(args.output, 'replay_traces', vars(args), results)
+
+
+if __name__ == '__main__':
+    main()
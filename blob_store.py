@@ -0,0 +1,129 @@
+"""コードブロブストアモジュール
+
+ツールに渡されたファイルの内容をSHA-256ハッシュをキーとしてメモリに保持します。
+クライアントは一度送信したファイルを全文の代わりに`sha256:<16進ハッシュ>`の
+参照で指定できるため、変更のないファイルを繰り返し送信する必要がありません。
+"""
+
+import hashlib
+import re
+import threading
+from collections import OrderedDict
+from typing import Any, Dict, Iterable, List, Optional
+
+BLOB_REF_PREFIX = "sha256:"
+
+_BLOB_REF_PATTERN = re.compile(r"sha256:[0-9a-f]{64}")
+
+
+def blob_ref(text: str) -> str:
+    """ファイルの内容から参照文字列（sha256:<16進ハッシュ>）を返します"""
+    return BLOB_REF_PREFIX + hashlib.sha256(text.encode("utf-8")).hexdigest()
+
+
+def is_blob_ref(value: str) -> bool:
+    """値がファイルの内容ではなく参照文字列であるかを返します"""
+    return len(value) == len(BLOB_REF_PREFIX) + 64 and _BLOB_REF_PATTERN.fullmatch(value) is not None
+
+
+class UnknownBlobError(ValueError):
+    """ストアにない参照が指定された場合のエラー"""
+
+    def __init__(self, refs: List[str]):
+        self.refs = refs
+        super().__init__(
+            f"Unknown code references: {', '.join(refs)}. "
+            "Send the full content of these files instead."
+        )
+
+
+class BlobStore:
+    """メモリ上限付きのLRUブロブストア
+
+    合計サイズ（UTF-8のバイト数）がmax_bytesを超えた場合は、
+    最も長く参照されていないファイルから削除します。
+    """
+
+    def __init__(self, max_bytes: int = 64 * 1024 * 1024):
+        self.max_bytes = max_bytes
+        self._blobs: "OrderedDict[str, str]" = OrderedDict()
+        self._sizes: Dict[str, int] = {}
+        self._bytes = 0
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+        self.saved_bytes = 0
+        self.evictions = 0
+
+    def put(self, text: str) -> str:
+        """ファイルの内容を保存し、参照文字列を返します"""
+        ref = blob_ref(text)
+        size = len(text.encode("utf-8"))
+        with self._lock:
+            if ref in self._blobs:
+                self._blobs.move_to_end(ref)
+                return ref
+            if size > self.max_bytes:
+                return ref
+            self._blobs[ref] = text
+            self._sizes[ref] = size
+            self._bytes += size
+            while self._bytes > self.max_bytes:
+                evicted, _ = self._blobs.popitem(last=False)
+                self._bytes -= self._sizes.pop(evicted)
+                self.evictions += 1
+        return ref
+
+    def get(self, ref: str) -> Optional[str]:
+        """参照文字列に対応するファイルの内容を返します（ない場合はNone）"""
+        with self._lock:
+            text = self._blobs.get(ref)
+            if text is None:
+                self.misses += 1
+                return None
+            self._blobs.move_to_end(ref)
+            self.hits += 1
+            self.saved_bytes += self._sizes[ref]
+            return text
+
+    def resolve(self, code: Iterable[str]) -> List[str]:
+        """参照文字列をファイルの内容に置き換えたリストを返します
+
+        全文で渡されたファイルはストアに保存され、以降は参照で指定できます。
+
+        Raises:
+            UnknownBlobError: ストアにない参照が含まれていた場合
+        """
+        resolved: List[str] = []
+        unknown: List[str] = []
+        for item in code:
+            if is_blob_ref(item):
+                text = self.get(item)
+                if text is None:
+                    unknown.append(item)
+                    continue
+                resolved.append(text)
+            else:
+                self.put(item)
+                resolved.append(item)
+        if unknown:
+            raise UnknownBlobError(unknown)
+        return resolved
+
+    def known(self, refs: Iterable[str]) -> List[str]:
+        """指定された参照のうちストアにあるものを返します"""
+        with self._lock:
+            return [ref for ref in refs if ref in self._blobs]
+
+    def stats(self) -> Dict[str, Any]:
+        """保存しているファイル数・サイズと参照の解決結果を返します"""
+        with self._lock:
+            return {
+                'blobs': len(self._blobs),
+                'bytes': self._bytes,
+                'max_bytes': self.max_bytes,
+                'hits': self.hits,
+                'misses': self.misses,
+                'saved_bytes': self.saved_bytes,
+                'evictions': self.evictions,
+            }
@@ -0,0 +1,75 @@
+"""コードの差分モジュール
+
+前回レビューしたファイルと今回のファイルを比較し、変更されたファイルについては
+周辺の行を含むunified diffの差分だけを、新しいファイルについては全文を
+モデルに送るコンテンツとして組み立てます。
+"""
+
+import difflib
+from dataclasses import dataclass
+from typing import Dict, List, Optional
+
+
+@dataclass
+class FileChange:
+    """1ファイル分の変更"""
+    path: str
+    # added / modified / unchanged / removed
+    status: str
+    # modifiedの場合はunified diff、addedの場合は全文
+    text: Optional[str] = None
+
+
+def diff_files(
+    previous: Dict[str, str],
+    current: Dict[str, str],
+    context_lines: int = 3
+) -> List[FileChange]:
+    """前回と今回のファイルを比較して変更の一覧を返します
+
+    差分が全文より大きくなるファイルは、差分の代わりに全文を送るためaddedとして扱います。
+    """
+    changes: List[FileChange] = []
+    for path, text in current.items():
+        before = previous.get(path)
+        if before is None:
+            changes.append(FileChange(path, 'added', text))
+        elif before == text:
+            changes.append(FileChange(path, 'unchanged'))
+        else:
+            diff = ''.join(difflib.unified_diff(
+                before.splitlines(keepends=True),
+                text.splitlines(keepends=True),
+                fromfile=f'a/{path}',
+                tofile=f'b/{path}',
+                n=context_lines,
+            ))
+            if len(diff) >= len(text):
+                changes.append(FileChange(path, 'added', text))
+            else:
+                changes.append(FileChange(path, 'modified', diff))
+    for path in previous:
+        if path not in current:
+            changes.append(FileChange(path, 'removed'))
+    return changes
+
+
+def render_changes(changes: List[FileChange]) -> str:
+    """変更の一覧をモデルに送るテキストに整形します"""
+    sections = []
+    modified = [c for c in changes if c.status == 'modified']
+    if modified:
+        sections.append(
+            "changed hunks since the previous review (unified diff):\n"
+            + "\n".join(c.text.rstrip("\n") for c in modified)
+        )
+    for change in changes:
+        if change.status == 'added':
+            sections.append(f"new or rewritten file {change.path} (full content):\n{change.text.rstrip()}")
+    unchanged = [c.path for c in changes if c.status == 'unchanged']
+    if unchanged:
+        sections.append("unchanged files: " + ", ".join(unchanged))
+    removed = [c.path for c in changes if c.status == 'removed']
+    if removed:
+        sections.append("removed files: " + ", ".join(removed))
+    return "\n\n".join(sections)
@@ -0,0 +1,238 @@
+"""コードペイロードのエンコーディングモジュール
+
+モデルに送るコードのリストを文字列に変換します。既定の`delimited`形式は
+ファイルごとにパス・言語・行範囲のヘッダを付けてそのまま埋め込むため、
+json.dumpsのように改行や引用符がエスケープされずトークン数が少なくなります。
+オプションで行番号の付与と、空白・コメントの削減（minify）を行えます。
+"""
+
+import json
+import os
+from typing import List, Optional, Tuple
+
+ENCODINGS = ('delimited', 'json')
+
+_LANGUAGES = {
+    '.py': 'python', '.js': 'javascript', '.mjs': 'javascript', '.jsx': 'javascript',
+    '.ts': 'typescript', '.tsx': 'typescript', '.html': 'html', '.htm': 'html',
+    '.css': 'css', '.scss': 'scss', '.json': 'json', '.md': 'markdown',
+    '.java': 'java', '.kt': 'kotlin', '.go': 'go', '.rs': 'rust', '.rb': 'ruby',
+    '.php': 'php', '.c': 'c', '.h': 'c', '.cpp': 'cpp', '.hpp': 'cpp', '.cs': 'csharp',
+    '.swift': 'swift', '.sh': 'shell', '.sql': 'sql', '.yaml': 'yaml', '.yml': 'yaml',
+    '.toml': 'toml', '.xml': 'xml', '.vue': 'vue',
+}
+
+# 行全体がコメントの場合に削除する言語ごとの行コメントの接頭辞
+_LINE_COMMENTS = {
+    'python': ('#',), 'shell': ('#',), 'ruby': ('#',), 'yaml': ('#',), 'toml': ('#',),
+    'javascript': ('//',), 'typescript': ('//',), 'java': ('//',), 'kotlin': ('//',),
+    'go': ('//',), 'rust': ('//',), 'c': ('//',), 'cpp': ('//',), 'csharp': ('//',),
+    'swift': ('//',), 'php': ('//', '#'), 'scss': ('//',), 'sql': ('--',),
+}
+
+# 複数行にわたるブロックコメントの開始と終了
+_BLOCK_COMMENTS = {
+    'javascript': ('/*', '*/'), 'typescript': ('/*', '*/'), 'java': ('/*', '*/'),
+    'kotlin': ('/*', '*/'), 'go': ('/*', '*/'), 'rust': ('/*', '*/'), 'c': ('/*', '*/'),
+    'cpp': ('/*', '*/'), 'csharp': ('/*', '*/'), 'swift': ('/*', '*/'), 'php': ('/*', '*/'),
+    'css': ('/*', '*/'), 'scss': ('/*', '*/'), 'html': ('<!--', '-->'), 'xml': ('<!--', '-->'),
+    'vue': ('<!--', '-->'),
+}
+
+# 複数行にわたる文字列リテラルの区切り（その中の行はコメントとして扱わずそのまま残す）
+_MULTILINE_STRINGS = {
+    'python': ('"""', "'''"), 'javascript': ('`',), 'typescript': ('`',), 'go': ('`',),
+    'rust': ('"',), 'java': ('"""',), 'kotlin': ('"""',), 'swift': ('"""',),
+}
+
+# 本文に引用符が現れるため、引用符を文字列の区切りとして扱わない言語
+_MARKUP = {'html', 'xml', 'vue', 'markdown', 'text'}
+
+# インデントが意味を持つためインデント幅を変更しない言語
+_INDENT_SENSITIVE = {'python', 'yaml', 'markdown', 'text'}
+
+
+def detect_language(path: Optional[str], text: str) -> str:
+    """パスの拡張子（なければ内容）からファイルの言語を推定します"""
+    if path:
+        language = _LANGUAGES.get(os.path.splitext(path)[1].lower())
+        if language:
+            return language
+    head = text.lstrip()[:200].lower()
+    if head.startswith('<!doctype html') or head.startswith('<html'):
+        return 'html'
+    if head.startswith('<?php'):
+        return 'php'
+    if head.startswith('<?xml'):
+        return 'xml'
+    if head.startswith('#!') and 'python' in head.split('\n', 1)[0]:
+        return 'python'
+    return 'text'
+
+
+def _indent_unit(lines: List[str]) -> int:
+    """空白でインデントされた行のうち最小のインデント幅を返します"""
+    widths = [
+        len(line) - len(line.lstrip(' '))
+        for line in lines
+        if line.startswith(' ') and line.strip()
+    ]
+    return min(widths) if widths else 0
+
+
+def _scan(line: str, state: Optional[str], language: str) -> Optional[str]:
+    """行を走査し、行末で続いているブロックコメントの終了記号または文字列の区切りを返します
+
+    stateは行頭で続いているもの（なければNone）です。1行で閉じる文字列は行末でリセットします。
+    """
+    block = _BLOCK_COMMENTS.get(language)
+    line_prefixes = _LINE_COMMENTS.get(language, ())
+    multiline = _MULTILINE_STRINGS.get(language, ())
+    quotes = multiline + (() if language in _MARKUP else ('"', "'"))
+    i = 0
+    while i < len(line):
+        if state is None:
+            if block and line.startswith(block[0], i):
+                state = block[1]
+                i += len(block[0])
+            elif line_prefixes and line.startswith(line_prefixes, i):
+                break
+            else:
+                quote = next((quote for quote in quotes if line.startswith(quote, i)), None)
+                state = quote
+                i += len(quote) if quote else 1
+        elif block and state == block[1]:
+            end = line.find(state, i)
+            if end == -1:
+                return state
+            state = None
+            i = end + len(block[1])
+        elif line[i] == '\\':
+            i += 2
+        elif line.startswith(state, i):
+            i += len(state)
+            state = None
+        else:
+            i += 1
+    if state is not None and state not in multiline and not (block and state == block[1]):
+        return None
+    return state
+
+
+def minify(text: str, language: str) -> List[Tuple[int, str]]:
+    """空白とコメントを削減し、(元の行番号, 行)のリストを返します
+
+    末尾の空白・行全体のコメント・連続する空行を削除し、インデントが意味を持たない
+    言語ではインデントを1階層あたり空白1文字に縮めます。ブロックコメントの後ろに
+    続くコードは残し、複数行の文字列やテンプレートリテラルの中の行はそのまま残します。
+    行の途中のコメントや文字列の中身は変更しないため、意味は変わりません。
+    """
+    line_prefixes = _LINE_COMMENTS.get(language, ())
+    block = _BLOCK_COMMENTS.get(language)
+    lines: List[Tuple[int, str]] = []
+    source = text.splitlines()
+    unit = 0 if language in _INDENT_SENSITIVE else _indent_unit(source)
+    state: Optional[str] = None
+    previous_blank = True
+    for number, line in enumerate(source, start=1):
+        start, state = state, _scan(line, state, language)
+        in_block = block is not None and start == block[1]
+        if start is not None and not in_block:
+            # 文字列の中の行は空白を含めて内容の一部なので変更しない
+            previous_blank = False
+            lines.append((number, line))
+            continue
+        if in_block:
+            end = line.find(block[1])
+            if end == -1:
+                continue
+            # ブロックコメントの終わりに続くコードは元の行のインデントで残す
+            rest = line[end + len(block[1]):].lstrip()
+            if not rest:
+                continue
+            line = line[:len(line) - len(line.lstrip())] + rest
+        stripped = line.strip()
+        if block and stripped.startswith(block[0]):
+            # ブロックコメントの後ろにコードが続く行は残す
+            end = stripped.find(block[1], len(block[0]))
+            if end == -1 or end + len(block[1]) == len(stripped):
+                continue
+        if line_prefixes and stripped.startswith(line_prefixes):
+            continue
+        if not stripped:
+            if previous_blank:
+                continue
+            previous_blank = True
+            lines.append((number, ''))
+            continue
+        previous_blank = False
+        if state is None or (block and state == block[1]):
+            # 行末で文字列が続く場合、末尾の空白は文字列の中身なので残す
+            line = line.rstrip()
+        if unit > 1 and line.startswith(' '):
+            width = len(line) - len(line.lstrip(' '))
+            line = ' ' * (width // unit + width % unit) + line[width:]
+        lines.append((number, line))
+    while lines and not lines[-1][1]:
+        lines.pop()
+    return lines
+
+
+def _encode_file(
+    index: int,
+    total: int,
+    text: str,
+    path: Optional[str],
+    line_numbers: bool,
+    minified: bool
+) -> str:
+    language = detect_language(path, text)
+    if minified:
+        lines = minify(text, language)
+    else:
+        lines = list(enumerate(text.splitlines(), start=1))
+    line_count = text.count('\n') + (0 if text.endswith('\n') or not text else 1)
+    header = f"<<<FILE {index}/{total}"
+    if path:
+        header += f" path={path}"
+    header += f" language={language} lines=1-{line_count}"
+    if minified:
+        header += " minified"
+    header += ">>>"
+    if line_numbers:
+        width = len(str(line_count))
+        body = '\n'.join(f"{number:>{width}}| {line}" for number, line in lines)
+    else:
+        body = '\n'.join(line for _, line in lines)
+    return f"{header}\n{body}\n<<<END FILE {index}>>>"
+
+
+def encode_code(
+    code: List[str],
+    paths: Optional[List[Optional[str]]] = None,
+    encoding: str = 'delimited',
+    line_numbers: bool = False,
+    minified: bool = False
+) -> str:
+    """コードのリストをモデルに送る文字列に変換します
+
+    Args:
+        code: ファイルの内容のリスト
+        paths: 各ファイルのパス（ヘッダと言語の推定に使用）
+        encoding: 'delimited'（ヘッダ付きの区切り形式）または'json'（従来のjson.dumps形式）
+        line_numbers: 各行に元のファイルの行番号を付けるか（delimitedのみ）
+        minified: 末尾の空白・行全体のコメント・連続する空行を削除するか（delimitedのみ）
+    """
+    if encoding == 'json':
+        return json.dumps(code, ensure_ascii=False)
+    if encoding != 'delimited':
+        raise ValueError(f"Unknown code encoding: {encoding}")
+    total = len(code)
+    return '\n'.join(
+        _encode_file(
+            index + 1, total, text,
+            paths[index] if paths and index < len(paths) else None,
+            line_numbers, minified,
+        )
+        for index, text in enumerate(code)
+    )
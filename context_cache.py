@@ -0,0 +1,82 @@
+"""コンテキストキャッシュ管理モジュール
+
+大きな静的システムプロンプトをモデルごとに一度だけバックエンドのキャッシュ済み
+コンテンツとして登録し、以降のリクエストではそのハンドルを参照させます。
+"""
+
+import asyncio
+import hashlib
+import time
+from typing import Dict, Optional, Tuple
+
+from backends import CachedContentHandle, ModelBackend
+
+
+class ContextCacheManager:
+    """システムプロンプトのキャッシュハンドルを登録・更新します
+
+    ハンドルは有効期限のrefresh_margin秒前になると再登録されます。
+    登録に失敗した組み合わせはretry_after秒間インラインのプロンプトに
+    フォールバックし、その間は登録を再試行しません。
+    """
+
+    def __init__(
+        self,
+        backend: ModelBackend,
+        ttl_seconds: int = 3600,
+        refresh_margin: int = 300,
+        retry_after: int = 600
+    ):
+        self.backend = backend
+        self.ttl_seconds = ttl_seconds
+        self.refresh_margin = refresh_margin
+        self.retry_after = retry_after
+        self._handles: Dict[Tuple[str, str], CachedContentHandle] = {}
+        self._failures: Dict[Tuple[str, str], float] = {}
+        self._locks: Dict[Tuple[str, str], asyncio.Lock] = {}
+
+    @staticmethod
+    def _key(model: str, system_instruction: str) -> Tuple[str, str]:
+        return model, hashlib.sha256(system_instruction.encode("utf-8")).hexdigest()
+
+    async def get_handle(self, model: str, system_instruction: str) -> Optional[str]:
+        """有効なキャッシュハンドル名を返します。利用できない場合はNoneを返します"""
+        key = self._key(model, system_instruction)
+        handle = self._handles.get(key)
+        if handle is not None and not self._needs_refresh(handle):
+            return handle.name
+
+        lock = self._locks.setdefault(key, asyncio.Lock())
+        async with lock:
+            # 待機中に他の呼び出しが登録を済ませている場合はそれを使う
+            handle = self._handles.get(key)
+            if handle is not None and not self._needs_refresh(handle):
+                return handle.name
+
+            failed_at = self._failures.get(key)
+            if failed_at is not None and time.time() - failed_at < self.retry_after:
+                return None
+
+            try:
+                handle = await self._register(model, system_instruction)
+            except Exception:
+                self._failures[key] = time.time()
+                self._handles.pop(key, None)
+                raise
+            self._failures.pop(key, None)
+            self._handles[key] = handle
+            return handle.name
+
+    def invalidate(self, model: str, system_instruction: str) -> None:
+        """ハンドルを破棄し、次回のリクエストで再登録させます"""
+        self._handles.pop(self._key(model, system_instruction), None)
+
+    def _needs_refresh(self, handle: CachedContentHandle) -> bool:
+        return time.time() >= handle.expires_at - self.refresh_margin
+
+    async def _register(self, model: str, system_instruction: str) -> CachedContentHandle:
+        return await self.backend.create_cached_content(
+            model=model,
+            system_instruction=system_instruction,
+            ttl_seconds=self.ttl_seconds,
+        )
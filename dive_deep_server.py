@@ -1,19 +1,53 @@
+import asyncio
+import atexit
 import dotenv
+import functools
 import json
 import os
 import sys
-from mcp.server.fastmcp import FastMCP
-from typing import List, TypedDict
-import google.genai as genai
-from google.genai.types import GenerateContentConfig
-from logger_config import get_logger
+import time
+from mcp.server.fastmcp import Context, FastMCP
+from typing import Any, Awaitable, Callable, Dict, List, Optional, Tuple
+from typing_extensions import TypedDict
+from backends import BatchJobError, BatchRequest, GenerationResult, LazyBackend
+from blob_store import BlobStore
+from code_diff import diff_files, render_changes
+from code_encoding import ENCODINGS, encode_code
+from context_cache import ContextCacheManager
+from logger_config import get_logger, payload
+from metrics import MetricsRegistry, start_metrics_server
+from model_router import ModelRouter, Route, hedged_call, load_routes
+from preflight import Section, output_token_cap, trim_sections, trim_text
+from response_cache import ResponseCache, make_cache_key
+from scheduler import ModelQuota, RequestScheduler
+from session_limiter import SessionLimiter
+from sessions import Session, SessionStore, Turn
+from similarity_cache import SimilarityCache
+from singleflight import SingleFlight
+from token_budget import chunk_files, estimate_tokens
+from trace_store import TraceStore, token_usage
 from prompts import (
     DEEP_THINKING_AGENT_DESCRIPTION,
     ENHANCEMENT_AGENT_DESCRIPTION,
     FINAL_REVIEW_AGENT_DESCRIPTION,
+    DIVE_DEEP_PIPELINE_DESCRIPTION,
     DEEP_THINKING_PROMPT,
     ADVANCED_ANALYSIS_PROMPT,
-    DEEP_REVIEW_PROMPT
+    DEEP_REVIEW_PROMPT,
+    MAP_CHUNK_INSTRUCTIONS,
+    MAP_REDUCE_MERGE_INSTRUCTIONS,
+    CODE_REFERENCE_NOTE,
+    KNOWN_CODE_BLOBS_DESCRIPTION,
+    INCREMENTAL_REVIEW_INSTRUCTIONS,
+    INCREMENTAL_REVIEW_NOTE,
+    BATCH_REVIEW_DESCRIPTION,
+    DESCRIPTION_PROFILES,
+    GUIDE_NOTE,
+    COMPACT_DESCRIPTIONS,
+    MINIMAL_DESCRIPTIONS,
+    SESSION_NOTE,
+    CONVERSATION_HISTORY_NOTE,
+    CONVERSATION_SUMMARY_PROMPT
 )
 
 
@@ -27,6 +61,14 @@ class McpResponse(TypedDict, total=False):
     """A TypedDict representing an MCP server response."""
     content: List[ContentItem]
     isError: bool
+    metadata: Dict[str, Any]
+
+
+class BatchJob(TypedDict, total=False):
+    """A TypedDict representing a single job of batch_review."""
+    id: str
+    instructions: str
+    code: List[str]
 
 
 # ロガーの初期化
@@ -34,12 +76,279 @@ logger = get_logger("dive_deep_server")
 
 dotenv.load_dotenv()
 
-# Gemini clientの初期化
-client = genai.Client(api_key=os.getenv("GEMINI_API_KEY"))
+
+def _create_backend() -> LazyBackend:
+    """DIVE_DEEP_BACKENDの設定に従ってモデルバックエンドを生成します
+
+    gemini（デフォルト）はGemini APIを、fakeはクォータを消費しない
+    ローカルのフェイクバックエンドを使用します。実際のクライアントは
+    最初のツール呼び出し（またはウォームアップ）まで生成されません。
+    """
+    name = os.getenv("DIVE_DEEP_BACKEND", "gemini")
+    if name == "fake":
+        return LazyBackend(
+            name,
+            latency=float(os.getenv("DIVE_DEEP_FAKE_LATENCY", "0.5")),
+            tokens_per_second=float(os.getenv("DIVE_DEEP_FAKE_TOKENS_PER_SECOND", "200")),
+            output_tokens=int(os.getenv("DIVE_DEEP_FAKE_OUTPUT_TOKENS", "300")),
+            error_rate=float(os.getenv("DIVE_DEEP_FAKE_ERROR_RATE", "0")),
+            seed=int(os.getenv("DIVE_DEEP_FAKE_SEED", "0")),
+            tail_rate=float(os.getenv("DIVE_DEEP_FAKE_TAIL_RATE", "0")),
+            tail_latency=float(os.getenv("DIVE_DEEP_FAKE_TAIL_LATENCY", "0")),
+        )
+    return LazyBackend(name, api_key=os.getenv("GEMINI_API_KEY"))
+
+
+# モデルバックエンドの初期化
+backend = _create_backend()
+logger.info("Using model backend: {}", backend.name)
+
+# 起動直後にバックグラウンドでバックエンドを生成し、最初の呼び出しの待ち時間をなくす
+WARMUP_ENABLED = os.getenv("DIVE_DEEP_WARMUP", "0") == "1"
 
 # デフォルトのモデルを環境変数から読み込む
 DEFAULT_MODEL = os.getenv("GEMINI_MODEL", "gemini-2.0-flash")
 
+
+def _load_model_routes() -> List[Route]:
+    """DIVE_DEEP_MODEL_ROUTES（JSON）からモデルのルートを読み込みます
+
+    設定が不正な場合はエラーを記録し、ルーティングせずにGEMINI_MODELを使います。
+    """
+    raw = os.getenv("DIVE_DEEP_MODEL_ROUTES")
+    if not raw:
+        return []
+    try:
+        return load_routes(raw)
+    except ValueError as e:
+        logger.error("Ignoring invalid DIVE_DEEP_MODEL_ROUTES, routing disabled: {}", e)
+        return []
+
+
+# modelを省略したツール呼び出しは、ツールと推定入力トークン数に一致するルートのモデルに送る
+model_router = ModelRouter(_load_model_routes(), DEFAULT_MODEL)
+
+# Gemini APIへの同時リクエスト数の上限
+MAX_CONCURRENT_REQUESTS = int(os.getenv("DIVE_DEEP_MAX_CONCURRENCY", "8"))
+
+
+def _load_model_quotas() -> Dict[str, ModelQuota]:
+    """DIVE_DEEP_MODEL_QUOTAS（JSON）からモデルごとのRPM/TPMを読み込みます"""
+    raw = os.getenv("DIVE_DEEP_MODEL_QUOTAS")
+    if not raw:
+        return {}
+    return {
+        model: ModelQuota(rpm=quota.get('rpm'), tpm=quota.get('tpm'))
+        for model, quota in json.loads(raw).items()
+    }
+
+
+# すべての上流リクエストはスケジューラを通してレート制限と再試行を受ける
+scheduler = RequestScheduler(
+    max_concurrency=MAX_CONCURRENT_REQUESTS,
+    quotas=_load_model_quotas(),
+    default_quota=ModelQuota(
+        rpm=float(os.getenv("DIVE_DEEP_DEFAULT_RPM", "0")),
+        tpm=float(os.getenv("DIVE_DEEP_DEFAULT_TPM", "0")),
+    ),
+    max_retries=int(os.getenv("DIVE_DEEP_MAX_RETRIES", "5")),
+    base_delay=float(os.getenv("DIVE_DEEP_RETRY_BASE_DELAY", "1.0")),
+    max_delay=float(os.getenv("DIVE_DEEP_RETRY_MAX_DELAY", "60")),
+)
+
+# レスポンスキャッシュの初期化（DIVE_DEEP_CACHE_DIRを指定するとディスクにも保存）
+CACHE_ENABLED = os.getenv("DIVE_DEEP_CACHE_ENABLED", "1") == "1"
+response_cache = ResponseCache(
+    max_entries=int(os.getenv("DIVE_DEEP_CACHE_MAX_ENTRIES", "256")),
+    ttl_seconds=float(os.getenv("DIVE_DEEP_CACHE_TTL", "3600")),
+    disk_dir=os.getenv("DIVE_DEEP_CACHE_DIR") or None,
+    max_disk_bytes=int(float(os.getenv("DIVE_DEEP_CACHE_MAX_DISK_MB", "100")) * 1024 * 1024),
+)
+
+# わずかに異なるリクエストに過去の生成結果を返す類似キャッシュ（オプトイン）
+SIMILARITY_CACHE_ENABLED = os.getenv("DIVE_DEEP_SIMILARITY_CACHE", "0") == "1"
+SIMILARITY_CACHE_TOOLS = set(
+    os.getenv("DIVE_DEEP_SIMILARITY_CACHE_TOOLS", "deep_thinking_agent").split(",")
+)
+similarity_cache = SimilarityCache(
+    threshold=float(os.getenv("DIVE_DEEP_SIMILARITY_THRESHOLD", "0.9")),
+    max_entries=int(os.getenv("DIVE_DEEP_SIMILARITY_CACHE_MAX_ENTRIES", "10000")),
+    max_bytes=int(float(os.getenv("DIVE_DEEP_SIMILARITY_CACHE_MAX_MB", "64")) * 1024 * 1024),
+    ttl_seconds=float(os.getenv("DIVE_DEEP_CACHE_TTL", "3600")),
+)
+
+# ツール・モデルごとのメトリクス（DIVE_DEEP_METRICS_PORTでPrometheus形式のエンドポイントを公開）
+metrics = MetricsRegistry()
+METRICS_HOST = os.getenv("DIVE_DEEP_METRICS_HOST", "127.0.0.1")
+METRICS_PORT = int(os.getenv("DIVE_DEEP_METRICS_PORT", "0"))
+
+# 実行中の同一リクエストを1回の上流呼び出しにまとめる
+COALESCING_ENABLED = os.getenv("DIVE_DEEP_COALESCE", "1") == "1"
+request_coalescer = SingleFlight()
+
+# システムプロンプトをGeminiのコンテキストキャッシュとして登録するモード
+CONTEXT_CACHE_ENABLED = os.getenv("DIVE_DEEP_CONTEXT_CACHE", "0") == "1"
+context_cache = ContextCacheManager(
+    backend,
+    ttl_seconds=int(os.getenv("DIVE_DEEP_CONTEXT_CACHE_TTL", "3600")),
+    refresh_margin=int(os.getenv("DIVE_DEEP_CONTEXT_CACHE_REFRESH_MARGIN", "300")),
+)
+
+# generate_content_streamで部分テキストを進捗通知として送るモード（ツールごとに上書き可能）
+STREAMING_ENABLED = os.getenv("DIVE_DEEP_STREAMING", "0") == "1"
+
+# 大きなコードリストをチャンクに分けて並列分析するmap-reduceモード
+MAP_REDUCE_ENABLED = os.getenv("DIVE_DEEP_MAP_REDUCE", "0") == "1"
+CHUNK_TOKEN_BUDGET = int(os.getenv("DIVE_DEEP_CHUNK_TOKEN_BUDGET", "30000"))
+
+# モデルに送るコードの形式（delimited: ファイルごとのヘッダ付き、json: 従来のjson.dumps）
+CODE_ENCODING = os.getenv("DIVE_DEEP_CODE_ENCODING", "delimited")
+if CODE_ENCODING not in ENCODINGS:
+    raise ValueError(f"DIVE_DEEP_CODE_ENCODING must be one of {ENCODINGS}: {CODE_ENCODING}")
+CODE_LINE_NUMBERS = os.getenv("DIVE_DEEP_CODE_LINE_NUMBERS", "0") == "1"
+CODE_MINIFY = os.getenv("DIVE_DEEP_CODE_MINIFY", "0") == "1"
+
+# 送信されたファイルの内容をハッシュで保持し、以降は参照で指定できるようにする
+blob_store = BlobStore(
+    max_bytes=int(float(os.getenv("DIVE_DEEP_BLOB_STORE_MAX_MB", "64")) * 1024 * 1024),
+)
+
+# batch_reviewで同時に実行するジョブ数と、上流のバッチAPIを使う場合のポーリング設定
+BATCH_CONCURRENCY = int(os.getenv("DIVE_DEEP_BATCH_CONCURRENCY", "4"))
+# 完了したジョブの進捗通知に含める結果のテキストの最大文字数（0は全文）
+BATCH_PROGRESS_CHARS = int(os.getenv("DIVE_DEEP_BATCH_PROGRESS_CHARS", "4000"))
+UPSTREAM_BATCH_POLL_INTERVAL = float(os.getenv("DIVE_DEEP_UPSTREAM_BATCH_POLL_INTERVAL", "30"))
+UPSTREAM_BATCH_TIMEOUT = float(os.getenv("DIVE_DEEP_UPSTREAM_BATCH_TIMEOUT", "86400"))
+
+# session_idごとに前回レビューしたファイルとレビュー結果を保持し、差分だけをレビューする
+session_store = SessionStore(
+    max_sessions=int(os.getenv("DIVE_DEEP_SESSION_MAX", "128")),
+    idle_ttl_seconds=float(os.getenv("DIVE_DEEP_SESSION_IDLE_TTL", "3600")),
+    max_review_bytes=int(float(os.getenv("DIVE_DEEP_SESSION_MAX_REVIEW_MB", "8")) * 1024 * 1024),
+)
+DIFF_CONTEXT_LINES = int(os.getenv("DIVE_DEEP_DIFF_CONTEXT_LINES", "3"))
+REVIEW_SUMMARY_CHARS = int(os.getenv("DIVE_DEEP_REVIEW_SUMMARY_CHARS", "4000"))
+# session_idを指定した呼び出しの会話の履歴。往復数か推定トークン数が上限を超えると、
+# 直近の往復を残して古い往復をモデルで要約する
+CONVERSATION_MAX_TURNS = int(os.getenv("DIVE_DEEP_CONVERSATION_MAX_TURNS", "16"))
+CONVERSATION_TOKEN_BUDGET = int(os.getenv("DIVE_DEEP_CONVERSATION_TOKEN_BUDGET", "32000"))
+CONVERSATION_KEEP_TURNS = int(os.getenv("DIVE_DEEP_CONVERSATION_KEEP_TURNS", "2"))
+CONVERSATION_SUMMARY_TOKENS = int(os.getenv("DIVE_DEEP_CONVERSATION_SUMMARY_TOKENS", "2048"))
+# 1往復として保持する推定トークン数の上限。直近の往復と要約だけで上限を超えないようにする
+CONVERSATION_TURN_TOKENS = max(
+    (CONVERSATION_TOKEN_BUDGET - CONVERSATION_SUMMARY_TOKENS) // max(CONVERSATION_KEEP_TURNS, 1),
+    256,
+)
+
+# トランスポート（stdio、streamable-http、sse）。HTTPでは複数のクライアントが
+# 1つのプロセスのキャッシュとレート制限を共有する
+TRANSPORT = os.getenv("DIVE_DEEP_TRANSPORT", "stdio")
+HTTP_HOST = os.getenv("DIVE_DEEP_HTTP_HOST", "127.0.0.1")
+HTTP_PORT = int(os.getenv("DIVE_DEEP_HTTP_PORT", "8000"))
+
+# 上流を呼び出す前に入力トークン数を見積もり、予算を超える場合はコンテキストやコードを削る
+TOKEN_BUDGET = int(os.getenv("DIVE_DEEP_TOKEN_BUDGET", "800000"))
+TOKEN_BUDGETS: Dict[str, int] = json.loads(os.getenv("DIVE_DEEP_TOKEN_BUDGETS") or "{}")
+# 推定値が予算のこの割合を超える場合だけ、バックエンドで正確なトークン数を数える
+EXACT_TOKEN_COUNT = os.getenv("DIVE_DEEP_EXACT_TOKEN_COUNT", "0") == "1"
+EXACT_TOKEN_COUNT_THRESHOLD = float(os.getenv("DIVE_DEEP_EXACT_TOKEN_COUNT_THRESHOLD", "0.8"))
+# 出力トークン数の上限（入力の一定割合を最小値と最大値の範囲に収める。既定の最大値0は無制限）
+MAX_OUTPUT_TOKENS = int(os.getenv("DIVE_DEEP_MAX_OUTPUT_TOKENS", "0"))
+MIN_OUTPUT_TOKENS = int(os.getenv("DIVE_DEEP_MIN_OUTPUT_TOKENS", "2048"))
+OUTPUT_TOKEN_RATIO = float(os.getenv("DIVE_DEEP_OUTPUT_TOKEN_RATIO", "0.5"))
+CONTEXT_WINDOW = int(os.getenv("DIVE_DEEP_CONTEXT_WINDOW", "1048576"))
+
+# ツール呼び出し1回あたりの期限（秒、0は無期限）。ツールごとにtimeout_secondsで上書きできる
+CALL_TIMEOUT = float(os.getenv("DIVE_DEEP_CALL_TIMEOUT", "0"))
+
+# クライアントセッションごとの上流呼び出しの同時実行数の上限（0は無制限）
+session_limiter = SessionLimiter(int(os.getenv("DIVE_DEEP_SESSION_MAX_CONCURRENCY", "0")))
+
+# ツール呼び出しごとの入力・出力・所要時間・トークン数を記録するディレクトリ（未設定は記録しない）。
+# 記録はbenchmarks/replay_traces.pyでフェイクバックエンドに対して再生できる
+TRACE_DIR = os.getenv("DIVE_DEEP_TRACE_DIR", "")
+trace_store = TraceStore(
+    TRACE_DIR,
+    max_bytes=int(float(os.getenv("DIVE_DEEP_TRACE_MAX_MB", "256")) * 1024 * 1024),
+    segment_bytes=int(float(os.getenv("DIVE_DEEP_TRACE_SEGMENT_MB", "8")) * 1024 * 1024),
+) if TRACE_DIR else None
+if trace_store is not None:
+    atexit.register(trace_store.close)
+
+# ツール一覧に載せる説明文のプロファイル（full、compact、minimal）。compactとminimalでは
+# 詳しい使い方をMCPリソースdive-deep://guides/{tool_name}とプロンプトtool_guideで提供する
+DESCRIPTION_PROFILE = os.getenv("DIVE_DEEP_DESCRIPTION_PROFILE", "full")
+if DESCRIPTION_PROFILE not in DESCRIPTION_PROFILES:
+    raise ValueError(
+        f"DIVE_DEEP_DESCRIPTION_PROFILE must be one of {DESCRIPTION_PROFILES}: {DESCRIPTION_PROFILE}"
+    )
+
+# ツールごとの詳しい使い方（fullプロファイルの説明文）
+TOOL_GUIDES = {
+    'deep_thinking_agent': DEEP_THINKING_AGENT_DESCRIPTION + SESSION_NOTE,
+    'enhancement_agent': ENHANCEMENT_AGENT_DESCRIPTION + CODE_REFERENCE_NOTE + SESSION_NOTE,
+    'final_review_agent': (
+        FINAL_REVIEW_AGENT_DESCRIPTION + CODE_REFERENCE_NOTE + INCREMENTAL_REVIEW_NOTE + SESSION_NOTE
+    ),
+    'dive_deep_pipeline': DIVE_DEEP_PIPELINE_DESCRIPTION + CODE_REFERENCE_NOTE,
+    'batch_review': BATCH_REVIEW_DESCRIPTION + CODE_REFERENCE_NOTE,
+    'known_code_blobs': KNOWN_CODE_BLOBS_DESCRIPTION,
+}
+
+
+def _describe(tool_name: str) -> str:
+    """DIVE_DEEP_DESCRIPTION_PROFILEに従ってツール一覧に載せる説明文を返します"""
+    if DESCRIPTION_PROFILE == 'full':
+        return TOOL_GUIDES[tool_name]
+    profile = COMPACT_DESCRIPTIONS if DESCRIPTION_PROFILE == 'compact' else MINIMAL_DESCRIPTIONS
+    return profile[tool_name] + GUIDE_NOTE.format(tool_name=tool_name)
+
+
+_ToolFunc = Callable[..., Awaitable[McpResponse]]
+
+
+def _traced(tool_name: str) -> Callable[[_ToolFunc], _ToolFunc]:
+    """ツール呼び出しをトレースストアに記録するデコレータ（DIVE_DEEP_TRACE_DIR未設定時は何もしない）"""
+
+    def decorator(func: _ToolFunc) -> _ToolFunc:
+        if trace_store is None:
+            return func
+
+        @functools.wraps(func)
+        async def wrapper(*args: Any, **kwargs: Any) -> McpResponse:
+            started_at = time.time()
+            started = time.perf_counter()
+            record: Dict[str, Any] = {
+                'ts': started_at,
+                'tool': tool_name,
+                'inputs': {key: value for key, value in kwargs.items() if key != 'ctx'},
+            }
+            try:
+                result = await func(*args, **kwargs)
+            except asyncio.CancelledError:
+                record['outcome'] = 'cancelled'
+                raise
+            except Exception as e:
+                record.update(outcome='error', output=str(e))
+                raise
+            else:
+                metadata = result.get('metadata', {})
+                record.update(
+                    outcome='error' if result.get('isError') else 'ok',
+                    output=result['content'][0]['text'] if result.get('content') else '',
+                    metadata=metadata,
+                    **token_usage(metadata),
+                )
+                return result
+            finally:
+                record['seconds'] = round(time.perf_counter() - started, 4)
+                trace_store.record(record)
+
+        return wrapper
+
+    return decorator
+
+
 logger.info("Initializing MCP server...")
 mcp = FastMCP(
     'Deep Thinking Assistant - MCP server for enhanced reasoning and analysis',
@@ -47,37 +356,923 @@ mcp = FastMCP(
         'loguru',
         'google-genai',
     ],
+    host=HTTP_HOST,
+    port=HTTP_PORT,
 )
 
 
+class DeadlineExceededError(TimeoutError):
+    """ツール呼び出しが期限内に完了しなかった場合のエラー"""
+
+    def __init__(self, timeout: float):
+        self.timeout = timeout
+        super().__init__(
+            f"Deadline of {timeout:g}s exceeded; the upstream request was cancelled"
+        )
+
+
+async def _with_deadline(coro: Awaitable[Any], timeout_seconds: Optional[float]) -> Any:
+    """期限（省略時はDIVE_DEEP_CALL_TIMEOUT）内にcoroを完了させます
+
+    期限を過ぎた場合は実行中の上流リクエストをキャンセルし、実行枠を解放してから
+    DeadlineExceededErrorを送出します。
+    """
+    timeout = CALL_TIMEOUT if timeout_seconds is None else timeout_seconds
+    if not timeout or timeout <= 0:
+        return await coro
+    try:
+        return await asyncio.wait_for(coro, timeout)
+    except asyncio.TimeoutError:
+        raise DeadlineExceededError(timeout) from None
+
+
+def _client_session(ctx: Optional[Context]) -> Optional[Any]:
+    """ツール呼び出し元のMCPセッションを返します（リクエスト外ではNone）"""
+    if ctx is None:
+        return None
+    try:
+        return ctx.session
+    except ValueError:
+        return None
+
+
+def _session(session_id: Optional[str], ctx: Optional[Context]) -> Optional[Session]:
+    """呼び出し元のクライアントセッションのsession_idのセッションを返します（未指定ならNone）"""
+    if not session_id:
+        return None
+    return session_store.get(session_id, _client_session(ctx))
+
+
+async def _generate_content(
+    tool_name: str,
+    model: Optional[str],
+    content: str,
+    system_instruction: str,
+    temperature: Optional[float] = None,
+    bypass_cache: bool = False,
+    ctx: Optional[Context] = None,
+    stream: Optional[bool] = None,
+    max_output_tokens: Optional[int] = None
+) -> Tuple[str, Dict[str, Any]]:
+    """モデルで生成したテキストとメタデータを返します。
+
+    modelがNoneの場合はツールと推定入力トークン数からルートを選び、ルートの
+    設定に従って応答の遅いリクエストを高速なモデルにヘッジします。
+    """
+    args = (content, system_instruction, temperature, bypass_cache)
+    if model is not None:
+        return await _generate_on_model(tool_name, model, *args, ctx, stream, max_output_tokens)
+
+    route = model_router.route(
+        tool_name, estimate_tokens(system_instruction) + estimate_tokens(content)
+    )
+    started = time.perf_counter()
+    primary_seconds: Optional[float] = None
+
+    async def primary() -> Tuple[str, Dict[str, Any]]:
+        nonlocal primary_seconds
+        result = await _generate_on_model(
+            tool_name, route.model, *args, ctx, stream, max_output_tokens
+        )
+        primary_seconds = time.perf_counter() - started
+        return result
+
+    async def hedge() -> Tuple[str, Dict[str, Any]]:
+        # ヘッジ側の部分テキストは進捗通知に混ぜない
+        logger.info(
+            "{} is slow on {}, hedging to {}", tool_name, route.model, route.hedge_model
+        )
+        return await _generate_on_model(
+            tool_name, route.hedge_model, *args, ctx, False, max_output_tokens
+        )
+
+    try:
+        (text, metadata), winner, hedged = await hedged_call(
+            primary, hedge, model_router.start(route), lambda: model_router.reserve_hedge(route)
+        )
+    except Exception:
+        model_router.record(route, time.perf_counter() - started, 'error')
+        metrics.record_route(tool_name, route.name, 'error')
+        raise
+    seconds = time.perf_counter() - started
+    if winner == 'hedge':
+        # キャンセルした最初のリクエストの所要時間は少なくともここまでかかっている
+        primary_seconds = seconds
+    model_router.record(route, seconds, winner, primary_seconds)
+    metrics.record_route(tool_name, route.name, f'{winner}_won' if hedged else winner)
+    return text, {
+        **metadata,
+        'route': {
+            'name': route.name,
+            'model': route.hedge_model if winner == 'hedge' else route.model,
+            'hedged': hedged,
+        },
+    }
+
+
+async def _generate_on_model(
+    tool_name: str,
+    model: str,
+    content: str,
+    system_instruction: str,
+    temperature: Optional[float] = None,
+    bypass_cache: bool = False,
+    ctx: Optional[Context] = None,
+    stream: Optional[bool] = None,
+    max_output_tokens: Optional[int] = None
+) -> Tuple[str, Dict[str, Any]]:
+    """指定したモデルで生成し、呼び出し結果をメトリクスに記録します。"""
+    started = time.perf_counter()
+    try:
+        text, metadata = await _generate_cached(
+            tool_name, model, content, system_instruction, temperature, bypass_cache, ctx, stream,
+            max_output_tokens,
+        )
+    except Exception:
+        metrics.record(tool_name, model, time.perf_counter() - started, error=True)
+        raise
+    # キャッシュヒットや合流した呼び出しは上流のトークンを消費していない
+    upstream = not metadata.get('cached') and not metadata.get('coalesced')
+    metrics.record(
+        tool_name,
+        model,
+        time.perf_counter() - started,
+        cached=bool(metadata.get('cached')),
+        input_tokens=metadata.get('input_tokens') if upstream else None,
+        output_tokens=metadata.get('output_tokens') if upstream else None,
+    )
+    return text, metadata
+
+
+async def _generate_cached(
+    tool_name: str,
+    model: str,
+    content: str,
+    system_instruction: str,
+    temperature: Optional[float],
+    bypass_cache: bool,
+    ctx: Optional[Context],
+    stream: Optional[bool],
+    max_output_tokens: Optional[int] = None
+) -> Tuple[str, Dict[str, Any]]:
+    """レスポンスキャッシュとリクエストの合流を経由して生成します。
+
+    同一リクエストの結果はレスポンスキャッシュから返されます。bypass_cacheが
+    Trueの場合はキャッシュを参照せずに生成し、結果でキャッシュを更新します。
+    類似キャッシュが有効なツールでは、完全一致しなくても類似度が閾値以上の
+    過去のリクエストの結果をapproximateとして返します。
+    実行中のリクエストと同じキーを持つ呼び出しは、新たに上流を呼び出さずに
+    その結果を共有します。bypass_cacheがTrueの呼び出しは合流せず、常に上流を呼び出します。
+    """
+    cache_key = make_cache_key(
+        tool_name, model, system_instruction, temperature, content, max_output_tokens
+    )
+    if CACHE_ENABLED and not bypass_cache:
+        entry = await response_cache.get_async(cache_key)
+        if entry is not None:
+            logger.debug("Cache hit for {} (saved {:.2f}s)", tool_name, entry.latency)
+            return entry.text, {'cached': True}
+    if _similarity_enabled(tool_name) and not bypass_cache:
+        hit = similarity_cache.lookup(
+            _similarity_scope(tool_name, model, system_instruction, temperature, max_output_tokens),
+            content,
+        )
+        if hit is not None:
+            logger.debug("Similarity cache hit for {} (similarity {:.3f})", tool_name, hit[1])
+            return hit[0], {'cached': True, 'approximate': True, 'similarity': round(hit[1], 3)}
+
+    async def generate() -> Tuple[str, Dict[str, Any]]:
+        return await _generate_uncached(
+            tool_name, model, content, system_instruction, temperature, ctx, stream, cache_key,
+            max_output_tokens,
+        )
+
+    if not COALESCING_ENABLED or bypass_cache:
+        return await generate()
+    (text, metadata), coalesced = await request_coalescer.do(cache_key, generate)
+    if coalesced:
+        logger.debug("Coalesced {} with an in-flight request", tool_name)
+        return text, {**metadata, 'coalesced': True}
+    return text, metadata
+
+
+async def _generate_uncached(
+    tool_name: str,
+    model: str,
+    content: str,
+    system_instruction: str,
+    temperature: Optional[float],
+    ctx: Optional[Context],
+    stream: Optional[bool],
+    cache_key: str,
+    max_output_tokens: Optional[int] = None
+) -> Tuple[str, Dict[str, Any]]:
+    """上流のモデルを呼び出し、結果をレスポンスキャッシュに保存します
+
+    ストリーミングモードでは部分テキストをMCPの進捗通知としてctxに送信し、
+    最終的には全文を返します。
+    リクエストはスケジューラを通り、モデルごとのレート制限と同時実行数の上限に
+    達している場合は失敗せずに待機し、429/503などのエラーは再試行されます。
+    さらにクライアントセッションごとの同時実行数の上限を超える場合も待機します。
+    """
+    streaming = STREAMING_ENABLED if stream is None else stream
+    cache_handle = await _get_context_cache_handle(model, system_instruction)
+    # 再試行をまたいで共有し、進捗通知の値が戻らないようにする
+    progress = _StreamProgress(ctx) if streaming and ctx is not None else None
+
+    async def attempt() -> Tuple[GenerationResult, float, Optional[str]]:
+        handle = cache_handle
+        try:
+            result, ttft = await _call_model(
+                model, content, system_instruction, temperature, handle,
+                progress, max_output_tokens,
+            )
+        except Exception as e:
+            if handle is None or getattr(e, 'code', None) not in (400, 403, 404):
+                raise
+            # ハンドルが失効・削除されていた場合はインラインのプロンプトで再試行する
+            logger.warning("Cached content {} rejected, retrying inline: {}", handle, e)
+            context_cache.invalidate(model, system_instruction)
+            handle = None
+            result, ttft = await _call_model(
+                model, content, system_instruction, temperature, None,
+                progress, max_output_tokens,
+            )
+        return result, ttft, handle
+
+    started = time.perf_counter()
+    estimated_tokens = estimate_tokens(content) + (
+        0 if cache_handle else estimate_tokens(system_instruction)
+    )
+    async with session_limiter.slot(_client_session(ctx)):
+        result, ttft, cache_handle = await scheduler.run(model, estimated_tokens, attempt)
+    text = result.text
+    latency = time.perf_counter() - started
+    mode = 'streamed' if streaming else 'buffered'
+    logger.info(
+        "{} ({}) time to first token: {:.3f}s, total: {:.3f}s", tool_name, mode, ttft, latency
+    )
+    truncated = result.finish_reason == 'MAX_TOKENS'
+    if truncated:
+        # 途中で終わった応答は、上限のない呼び出しや別の上限の呼び出しに返さないようキャッシュしない
+        logger.warning(
+            "{} response was truncated at max_output_tokens={}, not caching it",
+            tool_name, max_output_tokens,
+        )
+
+    if CACHE_ENABLED and not truncated:
+        await response_cache.set_async(cache_key, text, latency)
+    if _similarity_enabled(tool_name) and not truncated:
+        similarity_cache.add(
+            _similarity_scope(tool_name, model, system_instruction, temperature, max_output_tokens),
+            content,
+            text,
+        )
+    return text, {
+        'cached': False,
+        'context_cache': cache_handle is not None,
+        'mode': mode,
+        'ttft_seconds': round(ttft, 3),
+        'input_tokens': result.input_tokens,
+        'output_tokens': result.output_tokens,
+        'finish_reason': result.finish_reason,
+    }
+
+
+def _similarity_enabled(tool_name: str) -> bool:
+    return CACHE_ENABLED and SIMILARITY_CACHE_ENABLED and tool_name in SIMILARITY_CACHE_TOOLS
+
+
+def _similarity_scope(
+    tool_name: str,
+    model: str,
+    system_instruction: str,
+    temperature: Optional[float],
+    max_output_tokens: Optional[int] = None
+) -> str:
+    """類似キャッシュで結果を共有するリクエストの範囲を表すキーを返します"""
+    return make_cache_key(tool_name, model, system_instruction, temperature, "", max_output_tokens)
+
+
+class _StreamProgress:
+    """ストリーミングで送る進捗通知の送信先と、送信済みの進捗
+
+    インラインのプロンプトやスケジューラによる再試行では応答を最初から受信し直すため、
+    前の試行で送った位置を超えるまでは通知せず、進捗の値が戻らないようにします。
+    """
+
+    def __init__(self, ctx: Context):
+        self.ctx = ctx
+        self.reported = 0
+
+    async def report(self, received: int, text: str) -> None:
+        if received <= self.reported:
+            return
+        self.reported = received
+        await self.ctx.report_progress(progress=received, message=text)
+
+
+async def _call_model(
+    model: str,
+    content: str,
+    system_instruction: str,
+    temperature: Optional[float],
+    cache_handle: Optional[str],
+    progress: Optional[_StreamProgress],
+    max_output_tokens: Optional[int] = None
+) -> Tuple[GenerationResult, float]:
+    """バックエンドを呼び出し、生成結果と最初のトークンまでの時間を返します
+
+    cache_handleが指定された場合はシステムプロンプトの代わりにキャッシュ済み
+    コンテンツを参照します。progressが指定された場合はストリーミングで生成し、
+    受信した部分テキストを進捗通知として送信します。バッファリングモードでは
+    応答全体の受信時刻を最初のトークンの時刻とみなします。
+    """
+    request = {
+        'model': model,
+        'contents': content,
+        'system_instruction': None if cache_handle else system_instruction,
+        'temperature': temperature,
+        'cached_content': cache_handle,
+        'max_output_tokens': max_output_tokens,
+    }
+    started = time.perf_counter()
+    if progress is None:
+        result = await backend.generate(**request)
+        return result, time.perf_counter() - started
+
+    parts: List[str] = []
+    ttft: Optional[float] = None
+    received = 0
+    input_tokens = output_tokens = finish_reason = None
+    async for chunk in backend.generate_stream(**request):
+        input_tokens = chunk.input_tokens or input_tokens
+        output_tokens = chunk.output_tokens or output_tokens
+        finish_reason = chunk.finish_reason or finish_reason
+        if not chunk.text:
+            continue
+        if ttft is None:
+            ttft = time.perf_counter() - started
+        parts.append(chunk.text)
+        received += len(chunk.text)
+        await progress.report(received, chunk.text)
+    if ttft is None:
+        ttft = time.perf_counter() - started
+    return GenerationResult(''.join(parts), input_tokens, output_tokens, finish_reason), ttft
+
+
+async def _get_context_cache_handle(model: str, system_instruction: str) -> Optional[str]:
+    """コンテキストキャッシュが有効な場合にハンドル名を返します
+
+    登録に失敗した場合はNoneを返し、インラインのシステムプロンプトにフォールバックします。
+    """
+    if not CONTEXT_CACHE_ENABLED:
+        return None
+    try:
+        return await context_cache.get_handle(model, system_instruction)
+    except Exception as e:
+        logger.warning("Context cache registration failed for {}, using inline prompt: {}", model, e)
+        return None
+
+
+async def _preflight(
+    tool_name: str,
+    model: Optional[str],
+    system_instruction: str,
+    sections: List[Section],
+    build: Callable[[List[str]], str]
+) -> Tuple[str, Dict[str, Any], Optional[int]]:
+    """上流を呼び出す前に入力トークン数を確認し、送信するコンテンツを組み立てます
+
+    buildは各セクションのテキストからコンテンツを組み立てる関数です。入力が
+    ツールごとのトークン予算を超える場合は優先度の低いセクションから削ります。
+    DIVE_DEEP_EXACT_TOKEN_COUNTが有効で推定値が予算に近い場合は、バックエンドで
+    正確なトークン数を数えます。
+
+    Returns:
+        コンテンツ、メタデータに含めるプリフライトの結果、出力トークン数の上限
+
+    Raises:
+        TokenBudgetExceededError: 削ることのできない指示だけで予算を超える場合
+    """
+    budget = TOKEN_BUDGETS.get(tool_name, TOKEN_BUDGET)
+    content = build([section.text for section in sections])
+    prompt_tokens = estimate_tokens(system_instruction)
+    estimated = prompt_tokens + estimate_tokens(content)
+    report: Dict[str, Any] = {'budget': budget, 'estimated_input_tokens': estimated}
+
+    counted = estimated
+    if EXACT_TOKEN_COUNT and estimated > budget * EXACT_TOKEN_COUNT_THRESHOLD:
+        try:
+            counted = await backend.count_tokens(
+                model or DEFAULT_MODEL, content, system_instruction
+            )
+            report['exact_input_tokens'] = counted
+        except Exception as e:
+            logger.warning("Exact token count failed for {}, using the estimate: {}", tool_name, e)
+
+    trimmed: List[Dict[str, Any]] = []
+    if counted > budget:
+        # 削る量は推定値の尺度に換算する
+        excess = -(-(counted - budget) * estimated // counted)
+        texts, trimmed = trim_sections(sections, excess, budget)
+        content = build(texts)
+        estimated = prompt_tokens + estimate_tokens(content)
+        report['trimmed_input_tokens'] = estimated
+        logger.warning(
+            "{} input of ~{} tokens exceeds the budget of {}, trimmed {}",
+            tool_name, counted, budget, [t['section'] for t in trimmed],
+        )
+    report['trimmed'] = trimmed
+
+    max_output_tokens = output_token_cap(
+        estimated, OUTPUT_TOKEN_RATIO, MIN_OUTPUT_TOKENS, MAX_OUTPUT_TOKENS, CONTEXT_WINDOW
+    )
+    report['max_output_tokens'] = max_output_tokens
+    return content, report, max_output_tokens
+
+
+def _history_text(
+    summary: Optional[str],
+    turns: List[Turn],
+    exclude_tool: Optional[str] = None
+) -> str:
+    """会話の履歴をモデルに送るテキストにします"""
+    parts = [f"[summary of earlier calls]\n{summary}"] if summary else []
+    parts.extend(
+        f"[{turn.tool} request]\n{turn.request}\n\n[{turn.tool} answer]\n{turn.response}"
+        for turn in turns
+        if turn.tool != exclude_tool
+    )
+    return "\n\n".join(parts)
+
+
+async def _conversation_history(
+    session: Optional[Session],
+    exclude_tool: Optional[str] = None
+) -> str:
+    """セッションの会話の履歴を返します（セッションがない場合は空文字列）
+
+    古い往復の要約が実行中の場合は、その完了を待ってから返します。
+    """
+    if session is None:
+        return ""
+    task = session.summarizing
+    if task is not None and not task.done():
+        # 呼び出し元がキャンセルされても、ほかの呼び出しが使う要約は続ける
+        await asyncio.shield(task)
+    return _history_text(session.summary, session.turns, exclude_tool)
+
+
+def _with_history(history: str, content: str) -> str:
+    """会話の履歴がある場合は、新しいリクエストの前に付けます"""
+    if not history:
+        return content
+    return f"{CONVERSATION_HISTORY_NOTE.strip()}\n\n{history}\n\n[new request]\n{content}"
+
+
+def _record_turn(
+    session: Session,
+    tool_name: str,
+    request: str,
+    response: str,
+    model: Optional[str]
+) -> Dict[str, Any]:
+    """会話の履歴に往復を追加し、上限を超えた場合は古い往復の要約をバックグラウンドで始めます
+
+    往復はCONVERSATION_TURN_TOKENS以内に削って保持します（リクエストは半分まで）。
+
+    Returns:
+        メタデータに含める会話の履歴の状態
+    """
+    request = trim_text(request, CONVERSATION_TURN_TOKENS // 2)
+    response = trim_text(response, CONVERSATION_TURN_TOKENS - estimate_tokens(request))
+    tokens = estimate_tokens(request) + estimate_tokens(response)
+    session.add_turn(Turn(tool_name, request, response, tokens))
+    summarizing = session.summarizing is not None and not session.summarizing.done()
+    if not summarizing and session.needs_compaction(
+        CONVERSATION_MAX_TURNS, CONVERSATION_TOKEN_BUDGET, CONVERSATION_KEEP_TURNS
+    ):
+        session.summarizing = asyncio.ensure_future(_summarize_conversation(session, model))
+    return {
+        'turns': len(session.turns),
+        'summarized_turns': session.summarized_turns,
+        'history_tokens': session.history_tokens(),
+        'memory_bytes': session.memory_bytes(),
+    }
+
+
+async def _summarize_conversation(session: Session, model: Optional[str]) -> None:
+    """直近のCONVERSATION_KEEP_TURNS往復を残して、古い往復と前回の要約を1つの要約にまとめます
+
+    要約に失敗した場合は、古い往復を要約せずに捨てて履歴を上限内に収めます。
+    """
+    count = len(session.turns) - CONVERSATION_KEEP_TURNS
+    if count <= 0:
+        return
+    started = time.perf_counter()
+    try:
+        content, _, _ = await _preflight(
+            'conversation_summary',
+            model,
+            CONVERSATION_SUMMARY_PROMPT,
+            [Section('history', _history_text(session.summary, session.turns[:count]))],
+            lambda texts: texts[0],
+        )
+        summary, _ = await _generate_content(
+            tool_name='conversation_summary',
+            model=model,
+            content=content,
+            system_instruction=CONVERSATION_SUMMARY_PROMPT,
+            max_output_tokens=CONVERSATION_SUMMARY_TOKENS,
+        )
+    except Exception as e:
+        logger.warning("Conversation summary failed, dropping the {} oldest turns: {}", count, e)
+        session.compact(count, None, 0)
+        return
+    # 推定トークン数は上流のトークン数とずれるため、要約も上限内に削る
+    summary = trim_text(summary, CONVERSATION_SUMMARY_TOKENS)
+    session.compact(count, summary, estimate_tokens(summary))
+    logger.info(
+        "Summarized {} turns of a session in {:.3f}s (history ~{} tokens)",
+        count, time.perf_counter() - started, session.history_tokens(),
+    )
+
+
+async def _think(
+    instructions: str,
+    context: str,
+    model: Optional[str],
+    bypass_cache: bool,
+    ctx: Optional[Context] = None,
+    stream: Optional[bool] = None,
+    session: Optional[Session] = None
+) -> Tuple[str, Dict[str, Any]]:
+    """思考プロセスのコンテキストを分析します（予算を超える場合はコンテキストを削ります）
+
+    sessionを指定すると、セッションの会話の履歴をリクエストの前に付け、
+    このリクエストと回答を履歴に追加します。
+    """
+    request = f"instructions from user: {instructions}\nthinking process: {context}"
+    content, report, max_output_tokens = await _preflight(
+        'deep_thinking_agent',
+        model,
+        DEEP_THINKING_PROMPT,
+        [
+            Section('instructions', instructions, priority=2, trimmable=False),
+            Section('context', context),
+            Section('conversation', await _conversation_history(session), priority=0),
+        ],
+        lambda texts: _with_history(
+            texts[2], f"instructions from user: {texts[0]}\nthinking process: {texts[1]}"
+        ),
+    )
+    text, metadata = await _generate_content(
+        tool_name='deep_thinking_agent',
+        model=model,
+        content=content,
+        system_instruction=DEEP_THINKING_PROMPT,
+        bypass_cache=bypass_cache,
+        ctx=ctx,
+        stream=stream,
+        max_output_tokens=max_output_tokens,
+    )
+    metadata = {**metadata, 'preflight': report}
+    if session is not None:
+        metadata['conversation'] = _record_turn(session, 'deep_thinking_agent', request, text, model)
+    return text, metadata
+
+
+def _code_request_excerpt(
+    instructions: str,
+    code: List[str],
+    paths: Optional[List[str]] = None
+) -> str:
+    """会話の履歴に残すコードのリクエストを、ファイルの内容の代わりに一覧で表します"""
+    names = [paths[i] if paths and i < len(paths) else f"code[{i}]" for i in range(len(code))]
+    files = "\n".join(
+        f"- {name} ({len(text.splitlines())} lines)" for name, text in zip(names, code)
+    )
+    return f"instructions: {instructions}\ncode ({len(code)} files, contents not kept):\n{files}"
+
+
+def _build_code_content(
+    instructions: str,
+    code: List[str],
+    paths: Optional[List[Optional[str]]] = None
+) -> str:
+    """コードを分析するツールに送信するコンテンツを組み立てます"""
+    encoded = encode_code(code, paths, CODE_ENCODING, CODE_LINE_NUMBERS, CODE_MINIFY)
+    if CODE_ENCODING == 'json':
+        return f"instructions: {instructions}\ncode: {encoded}"
+    return f"instructions: {instructions}\ncode:\n{encoded}"
+
+
+async def _analyze_code(
+    tool_name: str,
+    system_instruction: str,
+    instructions: str,
+    code: List[str],
+    model: Optional[str],
+    temperature: float,
+    bypass_cache: bool,
+    ctx: Optional[Context],
+    stream: Optional[bool],
+    map_reduce: Optional[bool],
+    paths: Optional[List[str]] = None,
+    session: Optional[Session] = None
+) -> Tuple[str, Dict[str, Any]]:
+    """コードのリストを分析します
+
+    pathsを指定すると、各ファイルのヘッダにパスと推定した言語が含まれます。
+    map-reduceモードでは、コードをCHUNK_TOKEN_BUDGET以内のチャンクに分割して
+    並列に分析し（map）、部分的な分析結果を最後の呼び出しで統合します（reduce）。
+    mapとreduceの各呼び出しも予算の確認と出力トークン数の上限の対象になります。
+    チャンクが1つに収まる場合は通常の単一リクエストで分析します。
+    sessionを指定すると、単一リクエストではセッションの会話の履歴をリクエストの前に付け、
+    いずれのモードでもこのリクエストと回答を履歴に追加します。
+    """
+    use_map_reduce = MAP_REDUCE_ENABLED if map_reduce is None else map_reduce
+    chunks = (
+        chunk_files(code, paths, CHUNK_TOKEN_BUDGET) if use_map_reduce else [(code, paths)]
+    )
+    if len(chunks) <= 1:
+        names = [
+            paths[i] if paths and i < len(paths) else f"code[{i}]" for i in range(len(code))
+        ]
+        content, report, max_output_tokens = await _preflight(
+            tool_name,
+            model,
+            system_instruction,
+            [Section('instructions', instructions, priority=2, trimmable=False)]
+            + [Section(name, text) for name, text in zip(names, code)]
+            + [Section('conversation', await _conversation_history(session), priority=0)],
+            lambda texts: _with_history(
+                texts[-1], _build_code_content(texts[0], texts[1:-1], paths)
+            ),
+        )
+        text, metadata = await _generate_content(
+            tool_name=tool_name,
+            model=model,
+            content=content,
+            system_instruction=system_instruction,
+            temperature=temperature,
+            bypass_cache=bypass_cache,
+            ctx=ctx,
+            stream=stream,
+            max_output_tokens=max_output_tokens,
+        )
+        metadata = {**metadata, 'preflight': report}
+        if session is not None:
+            metadata['conversation'] = _record_turn(
+                session, tool_name, _code_request_excerpt(instructions, code, paths), text, model
+            )
+        return text, metadata
+
+    total = len(chunks)
+    logger.info("{} map-reduce: {} files split into {} chunks", tool_name, len(code), total)
+
+    async def analyze_chunk(
+        index: int,
+        chunk: List[str],
+        chunk_paths: Optional[List[Optional[str]]]
+    ) -> str:
+        chunk_instructions = (
+            MAP_CHUNK_INSTRUCTIONS.format(index=index + 1, total=total) + instructions
+        )
+        names = [
+            chunk_paths[i] if chunk_paths and chunk_paths[i] else f"code[{i}]"
+            for i in range(len(chunk))
+        ]
+        content, _, max_output_tokens = await _preflight(
+            tool_name,
+            model,
+            system_instruction,
+            [Section('instructions', chunk_instructions, priority=2, trimmable=False)]
+            + [Section(name, text) for name, text in zip(names, chunk)],
+            lambda texts: _build_code_content(texts[0], texts[1:], chunk_paths),
+        )
+        started = time.perf_counter()
+        # 部分的な結果はストリーミングしないが、セッションごとの同時実行数の制限は受ける
+        text, _ = await _generate_content(
+            tool_name=f"{tool_name}:map",
+            model=model,
+            content=content,
+            system_instruction=system_instruction,
+            temperature=temperature,
+            bypass_cache=bypass_cache,
+            ctx=ctx,
+            stream=False,
+            max_output_tokens=max_output_tokens,
+        )
+        elapsed = time.perf_counter() - started
+        logger.info(
+            "{} chunk {}/{}: {} files, ~{} tokens, {:.3f}s",
+            tool_name, index + 1, total, len(chunk), estimate_tokens(content), elapsed,
+        )
+        return text
+
+    started = time.perf_counter()
+    findings = await asyncio.gather(
+        *(
+            analyze_chunk(index, chunk, chunk_paths)
+            for index, (chunk, chunk_paths) in enumerate(chunks)
+        )
+    )
+    map_seconds = time.perf_counter() - started
+
+    # 部分的な結果の合計も予算を超えうるため、チャンクごとの結果を削れるセクションにする
+    content, report, max_output_tokens = await _preflight(
+        tool_name,
+        model,
+        system_instruction,
+        [Section(
+            'instructions',
+            MAP_REDUCE_MERGE_INSTRUCTIONS.format(total=total) + instructions,
+            priority=2,
+            trimmable=False,
+        )]
+        + [
+            Section(f"findings for chunk {index + 1}/{total}", text)
+            for index, text in enumerate(findings)
+        ],
+        lambda texts: f"instructions: {texts[0]}\npartial findings:\n" + "\n\n".join(
+            f"## Findings for chunk {index + 1}/{total}\n{text}"
+            for index, text in enumerate(texts[1:])
+        ),
+    )
+    text, metadata = await _generate_content(
+        tool_name=f"{tool_name}:reduce",
+        model=model,
+        content=content,
+        system_instruction=system_instruction,
+        temperature=temperature,
+        bypass_cache=bypass_cache,
+        ctx=ctx,
+        stream=stream,
+        max_output_tokens=max_output_tokens,
+    )
+    metadata = {**metadata, 'preflight': report}
+    metadata['map_reduce'] = {'chunks': total, 'map_seconds': round(map_seconds, 3)}
+    if session is not None:
+        metadata['conversation'] = _record_turn(
+            session, tool_name, _code_request_excerpt(instructions, code, paths), text, model
+        )
+    return text, metadata
+
+
+async def _review_incremental(
+    session_id: str,
+    paths: Optional[List[str]],
+    instructions: str,
+    code: List[str],
+    model: Optional[str],
+    temperature: float,
+    bypass_cache: bool,
+    ctx: Optional[Context],
+    stream: Optional[bool],
+    map_reduce: Optional[bool]
+) -> Tuple[str, Dict[str, Any]]:
+    """セッションで前回レビューしたファイルとの差分をレビューします
+
+    セッションの最初の呼び出しでは全文をレビューします。以降の呼び出しでは、
+    変更されたファイルの差分（周辺の行を含む）と新しいファイルの全文だけを、
+    前回のレビュー結果の要約とともにモデルに送ります。いずれの場合もセッションの
+    会話の履歴を付けます（差分のレビューでは、前回のレビュー結果と重複する
+    final_review_agentの往復を除きます）。同じセッションの呼び出しは1つずつ実行されます。
+    ファイルの合計サイズがセッションの上限を超える場合は、次回の差分の基準として保持しません。
+    """
+    if paths is None:
+        # 位置で対応付けると、ファイルを1つ挿入しただけで後ろのファイルがすべて変更扱いになる
+        raise ValueError("paths is required with session_id (one file path per code element)")
+    if len(paths) != len(code):
+        raise ValueError("paths must have one entry per code element")
+    if len(set(paths)) != len(paths):
+        raise ValueError("paths must be unique")
+    files = dict(zip(paths, code))
+    full_tokens = estimate_tokens(_build_code_content(instructions, code, paths))
+    session = session_store.get(session_id, _client_session(ctx))
+    # 同じセッションの呼び出しが前回のファイルとレビュー結果を同時に読み書きしないようにする
+    async with session.review_lock:
+        if not session.reviewed_files or session.last_review is None:
+            text, metadata = await _analyze_code(
+                tool_name='final_review_agent',
+                system_instruction=DEEP_REVIEW_PROMPT,
+                instructions=instructions,
+                code=code,
+                model=model,
+                temperature=temperature,
+                bypass_cache=bypass_cache,
+                ctx=ctx,
+                stream=stream,
+                map_reduce=map_reduce,
+                paths=paths,
+                session=session,
+            )
+            incremental = {
+                'mode': 'full',
+                'files': len(files),
+                'estimated_input_tokens': full_tokens,
+                'estimated_full_tokens': full_tokens,
+            }
+        else:
+            changes = diff_files(session.reviewed_files, files, DIFF_CONTEXT_LINES)
+            summary = session.last_review
+            if len(summary) > REVIEW_SUMMARY_CHARS:
+                summary = summary[:REVIEW_SUMMARY_CHARS] + "\n..."
+            history = await _conversation_history(session, exclude_tool='final_review_agent')
+            content, report, max_output_tokens = await _preflight(
+                'final_review_agent',
+                model,
+                DEEP_REVIEW_PROMPT,
+                [
+                    Section('instructions', instructions, priority=2, trimmable=False),
+                    Section('previous review summary', summary, priority=0),
+                    Section('changes', render_changes(changes)),
+                    Section('conversation', history, priority=0),
+                ],
+                lambda texts: _with_history(texts[3], (
+                    f"instructions: {INCREMENTAL_REVIEW_INSTRUCTIONS}{texts[0]}\n"
+                    f"previous review summary:\n{texts[1]}\n\n"
+                    f"{texts[2]}"
+                )),
+            )
+            text, metadata = await _generate_content(
+                tool_name='final_review_agent',
+                model=model,
+                content=content,
+                system_instruction=DEEP_REVIEW_PROMPT,
+                temperature=temperature,
+                bypass_cache=bypass_cache,
+                ctx=ctx,
+                stream=stream,
+                max_output_tokens=max_output_tokens,
+            )
+            metadata['preflight'] = report
+            metadata['conversation'] = _record_turn(
+                session,
+                'final_review_agent',
+                f"instructions: {instructions}\n\n{render_changes(changes)}",
+                text,
+                model,
+            )
+            counts: Dict[str, int] = {}
+            for change in changes:
+                counts[change.status] = counts.get(change.status, 0) + 1
+            # 全文のレビューと比べられるよう、会話の履歴の分は別に示す
+            history_tokens = estimate_tokens(_with_history(history, "")) if history else 0
+            incremental = {
+                'mode': 'diff',
+                'files': counts,
+                'estimated_input_tokens': estimate_tokens(content) - history_tokens,
+                'estimated_history_tokens': history_tokens,
+                'estimated_full_tokens': full_tokens,
+            }
+            logger.info(
+                "Incremental review for session {}: {} (estimated tokens {} instead of {})",
+                session_id, counts, incremental['estimated_input_tokens'], full_tokens,
+            )
+
+        incremental['retained'] = session.save_review(files, text, session_store.max_review_bytes)
+        return text, {**metadata, 'incremental': incremental}
+
+
 @mcp.tool(name='deep_thinking_agent',
-           description=DEEP_THINKING_AGENT_DESCRIPTION)
-def deep_thinking_agent(
+           description=_describe('deep_thinking_agent'),
+           structured_output=False)
+@_traced('deep_thinking_agent')
+async def deep_thinking_agent(
     instructions: str,
     context: str,
-    model: str = DEFAULT_MODEL
+    model: Optional[str] = None,
+    bypass_cache: bool = False,
+    stream: Optional[bool] = None,
+    session_id: Optional[str] = None,
+    timeout_seconds: Optional[float] = None,
+    ctx: Optional[Context] = None
 ) -> McpResponse:
     """deep_thinking_agentを実行し、着眼点を提示し思考範囲を拡大します。
 
     Args:
         context: 思考プロセスのコンテキスト
-        model: 使用するモデル名（デフォルト: "gemini-2.0-flash"）
+        model: 使用するモデル名（省略時はDIVE_DEEP_MODEL_ROUTESのルートで選択）
+        bypass_cache: Trueの場合はレスポンスキャッシュを使用しない
+        stream: 部分テキストを進捗通知で送るか（省略時はDIVE_DEEP_STREAMINGに従う）
+        session_id: 指定するとセッションの会話の履歴を使い、このリクエストと回答を履歴に追加する
+        timeout_seconds: 呼び出しの期限（秒、省略時はDIVE_DEEP_CALL_TIMEOUTに従う）
     """
-    logger.info(f"Starting deep_thinking_agent with model: {model}")
-    logger.debug(f"Instructions: {instructions}")
-    logger.debug(f"Context length: {len(context)} characters")
+    logger.info("Starting deep_thinking_agent with model: {}", model or "auto")
+    logger.debug("Instructions: {instructions}", instructions=payload(instructions))
+    logger.debug("Context length: {} characters", len(context))
     
     try:
-        # システムプロンプトの設定
-        content = f"instructions from user: {instructions}\nthinking process: {context}"
-
         logger.debug("Sending request to Gemini API")
-        response = client.models.generate_content(
-            model=model,
-            contents=content,
-            config=GenerateContentConfig(
-                system_instruction=DEEP_THINKING_PROMPT,
+        text, metadata = await _with_deadline(
+            _think(
+                instructions, context, model, bypass_cache, ctx=ctx, stream=stream,
+                session=_session(session_id, ctx),
             ),
+            timeout_seconds,
         )
         
         logger.info("Successfully received response from deep_thinking_agent")
@@ -85,12 +1280,22 @@ def deep_thinking_agent(
             'content': [
                 {
                     'type': 'text',
-                    'text': response.text,
+                    'text': text,
                 }
-            ]
+            ],
+            'metadata': metadata,
+        }
+    except asyncio.CancelledError:
+        logger.info("deep_thinking_agent was cancelled by the client")
+        raise
+    except DeadlineExceededError as e:
+        logger.warning("deep_thinking_agent: {}", e)
+        return {
+            'content': [{'type': 'text', 'text': f'Error in content generation: {e}'}],
+            'isError': True,
         }
     except Exception as e:
-        logger.error(f'Error in deep_thinking_agent: {str(e)}', exc_info=True)
+        logger.exception("Error in deep_thinking_agent: {}", e)
         return {
             'content': [{'type': 'text', 'text': f'Error in content generation: {e}'}],
             'isError': True,
@@ -98,50 +1303,78 @@ def deep_thinking_agent(
 
 
 @mcp.tool(name='enhancement_agent',
-           description=ENHANCEMENT_AGENT_DESCRIPTION)
-def enhancement_agent(
+           description=_describe('enhancement_agent'),
+           structured_output=False)
+@_traced('enhancement_agent')
+async def enhancement_agent(
     instructions: str,
     code: list[str],
-    model: str = DEFAULT_MODEL,
-    temperature: float = 0.7
+    model: Optional[str] = None,
+    temperature: float = 0.7,
+    bypass_cache: bool = False,
+    stream: Optional[bool] = None,
+    map_reduce: Optional[bool] = None,
+    paths: Optional[list[str]] = None,
+    session_id: Optional[str] = None,
+    timeout_seconds: Optional[float] = None,
+    ctx: Optional[Context] = None
 ) -> McpResponse:
     """enhancement_agentを実行し、深い思考と分析を提供します。
 
     Args:
         instructions: レビュー対象のコードに対する指示
-        code: コードのリスト
-        model: 使用するモデル名（デフォルト: "gemini-2.0-flash"）
+        code: コードのリスト（送信済みのファイルは"sha256:<ハッシュ>"の参照で指定できます）
+        model: 使用するモデル名（省略時はDIVE_DEEP_MODEL_ROUTESのルートで選択）
         temperature: 生成時の温度パラメータ（デフォルト: 0.7）
+        bypass_cache: Trueの場合はレスポンスキャッシュを使用しない
+        stream: 部分テキストを進捗通知で送るか（省略時はDIVE_DEEP_STREAMINGに従う）
+        map_reduce: コードをチャンクに分けて分析するか（省略時はDIVE_DEEP_MAP_REDUCEに従う）
+        paths: codeの各要素のファイルパス（ファイルごとのヘッダに含まれます）
+        session_id: 指定するとセッションの会話の履歴を使い、このリクエストと回答を履歴に追加する
+        timeout_seconds: 呼び出しの期限（秒、省略時はDIVE_DEEP_CALL_TIMEOUTに従う）
     """
-    logger.info(f"Starting enhancement_agent with model: {model}")
-    logger.debug(f"Instructions: {instructions}")
-    logger.debug(f"Number of code files: {len(code)}")
+    logger.info("Starting enhancement_agent with model: {}", model or "auto")
+    logger.debug("Instructions: {instructions}", instructions=payload(instructions))
+    logger.debug("Number of code files: {}", len(code))
     
     try:
-        # コンテンツの準備
-        content = f"instructions: {instructions}\ncode: {json.dumps(code, ensure_ascii=False)}"
-
-        logger.debug("Sending request to Gemini API")
-        response = client.models.generate_content(
+        code = blob_store.resolve(code)
+        text, metadata = await _with_deadline(_analyze_code(
+            tool_name='enhancement_agent',
+            system_instruction=ADVANCED_ANALYSIS_PROMPT,
+            instructions=instructions,
+            code=code,
             model=model,
-            contents=content,
-            config=GenerateContentConfig(
-                system_instruction=ADVANCED_ANALYSIS_PROMPT,
-                temperature=temperature,
-            ),
-        )
+            temperature=temperature,
+            bypass_cache=bypass_cache,
+            ctx=ctx,
+            stream=stream,
+            map_reduce=map_reduce,
+            paths=paths,
+            session=_session(session_id, ctx),
+        ), timeout_seconds)
         
         logger.info("Successfully received response from enhancement_agent")
         return {
             'content': [
                 {
                     'type': 'text',
-                    'text': response.text,
+                    'text': text,
                 }
-            ]
+            ],
+            'metadata': metadata,
+        }
+    except asyncio.CancelledError:
+        logger.info("enhancement_agent was cancelled by the client")
+        raise
+    except DeadlineExceededError as e:
+        logger.warning("enhancement_agent: {}", e)
+        return {
+            'content': [{'type': 'text', 'text': f'Error in content generation: {e}'}],
+            'isError': True,
         }
     except Exception as e:
-        logger.error(f'Error in enhancement_agent: {str(e)}', exc_info=True)
+        logger.exception("Error in enhancement_agent: {}", e)
         return {
             'content': [{'type': 'text', 'text': f'Error in content generation: {e}'}],
             'isError': True,
@@ -149,67 +1382,625 @@ def enhancement_agent(
 
 
 @mcp.tool(name='final_review_agent',
-           description=FINAL_REVIEW_AGENT_DESCRIPTION)
-def final_review_agent(
+           description=_describe('final_review_agent'),
+           structured_output=False)
+@_traced('final_review_agent')
+async def final_review_agent(
     instructions: str,
     code: list[str],
-    model: str = DEFAULT_MODEL,
-    temperature: float = 0.7
+    model: Optional[str] = None,
+    temperature: float = 0.7,
+    bypass_cache: bool = False,
+    stream: Optional[bool] = None,
+    map_reduce: Optional[bool] = None,
+    session_id: Optional[str] = None,
+    paths: Optional[list[str]] = None,
+    timeout_seconds: Optional[float] = None,
+    ctx: Optional[Context] = None
 ) -> McpResponse:
     """提案された回答や解決策を批判的に分析し、改善点を提示します。
 
     Args:
         instructions: レビュー対象のコードに対する指示
-        code: コードのリスト
-        model: 使用するモデル名（デフォルト: "gemini-2.0-flash"）
+        code: コードのリスト（送信済みのファイルは"sha256:<ハッシュ>"の参照で指定できます）
+        model: 使用するモデル名（省略時はDIVE_DEEP_MODEL_ROUTESのルートで選択）
         temperature: 生成時の温度パラメータ（デフォルト: 0.7）
+        bypass_cache: Trueの場合はレスポンスキャッシュを使用しない
+        stream: 部分テキストを進捗通知で送るか（省略時はDIVE_DEEP_STREAMINGに従う）
+        map_reduce: コードをチャンクに分けて分析するか（省略時はDIVE_DEEP_MAP_REDUCEに従う）
+        session_id: 指定すると前回のレビューからの差分だけをレビューし（インクリメンタルモード、
+            pathsが必須）、セッションの会話の履歴を使う
+        paths: codeの各要素のファイルパス（ファイルごとのヘッダと、インクリメンタルモードでの
+            ファイルの対応付けに使用）
+        timeout_seconds: 呼び出しの期限（秒、省略時はDIVE_DEEP_CALL_TIMEOUTに従う）
     """
-    logger.info(f"Starting final_review_agent with model: {model}")
-    logger.debug(f"Instructions: {instructions}")
-    logger.debug(f"Number of code files: {len(code)}")
+    logger.info("Starting final_review_agent with model: {}", model or "auto")
+    logger.debug("Instructions: {instructions}", instructions=payload(instructions))
+    logger.debug("Number of code files: {}", len(code))
     
     try:
-        # コンテンツの準備
-        content = f"instructions: {instructions}\ncode: {json.dumps(code, ensure_ascii=False)}"
-
-        logger.debug("Sending request to Gemini API")
-        response = client.models.generate_content(
-            model=model,
-            contents=content,
-            config=GenerateContentConfig(
+        code = blob_store.resolve(code)
+        if session_id:
+            review = _review_incremental(
+                session_id=session_id,
+                paths=paths,
+                instructions=instructions,
+                code=code,
+                model=model,
+                temperature=temperature,
+                bypass_cache=bypass_cache,
+                ctx=ctx,
+                stream=stream,
+                map_reduce=map_reduce,
+            )
+        else:
+            review = _analyze_code(
+                tool_name='final_review_agent',
                 system_instruction=DEEP_REVIEW_PROMPT,
+                instructions=instructions,
+                code=code,
+                model=model,
                 temperature=temperature,
-            ),
-        )
+                bypass_cache=bypass_cache,
+                ctx=ctx,
+                stream=stream,
+                map_reduce=map_reduce,
+                paths=paths,
+            )
+        text, metadata = await _with_deadline(review, timeout_seconds)
         
         logger.info("Successfully received response from final_review_agent")
         return {
             'content': [
                 {
                     'type': 'text',
-                    'text': response.text,
+                    'text': text,
+                }
+            ],
+            'metadata': metadata,
+        }
+    except asyncio.CancelledError:
+        logger.info("final_review_agent was cancelled by the client")
+        raise
+    except DeadlineExceededError as e:
+        logger.warning("final_review_agent: {}", e)
+        return {
+            'content': [{'type': 'text', 'text': f'Error in content generation: {e}'}],
+            'isError': True,
+        }
+    except Exception as e:
+        logger.exception("Error in final_review_agent: {}", e)
+        return {
+            'content': [{'type': 'text', 'text': f'Error in content generation: {e}'}],
+            'isError': True,
+        }
+
+
+@mcp.tool(name='dive_deep_pipeline',
+           description=_describe('dive_deep_pipeline'),
+           structured_output=False)
+@_traced('dive_deep_pipeline')
+async def dive_deep_pipeline(
+    instructions: str,
+    code: list[str],
+    context: str = "",
+    model: Optional[str] = None,
+    temperature: float = 0.7,
+    bypass_cache: bool = False,
+    stream: Optional[bool] = None,
+    map_reduce: Optional[bool] = None,
+    timeout_seconds: Optional[float] = None,
+    ctx: Optional[Context] = None
+) -> McpResponse:
+    """思考の深化・改善分析・最終レビューを1回の呼び出しでサーバー上で実行します。
+
+    思考プロセスの分析とコードの改善分析は互いに依存しないため並行して実行し、
+    最終レビューにはコードと両方の出力を直接渡します。各ステージの上流呼び出しは
+    呼び出し元のセッションの同時実行数の制限を受けます。最終レビューをストリーミング
+    しない場合は、ステージが完了するごとに進捗通知を送ります。
+
+    Args:
+        instructions: ユーザーからの指示
+        code: コードのリスト（送信済みのファイルは"sha256:<ハッシュ>"の参照で指定できます）
+        context: 思考プロセスのコンテキスト（空の場合は思考の深化を省略）
+        model: 使用するモデル名（省略時はDIVE_DEEP_MODEL_ROUTESのルートで選択）
+        temperature: 改善分析と最終レビューの温度パラメータ（デフォルト: 0.7）
+        bypass_cache: Trueの場合はレスポンスキャッシュを使用しない
+        stream: 最終レビューの部分テキストを進捗通知で送るか
+        map_reduce: コードをチャンクに分けて分析するか
+        timeout_seconds: パイプライン全体の期限（秒、省略時はDIVE_DEEP_CALL_TIMEOUTに従う）
+    """
+    logger.info("Starting dive_deep_pipeline with model: {}", model or "auto")
+    logger.debug("Number of code files: {}", len(code))
+
+    stage_metadata: Dict[str, Dict[str, Any]] = {}
+    stage_count = 3 if context else 2
+    # ストリーミングする最終レビューの進捗（受信した文字数）と値が混ざらないようにする
+    report_stages = ctx is not None and not (STREAMING_ENABLED if stream is None else stream)
+
+    async def run_stage(name: str, coro) -> str:
+        started = time.perf_counter()
+        text, metadata = await coro
+        seconds = time.perf_counter() - started
+        stage_metadata[name] = {**metadata, 'seconds': round(seconds, 3)}
+        logger.info("dive_deep_pipeline stage {} finished in {:.3f}s", name, seconds)
+        if report_stages:
+            await ctx.report_progress(
+                progress=len(stage_metadata), total=stage_count,
+                message=f"{name} finished in {seconds:.3f}s",
+            )
+        return text
+
+    async def skipped() -> str:
+        return ""
+
+    async def run_stages(code: List[str]) -> Tuple[str, str, str]:
+        thinking_stage = run_stage(
+            'deep_thinking_agent',
+            # 並行する2つのステージの部分テキストが混ざらないよう、ストリーミングは最終レビューだけ
+            _think(instructions, context, model, bypass_cache, ctx=ctx, stream=False),
+        ) if context else skipped()
+        enhancement_stage = run_stage('enhancement_agent', _analyze_code(
+            tool_name='enhancement_agent',
+            system_instruction=ADVANCED_ANALYSIS_PROMPT,
+            instructions=instructions,
+            code=code,
+            model=model,
+            temperature=temperature,
+            bypass_cache=bypass_cache,
+            ctx=ctx,
+            stream=False,
+            map_reduce=map_reduce,
+        ))
+        stages = [asyncio.ensure_future(thinking_stage), asyncio.ensure_future(enhancement_stage)]
+        try:
+            thinking, enhancement = await asyncio.gather(*stages)
+        except Exception:
+            # 片方の段階が失敗した場合、もう片方が上流の実行枠を使い続けないようにキャンセルする
+            for stage in stages:
+                stage.cancel()
+            raise
+
+        review_instructions = instructions
+        if thinking:
+            review_instructions += f"\n\nfeedback on the thought process:\n{thinking}"
+        review_instructions += f"\n\nenhancement analysis of the code:\n{enhancement}"
+        review = await run_stage('final_review_agent', _analyze_code(
+            tool_name='final_review_agent',
+            system_instruction=DEEP_REVIEW_PROMPT,
+            instructions=review_instructions,
+            code=code,
+            model=model,
+            temperature=temperature,
+            bypass_cache=bypass_cache,
+            ctx=ctx,
+            stream=stream,
+            map_reduce=map_reduce,
+        ))
+        return thinking, enhancement, review
+
+    try:
+        code = blob_store.resolve(code)
+        started = time.perf_counter()
+        thinking, enhancement, review = await _with_deadline(run_stages(code), timeout_seconds)
+        total_seconds = time.perf_counter() - started
+
+        sections = []
+        if thinking:
+            sections.append(f"# deep_thinking_agent\n{thinking}")
+        sections.append(f"# enhancement_agent\n{enhancement}")
+        sections.append(f"# final_review_agent\n{review}")
+
+        logger.info("Successfully completed dive_deep_pipeline in {:.3f}s", total_seconds)
+        return {
+            'content': [
+                {
+                    'type': 'text',
+                    'text': "\n\n".join(sections),
                 }
-            ]
+            ],
+            'metadata': {
+                'stages': stage_metadata,
+                'total_seconds': round(total_seconds, 3),
+            },
+        }
+    except asyncio.CancelledError:
+        logger.info("dive_deep_pipeline was cancelled by the client")
+        raise
+    except DeadlineExceededError as e:
+        logger.warning("dive_deep_pipeline: {}", e)
+        return {
+            'content': [{'type': 'text', 'text': f'Error in content generation: {e}'}],
+            'isError': True,
         }
     except Exception as e:
-        logger.error(f'Error in final_review_agent: {str(e)}', exc_info=True)
+        logger.exception("Error in dive_deep_pipeline: {}", e)
         return {
             'content': [{'type': 'text', 'text': f'Error in content generation: {e}'}],
             'isError': True,
         }
 
 
+# batch_reviewのagentに指定できるツールとそのシステムプロンプト
+_BATCH_AGENTS = {
+    'final_review_agent': DEEP_REVIEW_PROMPT,
+    'enhancement_agent': ADVANCED_ANALYSIS_PROMPT,
+}
+
+
+@mcp.tool(name='batch_review',
+           description=_describe('batch_review'),
+           structured_output=False)
+@_traced('batch_review')
+async def batch_review(
+    jobs: list[BatchJob],
+    agent: str = 'final_review_agent',
+    model: Optional[str] = None,
+    temperature: float = 0.7,
+    bypass_cache: bool = False,
+    concurrency: Optional[int] = None,
+    upstream_batch: bool = False,
+    timeout_seconds: Optional[float] = None,
+    ctx: Optional[Context] = None
+) -> McpResponse:
+    """独立した複数のレビュージョブをまとめて実行します。
+
+    ジョブは同時実行数に上限のあるワーカープールで実行され、完了したジョブから
+    結果のテキスト（BATCH_PROGRESS_CHARSまで）とともに進捗通知で報告されます。
+    ジョブごとのエラーは他のジョブに影響しません。各ジョブの上流呼び出しは
+    呼び出し元のクライアントセッションの同時実行数の制限を受けます。
+
+    Args:
+        jobs: instructionsとcode（と任意のid）を持つジョブのリスト
+        agent: 各ジョブを実行するツール（final_review_agentまたはenhancement_agent）
+        model: 使用するモデル名（省略時はDIVE_DEEP_MODEL_ROUTESのルートで選択）
+        temperature: 生成時の温度パラメータ（デフォルト: 0.7）
+        bypass_cache: Trueの場合はレスポンスキャッシュを使用しない
+        concurrency: 同時に実行するジョブ数（DIVE_DEEP_BATCH_CONCURRENCYが既定値かつ上限）
+        upstream_batch: Trueの場合は上流のバッチAPIにまとめて送信する（完了まで長時間かかります）
+        timeout_seconds: ジョブごとの期限（秒、省略時はDIVE_DEEP_CALL_TIMEOUTに従う。
+            upstream_batchではDIVE_DEEP_UPSTREAM_BATCH_TIMEOUTが適用されます）
+    """
+    logger.info(
+        "Starting batch_review with {} jobs, agent: {}, model: {}", len(jobs), agent, model or "auto"
+    )
+    if agent not in _BATCH_AGENTS:
+        return {
+            'content': [{'type': 'text', 'text': f'Unknown agent for batch_review: {agent}'}],
+            'isError': True,
+        }
+
+    total = len(jobs)
+    results: List[Optional[Dict[str, Any]]] = [None] * total
+    texts: List[str] = [''] * total
+    completed = 0
+    started = time.perf_counter()
+
+    async def report(index: int) -> None:
+        nonlocal completed
+        completed += 1
+        if ctx is not None:
+            update = dict(results[index])
+            if update['ok']:
+                text = texts[index]
+                truncated = 0 < BATCH_PROGRESS_CHARS < len(text)
+                update['text'] = text[:BATCH_PROGRESS_CHARS] if truncated else text
+                update['truncated'] = truncated
+            await ctx.report_progress(
+                progress=completed, total=total, message=json.dumps(update)
+            )
+
+    def job_id(index: int) -> str:
+        return str(jobs[index].get('id') or index + 1)
+
+    async def run_job(index: int) -> None:
+        job = jobs[index]
+        job_started = time.perf_counter()
+        try:
+            code = blob_store.resolve(job.get('code') or [])
+            text, metadata = await _with_deadline(_analyze_code(
+                tool_name=agent,
+                system_instruction=_BATCH_AGENTS[agent],
+                instructions=job.get('instructions', ''),
+                code=code,
+                model=model,
+                temperature=temperature,
+                bypass_cache=bypass_cache,
+                # ストリーミングはしないが、セッションごとの同時実行数の制限は受ける
+                ctx=ctx,
+                stream=False,
+                map_reduce=None,
+            ), timeout_seconds)
+            texts[index] = text
+            results[index] = {'id': job_id(index), 'ok': True, 'metadata': metadata}
+        except Exception as e:
+            logger.warning("batch_review job {} failed: {}", job_id(index), e)
+            results[index] = {'id': job_id(index), 'ok': False, 'error': str(e)}
+        results[index]['seconds'] = round(time.perf_counter() - job_started, 3)
+        await report(index)
+
+    async def worker(queue: "asyncio.Queue[int]") -> None:
+        while True:
+            try:
+                index = queue.get_nowait()
+            except asyncio.QueueEmpty:
+                return
+            await run_job(index)
+
+    async def run_upstream_batch() -> None:
+        # 上流のバッチAPIは応答時間を問わないため、ルーティングせずに1つのモデルへまとめて送る
+        batch_model = model or DEFAULT_MODEL
+        requests: List[BatchRequest] = []
+        pending: List[Tuple[int, str]] = []
+        for index, job in enumerate(jobs):
+            try:
+                content = _build_code_content(
+                    job.get('instructions', ''), blob_store.resolve(job.get('code') or [])
+                )
+            except Exception as e:
+                results[index] = {'id': job_id(index), 'ok': False, 'error': str(e), 'seconds': 0.0}
+                await report(index)
+                continue
+            cache_key = make_cache_key(
+                agent, batch_model, _BATCH_AGENTS[agent], temperature, content
+            )
+            entry = (
+                await response_cache.get_async(cache_key)
+                if CACHE_ENABLED and not bypass_cache else None
+            )
+            if entry is not None:
+                texts[index] = entry.text
+                results[index] = {'id': job_id(index), 'ok': True, 'metadata': {'cached': True}, 'seconds': 0.0}
+                await report(index)
+                continue
+            requests.append(BatchRequest(content, _BATCH_AGENTS[agent], temperature))
+            pending.append((index, cache_key))
+        if not requests:
+            return
+
+        batch_started = time.perf_counter()
+        try:
+            outcomes = await backend.generate_batch(
+                batch_model, requests, UPSTREAM_BATCH_POLL_INTERVAL, UPSTREAM_BATCH_TIMEOUT
+            )
+        except Exception as e:
+            logger.warning("batch_review upstream batch failed: {}", e)
+            outcomes = [e] * len(requests)
+        if len(outcomes) != len(requests):
+            # 結果が足りないジョブは失敗として扱う（zipで切り捨てると結果のないジョブが残る）
+            logger.warning(
+                "batch_review upstream batch returned {} results for {} requests",
+                len(outcomes), len(requests),
+            )
+            missing = BatchJobError(
+                f"Upstream batch returned {len(outcomes)} results for {len(requests)} requests"
+            )
+            outcomes = [*outcomes[:len(requests)], *[missing] * (len(requests) - len(outcomes))]
+        seconds = round(time.perf_counter() - batch_started, 3)
+        for (index, cache_key), outcome in zip(pending, outcomes):
+            if isinstance(outcome, Exception):
+                results[index] = {'id': job_id(index), 'ok': False, 'error': str(outcome), 'seconds': seconds}
+                metrics.record(agent, batch_model, seconds, error=True)
+            else:
+                texts[index] = outcome.text
+                results[index] = {
+                    'id': job_id(index),
+                    'ok': True,
+                    'metadata': {
+                        'cached': False,
+                        'mode': 'upstream_batch',
+                        'input_tokens': outcome.input_tokens,
+                        'output_tokens': outcome.output_tokens,
+                        'finish_reason': outcome.finish_reason,
+                    },
+                    'seconds': seconds,
+                }
+                metrics.record(
+                    agent, batch_model, seconds,
+                    input_tokens=outcome.input_tokens, output_tokens=outcome.output_tokens,
+                )
+                if CACHE_ENABLED:
+                    await response_cache.set_async(cache_key, outcome.text, seconds)
+            await report(index)
+
+    try:
+        if upstream_batch:
+            await run_upstream_batch()
+        else:
+            queue: "asyncio.Queue[int]" = asyncio.Queue()
+            for index in range(total):
+                queue.put_nowait(index)
+            # 1回の呼び出しがスケジューラの実行枠を占有しないよう、既定値を上限にする
+            workers = max(1, min(concurrency or BATCH_CONCURRENCY, BATCH_CONCURRENCY, total))
+            await asyncio.gather(*(worker(queue) for _ in range(workers)))
+
+        total_seconds = time.perf_counter() - started
+        succeeded = sum(1 for r in results if r and r['ok'])
+        logger.info(
+            "batch_review finished {} jobs ({} failed) in {:.3f}s",
+            total, total - succeeded, total_seconds,
+        )
+        sections = []
+        for index, result in enumerate(results):
+            body = texts[index] if result['ok'] else f"Error: {result['error']}"
+            sections.append(f"# job {result['id']}\n{body}")
+        return {
+            'content': [{'type': 'text', 'text': "\n\n".join(sections)}],
+            'isError': total > 0 and succeeded == 0,
+            'metadata': {
+                'jobs': results,
+                'succeeded': succeeded,
+                'failed': total - succeeded,
+                'total_seconds': round(total_seconds, 3),
+                'throughput_jobs_per_second': round(total / total_seconds, 3) if total_seconds else None,
+                'mode': 'upstream_batch' if upstream_batch else 'worker_pool',
+            },
+        }
+    except asyncio.CancelledError:
+        logger.info("batch_review was cancelled by the client")
+        raise
+    except Exception as e:
+        logger.exception("Error in batch_review: {}", e)
+        return {
+            'content': [{'type': 'text', 'text': f'Error in content generation: {e}'}],
+            'isError': True,
+        }
+
+
+@mcp.tool(name='known_code_blobs',
+           description=_describe('known_code_blobs'),
+           structured_output=False)
+@_traced('known_code_blobs')
+async def known_code_blobs(hashes: list[str]) -> McpResponse:
+    """指定された参照のうちサーバーが保持しているものを返します。
+
+    Args:
+        hashes: "sha256:<ハッシュ>"形式の参照のリスト
+    """
+    known = set(blob_store.known(hashes))
+    logger.debug("known_code_blobs: {} of {} references known", len(known), len(hashes))
+    return {
+        'content': [
+            {
+                'type': 'text',
+                'text': json.dumps({
+                    'known': [h for h in hashes if h in known],
+                    'unknown': [h for h in hashes if h not in known],
+                }),
+            }
+        ],
+    }
+
+
+@mcp.resource('dive-deep://guides/{tool_name}',
+              name='tool_guide',
+              description='Full usage guide of a tool (the description shown by the full profile)',
+              mime_type='text/plain')
+def tool_guide(tool_name: str) -> str:
+    """ツールの詳しい使い方を返します"""
+    if tool_name not in TOOL_GUIDES:
+        raise ValueError(f"Unknown tool: {tool_name}")
+    return TOOL_GUIDES[tool_name].strip()
+
+
+@mcp.prompt(name='tool_guide',
+            description='Full usage guide of a dive-deep tool, to load before using it')
+def tool_guide_prompt(tool_name: str) -> str:
+    """ツールの詳しい使い方をプロンプトとして返します"""
+    return tool_guide(tool_name)
+
+
+@mcp.resource('dive-deep://metrics',
+              name='metrics',
+              description='Per-tool and per-model request/error counts, latency histograms and token usage',
+              mime_type='application/json')
+def metrics_snapshot() -> str:
+    """ツール・モデルごとのメトリクスを返します"""
+    return json.dumps(metrics.snapshot())
+
+
+@mcp.resource('dive-deep://cache/stats',
+              name='cache_stats',
+              description='Response cache hit/miss counters and saved latency',
+              mime_type='application/json')
+def cache_stats() -> str:
+    """レスポンスキャッシュの統計情報を返します"""
+    return json.dumps(response_cache.stats())
+
+
+@mcp.resource('dive-deep://similarity-cache/stats',
+              name='similarity_cache_stats',
+              description='Similarity cache entries, approximate hits and evictions',
+              mime_type='application/json')
+def similarity_cache_stats() -> str:
+    """類似キャッシュの統計情報を返します"""
+    return json.dumps(similarity_cache.stats())
+
+
+@mcp.resource('dive-deep://routing/stats',
+              name='routing_stats',
+              description='Model routes, hedged requests and which model answered first',
+              mime_type='application/json')
+def routing_stats() -> str:
+    """モデルルーティングの統計情報を返します"""
+    return json.dumps(model_router.stats())
+
+
+@mcp.resource('dive-deep://scheduler/stats',
+              name='scheduler_stats',
+              description='Request scheduler queue depth, retries and throttling time',
+              mime_type='application/json')
+def scheduler_stats() -> str:
+    """リクエストスケジューラの統計情報を返します"""
+    return json.dumps(scheduler.stats())
+
+
+@mcp.resource('dive-deep://coalescing/stats',
+              name='coalescing_stats',
+              description='Upstream calls made and saved by request coalescing',
+              mime_type='application/json')
+def coalescing_stats() -> str:
+    """リクエスト合流の統計情報を返します"""
+    return json.dumps(request_coalescer.stats())
+
+
+@mcp.resource('dive-deep://sessions/stats',
+              name='session_stats',
+              description='Connected client sessions and their in-flight upstream calls',
+              mime_type='application/json')
+def session_stats() -> str:
+    """クライアントセッションごとの実行状況を返します"""
+    return json.dumps(session_limiter.stats())
+
+
+@mcp.resource('dive-deep://blobs/stats',
+              name='blob_stats',
+              description='Code blob store size and reference hit/miss counters',
+              mime_type='application/json')
+def blob_stats() -> str:
+    """コードブロブストアの統計情報を返します"""
+    return json.dumps(blob_store.stats())
+
+
+@mcp.resource('dive-deep://session-store/stats',
+              name='session_store_stats',
+              description='Review sessions held for incremental reviews and idle evictions',
+              mime_type='application/json')
+def session_store_stats() -> str:
+    """インクリメンタルレビューのセッションの統計情報を返します"""
+    return json.dumps(session_store.stats())
+
+
+@mcp.resource('dive-deep://traces/stats',
+              name='trace_stats',
+              description='Recorded tool-call traces: segments, records, disk usage and evictions',
+              mime_type='application/json')
+def trace_stats() -> str:
+    """トレースストアの統計情報を返します"""
+    return json.dumps(trace_store.stats() if trace_store is not None else {'enabled': False})
+
+
 def main() -> None:
     """Run Dive Deep MCP server."""
 
     logger.info("Starting Dive Deep MCP server")
 
-    # Run server with default transport (stdio)
+    if WARMUP_ENABLED:
+        backend.warm_up()
+        logger.info("Warming up model backend in the background")
+
+    if METRICS_PORT:
+        start_metrics_server(metrics, METRICS_HOST, METRICS_PORT)
+        logger.info("Serving Prometheus metrics on http://{}:{}/metrics", METRICS_HOST, METRICS_PORT)
+
     try:
-        logger.info("Running server with stdio transport")
-        mcp.run()
+        if TRANSPORT == 'stdio':
+            logger.info("Running server with stdio transport")
+        else:
+            logger.info("Running server with {} transport on {}:{}", TRANSPORT, HTTP_HOST, HTTP_PORT)
+        mcp.run(transport=TRANSPORT)
     except Exception as e:
-        logger.critical(f"Failed to start server: {str(e)}", exc_info=True)
+        logger.opt(exception=True).critical("Failed to start server: {}", e)
         sys.exit(1)
 
 
@@ -1,8 +1,163 @@
 import os
+import queue
 import sys
-from datetime import datetime
+import threading
+import time
+from datetime import datetime, timedelta
 from loguru import logger
-from typing import Any
+from typing import Any, Optional, TextIO
+
+# ログに出力するペイロード（指示文やコードなど）の最大文字数
+DEFAULT_PAYLOAD_LIMIT = int(os.getenv("DIVE_DEEP_LOG_PAYLOAD_LIMIT", "200"))
+
+# setup_loggerで設定済みのアプリ名（ハンドラは最初の1回だけ設定する）
+_configured_app: Optional[str] = None
+
+
+class Payload:
+    """ログ用に切り詰めて表示されるペイロード
+
+    文字列化はログが実際に出力されるときにだけ行われるため、
+    出力されないレベルのログでは大きなペイロードを処理しません。
+    """
+
+    __slots__ = ('value', 'limit')
+
+    def __init__(self, value: Any, limit: Optional[int] = None):
+        self.value = value
+        self.limit = DEFAULT_PAYLOAD_LIMIT if limit is None else limit
+
+    def __str__(self) -> str:
+        text = self.value if isinstance(self.value, str) else repr(self.value)
+        if len(text) <= self.limit:
+            return text
+        return f"{text[:self.limit]}... ({len(text)} chars)"
+
+    __repr__ = __str__
+
+    def __format__(self, format_spec: str) -> str:
+        return format(str(self), format_spec)
+
+
+def payload(value: Any, limit: Optional[int] = None) -> Payload:
+    """ペイロードを切り詰めてログに出力するためのラッパーを返します"""
+    return Payload(value, limit)
+
+
+class BackgroundStream:
+    """書き込みを別スレッドで行うストリーム
+
+    呼び出し側はフォーマット済みのメッセージをキューに積むだけで戻り、
+    ストリームへの書き込みとフラッシュはバックグラウンドのスレッドが行います。
+    loguruのenqueue=Trueと異なりレコードのpickleを行わないため、
+    呼び出し側のオーバーヘッドが小さくなります。
+    """
+
+    def __init__(self, stream: TextIO, close_on_stop: bool = False):
+        self.stream = stream
+        self.close_on_stop = close_on_stop
+        self._queue: "queue.SimpleQueue[Optional[str]]" = queue.SimpleQueue()
+        self._thread = threading.Thread(target=self._worker, name='log-writer', daemon=True)
+        self._thread.start()
+
+    def isatty(self) -> bool:
+        return self.stream.isatty()
+
+    def write(self, message: str) -> None:
+        self._queue.put(message)
+
+    def _worker(self) -> None:
+        while True:
+            message = self._queue.get()
+            if message is None:
+                self._finish()
+                break
+            try:
+                self.stream.write(message)
+                # キューが空になったときにまとめてフラッシュする
+                if self._queue.empty():
+                    self.stream.flush()
+            except (OSError, ValueError):
+                # 出力先が閉じられている場合はログを捨てる
+                pass
+
+    def _finish(self) -> None:
+        try:
+            self.stream.flush()
+            if self.close_on_stop:
+                self.stream.close()
+        except (OSError, ValueError):
+            pass
+
+    def stop(self) -> None:
+        """キューに残っているメッセージを書き終えてからスレッドを終了します"""
+        self._queue.put(None)
+        self._thread.join()
+
+
+class DailyLogFile:
+    """日付ごとのファイル（<app_name>_YYYYMMDD.log）に書き込むストリーム
+
+    日付が変わると新しいファイルに切り替え、retention_days日より古いファイルを削除します。
+    BackgroundStreamの書き込みスレッドから使われるため、ファイルへの書き込みと
+    ローテーションで呼び出し側を待たせません。
+    """
+
+    def __init__(
+        self,
+        log_dir: str,
+        app_name: str,
+        retention_days: int = 30,
+        buffering: int = 1 << 16
+    ):
+        self.log_dir = log_dir
+        self.app_name = app_name
+        self.retention_days = retention_days
+        self.buffering = buffering
+        self._file: Optional[TextIO] = None
+        self._rollover_at = 0.0
+
+    def isatty(self) -> bool:
+        return False
+
+    def write(self, message: str) -> None:
+        if time.time() >= self._rollover_at:
+            self._rotate()
+        self._file.write(message)
+
+    def flush(self) -> None:
+        if self._file is not None:
+            self._file.flush()
+
+    def close(self) -> None:
+        if self._file is not None:
+            self._file.close()
+            self._file = None
+            self._rollover_at = 0.0
+
+    def _rotate(self) -> None:
+        self.close()
+        now = datetime.now()
+        self._file = open(
+            os.path.join(self.log_dir, f"{self.app_name}_{now:%Y%m%d}.log"),
+            "a", encoding="utf-8", buffering=self.buffering,
+        )
+        midnight = now.replace(hour=0, minute=0, second=0, microsecond=0)
+        self._rollover_at = (midnight + timedelta(days=1)).timestamp()
+        self._remove_expired(now)
+
+    def _remove_expired(self, now: datetime) -> None:
+        cutoff = f"{self.app_name}_{now - timedelta(days=self.retention_days):%Y%m%d}.log"
+        prefix = f"{self.app_name}_"
+        for name in os.listdir(self.log_dir):
+            # 日付の部分は固定長のため、ファイル名の文字列比較で古いものを判定できる
+            if (name.startswith(prefix) and name.endswith(".log")
+                    and len(name) == len(cutoff) and name < cutoff):
+                try:
+                    os.remove(os.path.join(self.log_dir, name))
+                except OSError:
+                    continue
+
 
 class LoggerConfig:
     def __init__(self, app_name: str = "dive_deep"):
@@ -13,38 +168,51 @@ class LoggerConfig:
         self.log_dir = os.path.join(self.root_dir, "logs")
         # logsディレクトリが存在しない場合は作成
         os.makedirs(self.log_dir, exist_ok=True)
-        
+        # JSON形式の構造化ログを出力するか
+        self.serialize = os.getenv("DIVE_DEEP_LOG_JSON", "0") == "1"
+        self.console_level = os.getenv("DIVE_DEEP_LOG_LEVEL", "INFO")
+        self.file_level = os.getenv("DIVE_DEEP_LOG_FILE_LEVEL", "DEBUG")
+
     def setup_logger(self):
-        """ロガーの設定を行います"""
+        """ロガーの設定を行います
+
+        コンソールとファイルへの出力はどちらもBackgroundStreamで別スレッドから書き込み、
+        呼び出し側はフォーマット済みのメッセージをキューに積むだけで戻ります。
+        """
         # すべての既存のハンドラを削除
         logger.remove()
-        
-        # 日付ごとのログファイル名を生成
-        log_file = os.path.join(
-            self.log_dir,
-            f"{self.app_name}_{datetime.now().strftime('%Y%m%d')}.log"
-        )
-        
+
         # コンソール出力の設定
         logger.add(
-            sys.stderr,
+            BackgroundStream(sys.stderr),
             format="<green>{time:YYYY-MM-DD HH:mm:ss}</green> | <level>{level: <8}</level> | <cyan>{name}</cyan>:<cyan>{function}</cyan>:<cyan>{line}</cyan> - <level>{message}</level>",
-            level="INFO"
+            level=self.console_level,
+            colorize=sys.stderr.isatty(),
+            serialize=self.serialize
         )
-        
-        # ファイル出力の設定
+
+        # ファイル出力の設定（毎日0時にローテーションし、30日分保持）
         logger.add(
-            log_file,
-            rotation="00:00",  # 毎日0時にローテーション
-            retention="30 days",  # 30日分保持
+            BackgroundStream(
+                DailyLogFile(self.log_dir, self.app_name, retention_days=30), close_on_stop=True
+            ),
             format="{time:YYYY-MM-DD HH:mm:ss} | {level: <8} | {name}:{function}:{line} - {message}",
-            level="DEBUG",
-            encoding="utf-8"
+            level=self.file_level,
+            colorize=False,
+            serialize=self.serialize
         )
-        
+
         return logger
 
+
 def get_logger(app_name: str = "dive_deep") -> Any:
-    """ロガーのインスタンスを取得します"""
-    logger_config = LoggerConfig(app_name)
-    return logger_config.setup_logger() 
\ No newline at end of file
+    """ロガーのインスタンスを取得します
+
+    ハンドラの設定は最初の呼び出しでのみ行い、以降の呼び出しでは
+    設定済みのロガーをそのまま返します。
+    """
+    global _configured_app
+    if _configured_app is None:
+        LoggerConfig(app_name).setup_logger()
+        _configured_app = app_name
+    return logger
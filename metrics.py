@@ -0,0 +1,233 @@
+"""メトリクス収集モジュール
+
+ツールとモデルの組み合わせごとに、リクエスト数・エラー数・レイテンシのヒストグラム・
+入出力トークン数を記録します。記録はホットパス上で呼ばれるため、
+固定バケットへの加算だけで完了するようにしています。
+"""
+
+import bisect
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from typing import Any, Dict, List, Optional, Tuple
+
+# レイテンシヒストグラムのバケット境界（秒）
+DEFAULT_BUCKETS = (0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 20.0, 40.0, 80.0, 160.0)
+
+# 直近1時間の集計に使う1分単位のスロット数
+_WINDOW_MINUTES = 60
+
+
+class Histogram:
+    """固定バケットのヒストグラム"""
+
+    def __init__(self, buckets: Tuple[float, ...] = DEFAULT_BUCKETS):
+        self.buckets = buckets
+        self.counts = [0] * (len(buckets) + 1)
+        self.sum = 0.0
+        self.count = 0
+
+    def observe(self, value: float) -> None:
+        self.counts[bisect.bisect_left(self.buckets, value)] += 1
+        self.sum += value
+        self.count += 1
+
+    def quantile(self, q: float) -> Optional[float]:
+        """バケット内を線形補間して分位点を推定します"""
+        if not self.count:
+            return None
+        rank = q * self.count
+        cumulative = 0
+        for i, count in enumerate(self.counts):
+            if cumulative + count >= rank and count:
+                lower = self.buckets[i - 1] if i > 0 else 0.0
+                if i == len(self.buckets):
+                    return lower
+                return lower + (self.buckets[i] - lower) * (rank - cumulative) / count
+            cumulative += count
+        return self.buckets[-1]
+
+
+class SeriesMetrics:
+    """ツールとモデルの組み合わせ1つ分のメトリクス"""
+
+    def __init__(self):
+        self.requests = 0
+        self.errors = 0
+        self.cache_hits = 0
+        self.input_tokens = 0
+        self.output_tokens = 0
+        self.latency = Histogram()
+        # [分, リクエスト数, 入力トークン数, 出力トークン数] のリングバッファ
+        self._window: List[List[int]] = [[-1, 0, 0, 0] for _ in range(_WINDOW_MINUTES)]
+
+    def record(
+        self,
+        latency: float,
+        error: bool,
+        cached: bool,
+        input_tokens: int,
+        output_tokens: int
+    ) -> None:
+        self.requests += 1
+        if error:
+            self.errors += 1
+        if cached:
+            self.cache_hits += 1
+        self.input_tokens += input_tokens
+        self.output_tokens += output_tokens
+        self.latency.observe(latency)
+
+        minute = int(time.time() // 60)
+        slot = self._window[minute % _WINDOW_MINUTES]
+        if slot[0] != minute:
+            slot[:] = [minute, 0, 0, 0]
+        slot[1] += 1
+        slot[2] += input_tokens
+        slot[3] += output_tokens
+
+    def last_hour(self) -> Dict[str, int]:
+        minute = int(time.time() // 60)
+        slots = [s for s in self._window if minute - s[0] < _WINDOW_MINUTES]
+        return {
+            'requests': sum(s[1] for s in slots),
+            'input_tokens': sum(s[2] for s in slots),
+            'output_tokens': sum(s[3] for s in slots),
+        }
+
+
+class MetricsRegistry:
+    """ツール・モデルごとのメトリクスを保持します"""
+
+    def __init__(self):
+        self._series: Dict[Tuple[str, str], SeriesMetrics] = {}
+        # (ツール, ルート, 結果) -> リクエスト数
+        self._routes: Dict[Tuple[str, str, str], int] = {}
+        self._lock = threading.Lock()
+        self.started_at = time.time()
+
+    def record(
+        self,
+        tool: str,
+        model: str,
+        latency: float,
+        error: bool = False,
+        cached: bool = False,
+        input_tokens: Optional[int] = None,
+        output_tokens: Optional[int] = None
+    ) -> None:
+        """1回の呼び出し結果を記録します"""
+        series = self._series.get((tool, model))
+        if series is None:
+            with self._lock:
+                series = self._series.setdefault((tool, model), SeriesMetrics())
+        series.record(latency, error, cached, input_tokens or 0, output_tokens or 0)
+
+    def record_route(self, tool: str, route: str, outcome: str) -> None:
+        """モデルルーティングの結果（primary、primary_won、hedge_won、error）を記録します"""
+        key = (tool, route, outcome)
+        with self._lock:
+            self._routes[key] = self._routes.get(key, 0) + 1
+
+    def _items(self) -> List[Tuple[Tuple[str, str], SeriesMetrics]]:
+        with self._lock:
+            return sorted(self._series.items())
+
+    def snapshot(self) -> Dict[str, Any]:
+        """すべての系列の集計値を辞書で返します"""
+        series = []
+        for (tool, model), metrics in self._items():
+            histogram = metrics.latency
+            series.append({
+                'tool': tool,
+                'model': model,
+                'requests': metrics.requests,
+                'errors': metrics.errors,
+                'cache_hits': metrics.cache_hits,
+                'input_tokens': metrics.input_tokens,
+                'output_tokens': metrics.output_tokens,
+                'last_hour': metrics.last_hour(),
+                'latency_seconds': {
+                    'mean': histogram.sum / histogram.count if histogram.count else None,
+                    'p50': histogram.quantile(0.5),
+                    'p95': histogram.quantile(0.95),
+                    'p99': histogram.quantile(0.99),
+                    'buckets': dict(zip(
+                        [str(b) for b in histogram.buckets] + ['+Inf'], histogram.counts
+                    )),
+                },
+            })
+        with self._lock:
+            routes = [
+                {'tool': tool, 'route': route, 'outcome': outcome, 'requests': count}
+                for (tool, route, outcome), count in sorted(self._routes.items())
+            ]
+        return {
+            'uptime_seconds': round(time.time() - self.started_at, 1),
+            'series': series,
+            'routes': routes,
+        }
+
+    def prometheus_text(self) -> str:
+        """Prometheusのテキスト形式でメトリクスを出力します"""
+        families: Dict[str, Tuple[str, List[str]]] = {
+            'dive_deep_requests_total': ('counter', []),
+            'dive_deep_errors_total': ('counter', []),
+            'dive_deep_cache_hits_total': ('counter', []),
+            'dive_deep_tokens_total': ('counter', []),
+            'dive_deep_request_duration_seconds': ('histogram', []),
+            'dive_deep_route_requests_total': ('counter', []),
+        }
+        for (tool, model), metrics in self._items():
+            labels = f'tool="{tool}",model="{model}"'
+            families['dive_deep_requests_total'][1].append(f'{{{labels}}} {metrics.requests}')
+            families['dive_deep_errors_total'][1].append(f'{{{labels}}} {metrics.errors}')
+            families['dive_deep_cache_hits_total'][1].append(f'{{{labels}}} {metrics.cache_hits}')
+            families['dive_deep_tokens_total'][1].extend([
+                f'{{{labels},type="input"}} {metrics.input_tokens}',
+                f'{{{labels},type="output"}} {metrics.output_tokens}',
+            ])
+            histogram = metrics.latency
+            samples = families['dive_deep_request_duration_seconds'][1]
+            cumulative = 0
+            for bound, count in zip(list(histogram.buckets) + ['+Inf'], histogram.counts):
+                cumulative += count
+                samples.append(f'_bucket{{{labels},le="{bound}"}} {cumulative}')
+            samples.append(f'_sum{{{labels}}} {histogram.sum}')
+            samples.append(f'_count{{{labels}}} {histogram.count}')
+        with self._lock:
+            routes = sorted(self._routes.items())
+        for (tool, route, outcome), count in routes:
+            families['dive_deep_route_requests_total'][1].append(
+                f'{{tool="{tool}",route="{route}",outcome="{outcome}"}} {count}'
+            )
+
+        lines = []
+        for name, (metric_type, samples) in families.items():
+            lines.append(f'# TYPE {name} {metric_type}')
+            lines.extend(f'{name}{sample}' for sample in samples)
+        return '\n'.join(lines) + '\n'
+
+
+def start_metrics_server(registry: MetricsRegistry, host: str, port: int) -> ThreadingHTTPServer:
+    """/metricsでPrometheus形式のメトリクスを返すHTTPサーバーをバックグラウンドで起動します"""
+
+    class Handler(BaseHTTPRequestHandler):
+        def do_GET(self):
+            if self.path.split('?')[0] != '/metrics':
+                self.send_error(404)
+                return
+            body = registry.prometheus_text().encode('utf-8')
+            self.send_response(200)
+            self.send_header('Content-Type', 'text/plain; version=0.0.4; charset=utf-8')
+            self.send_header('Content-Length', str(len(body)))
+            self.end_headers()
+            self.wfile.write(body)
+
+        def log_message(self, format, *args):
+            pass
+
+    server = ThreadingHTTPServer((host, port), Handler)
+    thread = threading.Thread(target=server.serve_forever, name='metrics-server', daemon=True)
+    thread.start()
+    return server
@@ -0,0 +1,273 @@
+"""モデルルーティングモジュール
+
+ツールの種類と推定入力トークン数からリクエストを送るモデルを選びます。
+ルートにヘッジ用のモデルが指定されている場合、応答が一定時間（固定の秒数、または
+そのルートで観測したレイテンシの分位点）を過ぎても返らなければ高速なモデルにも
+同じリクエストを送り、先に返った応答を使って残りをキャンセルします。
+"""
+
+import asyncio
+import json
+import threading
+from collections import deque
+from dataclasses import dataclass, fields
+from typing import Any, Awaitable, Callable, Dict, List, Optional, Tuple
+
+from metrics import Histogram
+
+# 観測値から分位点を求めるのに必要なサンプル数（それまではhedge_afterを使う）
+MIN_HEDGE_SAMPLES = 20
+# ヘッジまでの秒数の算出に使う直近の所要時間の件数（上流のレイテンシの変化に追従する）
+HEDGE_WINDOW = 200
+
+
+@dataclass
+class Route:
+    """ツールと入力サイズの条件に一致したリクエストを送るモデル
+
+    tools: 対象のツール名（Noneはすべてのツール）
+    max_input_tokens: 推定入力トークン数の上限（Noneは上限なし）
+    hedge_model: 応答が遅い場合に同じリクエストを送るモデル（Noneはヘッジしない）
+    hedge_after: ヘッジを送るまでの秒数
+    hedge_quantile: 指定した場合、観測したレイテンシのこの分位点をヘッジまでの秒数にする
+    max_hedge_ratio: ヘッジを送るリクエストの割合の上限（上流の負荷の増加を抑える）
+    """
+    name: str
+    model: str
+    tools: Optional[List[str]] = None
+    max_input_tokens: Optional[int] = None
+    hedge_model: Optional[str] = None
+    hedge_after: float = 10.0
+    hedge_quantile: Optional[float] = None
+    max_hedge_ratio: float = 0.1
+
+    def matches(self, tool_name: str, input_tokens: int) -> bool:
+        if self.tools is not None and tool_name not in self.tools:
+            return False
+        return self.max_input_tokens is None or input_tokens <= self.max_input_tokens
+
+
+def _check_route(index: int, route: Any) -> Route:
+    """JSONの1要素を検証してRouteに変換します"""
+    where = f"route {index}"
+    if not isinstance(route, dict):
+        raise ValueError(f"{where} must be an object, got {type(route).__name__}")
+    unknown = set(route) - {field.name for field in fields(Route)}
+    if unknown:
+        raise ValueError(f"{where} has unknown keys: {', '.join(sorted(unknown))}")
+    for key in ('name', 'model'):
+        if not isinstance(route.get(key), str) or not route[key]:
+            raise ValueError(f"{where} requires a non-empty string '{key}'")
+    where = f"route '{route['name']}'"
+    tools = route.get('tools')
+    if tools is not None and (
+        not isinstance(tools, list) or not all(isinstance(tool, str) for tool in tools)
+    ):
+        raise ValueError(f"{where}: 'tools' must be a list of tool names")
+    max_input_tokens = route.get('max_input_tokens')
+    if max_input_tokens is not None and (
+        not isinstance(max_input_tokens, int) or isinstance(max_input_tokens, bool)
+        or max_input_tokens <= 0
+    ):
+        raise ValueError(f"{where}: 'max_input_tokens' must be a positive integer")
+    if route.get('hedge_model') is not None and not isinstance(route['hedge_model'], str):
+        raise ValueError(f"{where}: 'hedge_model' must be a model name")
+    for key, low, high in (
+        ('hedge_after', 0.0, None), ('hedge_quantile', 0.0, 1.0), ('max_hedge_ratio', 0.0, 1.0)
+    ):
+        value = route.get(key)
+        if value is None:
+            continue
+        if (
+            not isinstance(value, (int, float)) or isinstance(value, bool)
+            or value < low or (high is not None and value > high)
+        ):
+            bounds = f"between {low:g} and {high:g}" if high is not None else f"at least {low:g}"
+            raise ValueError(f"{where}: '{key}' must be a number {bounds}")
+    return Route(**route)
+
+
+def load_routes(raw: str) -> List[Route]:
+    """ルートのJSON（オブジェクトのリスト）を検証して読み込みます
+
+    Raises:
+        ValueError: JSONとして解釈できない、未知のキーや不正な値を含む、名前が重複する場合
+    """
+    try:
+        data = json.loads(raw)
+    except json.JSONDecodeError as e:
+        raise ValueError(f"invalid JSON: {e}") from e
+    if not isinstance(data, list):
+        raise ValueError(f"expected a list of routes, got {type(data).__name__}")
+    routes = [_check_route(index, route) for index, route in enumerate(data)]
+    names = [route.name for route in routes] + ['default']
+    duplicates = sorted({name for name in names if names.count(name) > 1})
+    if duplicates:
+        raise ValueError(f"duplicate route names: {', '.join(duplicates)}")
+    return routes
+
+
+def _quantile(values: "deque[float]", q: float) -> float:
+    """観測値の分位点を返します（最近傍順位）"""
+    ordered = sorted(values)
+    return ordered[min(len(ordered) - 1, max(0, int(q * len(ordered) + 0.5) - 1))]
+
+
+class _RouteStats:
+    """ルート1つ分の結果の集計"""
+
+    def __init__(self):
+        # 開始したリクエスト数（ヘッジの割合の分母）と完了したリクエスト数
+        self.started = 0
+        self.requests = 0
+        self.errors = 0
+        self.hedged = 0
+        self.hedge_wins = 0
+        self.latency = Histogram()
+        # ヘッジまでの秒数の算出に使う、直近の最初に送ったリクエストの所要時間
+        self.primary_latency: "deque[float]" = deque(maxlen=HEDGE_WINDOW)
+
+
+class ModelRouter:
+    """リクエストごとにルートを選び、ルートごとの結果を集計します
+
+    ルートは定義された順に評価され、最初に条件に一致したものが選ばれます。
+    どれにも一致しない場合はdefault_modelに送ります（ヘッジなし）。
+    """
+
+    def __init__(self, routes: List[Route], default_model: str):
+        self.routes = routes
+        self.default = Route('default', default_model)
+        self._stats: Dict[str, _RouteStats] = {
+            route.name: _RouteStats() for route in [*routes, self.default]
+        }
+        self._lock = threading.Lock()
+
+    def route(self, tool_name: str, input_tokens: int) -> Route:
+        """ツール名と推定入力トークン数に一致するルートを返します"""
+        for route in self.routes:
+            if route.matches(tool_name, input_tokens):
+                return route
+        return self.default
+
+    def start(self, route: Route) -> Optional[float]:
+        """リクエストの開始を記録し、ヘッジを送るまでの秒数を返します"""
+        with self._lock:
+            self._stats[route.name].started += 1
+        return self.hedge_delay(route)
+
+    def hedge_delay(self, route: Route) -> Optional[float]:
+        """ヘッジを送るまでの秒数を返します（ヘッジしない場合はNone）"""
+        if route.hedge_model is None:
+            return None
+        stats = self._stats[route.name]
+        with self._lock:
+            if stats.started and stats.hedged >= stats.started * route.max_hedge_ratio:
+                return None
+            if route.hedge_quantile is not None and len(stats.primary_latency) >= MIN_HEDGE_SAMPLES:
+                return _quantile(stats.primary_latency, route.hedge_quantile)
+        return route.hedge_after
+
+    def reserve_hedge(self, route: Route) -> bool:
+        """ヘッジを送る直前に呼び、割合の上限内であれば送信数に数えてTrueを返します
+
+        送信した時点で数えるため、遅いリクエストが同時に集中しても上限を超えません。
+        """
+        stats = self._stats[route.name]
+        with self._lock:
+            if stats.hedged >= stats.started * route.max_hedge_ratio:
+                return False
+            stats.hedged += 1
+            return True
+
+    def record(
+        self,
+        route: Route,
+        latency: float,
+        outcome: str,
+        primary_latency: Optional[float] = None
+    ) -> None:
+        """1回のリクエストの結果（primary、hedge、error）を記録します
+
+        primary_latencyには最初に送ったリクエストの所要時間を渡します。ヘッジが
+        先に返ってキャンセルした場合は、キャンセルまでの時間（下限）を渡します。
+        ヘッジの送信数はreserve_hedgeで数えます。
+        """
+        stats = self._stats[route.name]
+        with self._lock:
+            stats.requests += 1
+            if outcome == 'error':
+                stats.errors += 1
+            elif outcome == 'hedge':
+                stats.hedge_wins += 1
+            stats.latency.observe(latency)
+            if primary_latency is not None:
+                stats.primary_latency.append(primary_latency)
+
+    def stats(self) -> Dict[str, Any]:
+        """ルートごとのリクエスト数・ヘッジの結果・レイテンシを返します"""
+        routes = []
+        for route in [*self.routes, self.default]:
+            stats = self._stats[route.name]
+            routes.append({
+                'name': route.name,
+                'model': route.model,
+                'tools': route.tools,
+                'max_input_tokens': route.max_input_tokens,
+                'hedge_model': route.hedge_model,
+                'hedge_delay_seconds': self.hedge_delay(route),
+                'requests': stats.requests,
+                'errors': stats.errors,
+                'hedged': stats.hedged,
+                'hedge_wins': stats.hedge_wins,
+                'latency_seconds': {
+                    'p50': stats.latency.quantile(0.5),
+                    'p99': stats.latency.quantile(0.99),
+                },
+            })
+        return {'routes': routes}
+
+
+def _consume_result(task: "asyncio.Future[Any]") -> None:
+    # キャンセルした側の例外が未回収の警告にならないようにする
+    if not task.cancelled():
+        task.exception()
+
+
+async def hedged_call(
+    primary: Callable[[], Awaitable[Any]],
+    hedge: Callable[[], Awaitable[Any]],
+    delay: Optional[float],
+    allow_hedge: Optional[Callable[[], bool]] = None
+) -> Tuple[Any, str, bool]:
+    """primaryを実行し、delay秒以内に完了しなければhedgeも実行します
+
+    先に成功した方の結果を返し、もう一方はキャンセルします。片方が失敗した場合は
+    もう一方の結果を待ちます。delayがNoneの場合はヘッジしません。allow_hedgeを
+    指定した場合は、ヘッジを送る時点で呼び出し、Falseであればヘッジしません。
+
+    Returns:
+        結果、勝った側（primaryまたはhedge）、ヘッジを送ったか
+    """
+    tasks = [asyncio.ensure_future(primary())]
+    try:
+        if delay is None:
+            return await tasks[0], 'primary', False
+        done, _ = await asyncio.wait(tasks, timeout=max(delay, 0))
+        if not done and (allow_hedge is None or allow_hedge()):
+            tasks.append(asyncio.ensure_future(hedge()))
+        while True:
+            pending = [task for task in tasks if not task.done()]
+            if pending:
+                await asyncio.wait(pending, return_when=asyncio.FIRST_COMPLETED)
+            for task, winner in zip(tasks, ('primary', 'hedge')):
+                if task.done() and task.exception() is None:
+                    return task.result(), winner, len(tasks) > 1
+            if all(task.done() for task in tasks):
+                # 両方とも失敗した場合は最初に送ったリクエストのエラーを返す
+                raise tasks[0].exception()
+    finally:
+        for task in tasks:
+            if not task.done():
+                task.add_done_callback(_consume_result)
+                task.cancel()
@@ -0,0 +1,125 @@
+"""トークン予算のプリフライトモジュール
+
+モデルを呼び出す前にリクエストの入力トークン数を見積もり、予算を超える場合は
+優先度の低いセクション（思考プロセスのコンテキストやコードなど）から
+先頭と末尾を残して中間を削り、予算内に収めます。
+また、入力の大きさに応じて出力トークン数の上限を決めます。
+"""
+
+from dataclasses import dataclass
+from typing import Any, Dict, List, Optional, Sequence, Tuple
+
+from token_budget import estimate_tokens
+
+# 削った部分の代わりに挿入するマーカーの分として残しておくトークン数
+_MARKER_TOKENS = 24
+
+
+@dataclass
+class Section:
+    """予算に応じて削られる可能性のあるコンテンツの一部"""
+    name: str
+    text: str
+    # 値が小さいセクションから先に削る
+    priority: int = 1
+    # Falseの場合は削らない（ユーザーの指示など）
+    trimmable: bool = True
+
+
+class TokenBudgetExceededError(ValueError):
+    """削ることのできないセクションだけで予算を超える場合のエラー"""
+
+    def __init__(self, budget: int, required: int):
+        self.budget = budget
+        self.required = required
+        super().__init__(
+            f"Request needs at least ~{required} input tokens after trimming, "
+            f"which exceeds the token budget of {budget}. Shorten the instructions "
+            "or split the request."
+        )
+
+
+def trim_text(text: str, max_tokens: int) -> str:
+    """テキストの先頭（約2/3）と末尾を残し、推定トークン数をmax_tokens以内に削ります
+
+    削った部分は行数と推定トークン数を示すマーカーに置き換えます。
+    可能な場合は行の境界で切ります。
+    """
+    tokens = estimate_tokens(text)
+    if tokens <= max_tokens:
+        return text
+    target = max(0, max_tokens - _MARKER_TOKENS)
+    keep_chars = len(text) * target // tokens
+    while True:
+        head = text[:keep_chars * 2 // 3]
+        tail = text[len(text) - (keep_chars - len(head)):] if keep_chars > len(head) else ''
+        if '\n' in head:
+            head = head[:head.rfind('\n') + 1]
+        if '\n' in tail:
+            tail = tail[tail.find('\n') + 1:]
+        omitted = text[len(head):len(text) - len(tail)]
+        trimmed = (
+            f"{head}\n... [trimmed {omitted.count(chr(10)) + 1} lines, "
+            f"~{estimate_tokens(omitted)} tokens to fit the token budget] ...\n{tail}"
+        )
+        if keep_chars == 0 or estimate_tokens(trimmed) <= max_tokens:
+            return trimmed
+        keep_chars = keep_chars * 9 // 10
+
+
+def trim_sections(
+    sections: Sequence[Section],
+    excess_tokens: int,
+    budget: int
+) -> Tuple[List[str], List[Dict[str, Any]]]:
+    """推定トークン数の合計がexcess_tokens以上減るようにセクションを削ります
+
+    優先度の低いセクションから、同じ優先度では大きいセクションから順に削ります。
+
+    Returns:
+        削った後の各セクションのテキストと、削ったセクションの報告のリスト
+
+    Raises:
+        TokenBudgetExceededError: 削れるセクションをすべて削っても足りない場合
+    """
+    texts = [section.text for section in sections]
+    sizes = [estimate_tokens(text) for text in texts]
+    order = sorted(
+        (i for i, section in enumerate(sections) if section.trimmable),
+        key=lambda i: (sections[i].priority, -sizes[i]),
+    )
+    trimmed: List[Dict[str, Any]] = []
+    for index in order:
+        if excess_tokens <= 0:
+            break
+        if sizes[index] <= _MARKER_TOKENS:
+            continue
+        texts[index] = trim_text(texts[index], max(0, sizes[index] - excess_tokens))
+        kept = estimate_tokens(texts[index])
+        excess_tokens -= sizes[index] - kept
+        trimmed.append({
+            'section': sections[index].name,
+            'original_tokens': sizes[index],
+            'kept_tokens': kept,
+        })
+    if excess_tokens > 0:
+        raise TokenBudgetExceededError(budget, budget + excess_tokens)
+    return texts, trimmed
+
+
+def output_token_cap(
+    input_tokens: int,
+    ratio: float,
+    minimum: int,
+    maximum: int,
+    context_window: int
+) -> Optional[int]:
+    """入力トークン数に応じた出力トークン数の上限を返します
+
+    上限は入力のratio倍をminimumとmaximumの範囲に収めた値で、コンテキストウィンドウの
+    残りを超えません。maximumが0の場合は上限を設けずNoneを返します。
+    """
+    if maximum <= 0:
+        return None
+    cap = min(max(int(input_tokens * ratio), minimum), maximum)
+    return max(1, min(cap, context_window - input_tokens))
@@ -401,3 +401,161 @@ Analysis Results Structure:
 
 Through this analytical framework, support the realization of better design and implementation, promoting sustainable quality improvement.
 """
+
+
+# map-reduce分析用の指示文
+MAP_CHUNK_INSTRUCTIONS = """
+You are analyzing chunk {index} of {total} of a larger code submission. 
+Only the files in this chunk are shown. Report concrete findings for these files, 
+and note any assumptions about code that lives in other chunks so they can be checked when the results are merged.
+"""
+
+MAP_REDUCE_MERGE_INSTRUCTIONS = """
+The code submission was too large to analyze at once, so it was split into {total} chunks that were analyzed independently. 
+The partial findings for each chunk are provided below. Merge them into a single, coherent response that follows your usual output structure. 
+Remove duplicates, resolve contradictions between chunks, verify cross-chunk assumptions against the other findings, and prioritize the most important issues across the whole submission.
+"""
+
+
+# dive_deep_pipeline用の説明文
+DIVE_DEEP_PIPELINE_DESCRIPTION = """
+This tool runs the full dive-deep workflow in a single call: deep_thinking_agent, enhancement_agent and final_review_agent.
+Use it instead of calling the three tools one after another when you already have both your structured thought process and your complete code.
+
+IMPORTANT USAGE REQUIREMENTS:
+1. The same requirements as the individual tools apply: create your own thought process and your own complete solution BEFORE using this tool.
+2. This tool is for REVIEW ONLY - DO NOT delegate the answer creation to this tool.
+
+Submission Format:
+- instructions: str (User-provided guidelines or requirements related to the task.)
+- context: str (Your structured thought process. Pass an empty string to skip the deep thinking stage.)
+- code: list[str] (A list where each element is the complete content of a single file, represented as a raw string.)
+
+How it works:
+- The deep thinking review of your thought process and the enhancement analysis of your code run concurrently on the server.
+- The final review receives your code together with the outputs of both earlier stages.
+- The result contains the output of every stage and the time each stage took.
+- Unless the final review is streamed, progress notifications report each stage as it finishes.
+
+After receiving the result, apply the feedback of all stages and present the revised solution to the user.
+"""
+
+CODE_REFERENCE_NOTE = """
+Avoiding re-uploads of unchanged files:
+- Every file you submit in code is remembered by the server under "sha256:<hex digest>", the SHA-256 of its UTF-8 content.
+- In later calls you may pass that reference string in place of the full content of an unchanged file.
+- Use known_code_blobs to check which references the server still has; send the full content of any unknown file.
+"""
+
+KNOWN_CODE_BLOBS_DESCRIPTION = """
+Reports which code references the server already holds.
+Pass a list of "sha256:<hex digest>" strings (the SHA-256 of each file's UTF-8 content).
+The result is a JSON object with "known" and "unknown" lists. Known references can be passed in the code argument of enhancement_agent, final_review_agent and dive_deep_pipeline instead of the full file content; unknown files must be sent in full.
+"""
+
+INCREMENTAL_REVIEW_INSTRUCTIONS = """
+This is a follow-up review of files you have reviewed before. 
+Instead of the full files, you receive a summary of your previous review and only the changes made since then (unified diff hunks with surrounding lines; new or rewritten files are shown in full). 
+Check whether the changes resolve the earlier findings, report any problems the changes introduce, and keep earlier findings that are still unresolved. Do not re-review unchanged code from scratch.
+"""
+
+INCREMENTAL_REVIEW_NOTE = """
+Incremental review (optional):
+- Pass the same session_id on every review of the same task, together with paths (one file path per code element; required with session_id) so files can be matched across calls.
+- After the first call, only the changed hunks and the previous review summary are sent to the model, which makes repeated reviews faster and cheaper.
+"""
+
+SESSION_NOTE = """
+Session (optional):
+- Pass the same session_id to the deep_thinking_agent, enhancement_agent and final_review_agent calls of one task.
+- The server remembers the earlier requests and answers of the session (older ones as a summary), so follow-up calls only need to send new or changed material.
+"""
+
+CONVERSATION_HISTORY_NOTE = """
+Earlier tool calls in this session and your answers to them (oldest first; older calls may be summarized). Use them as background for the new request below.
+"""
+
+CONVERSATION_SUMMARY_PROMPT = """
+You compress the history of a code review and problem-solving session into a concise summary that later calls will receive instead of the full history.
+Keep the task and the user's requirements and constraints, the agreed plan, the findings and recommendations that are still open, decisions that were made, and file names, identifiers and versions.
+Drop pleasantries, repeated content, and code that can be resent; describe code changes in a sentence instead.
+Write plain text without an introduction.
+"""
+
+BATCH_REVIEW_DESCRIPTION = """
+This tool reviews many independent files or modules in a single call, for example when reviewing dozens of modules at once.
+Each job is reviewed exactly as enhancement_agent or final_review_agent (chosen with agent) would review it, and jobs run concurrently on the server.
+
+Submission Format:
+- jobs: list of objects, each with:
+  - id: str (optional, a label such as the file path, used in the result)
+  - instructions: str (Requirements or constraints for this job.)
+  - code: list[str] (Complete file contents for this job, as raw strings.)
+- agent: "final_review_agent" (default) or "enhancement_agent"
+- concurrency: int (optional, how many jobs run at the same time, capped by the server setting)
+- upstream_batch: bool (optional, submit all jobs to the upstream batch API; cheaper, but may take a long time to complete)
+
+How it works:
+- Progress notifications report each job as soon as it completes, including its result text (truncated if long).
+- A failing job does not affect the others; its error is reported in its own section.
+- The result contains one section per job, in the order of jobs, and metadata with the time each job took and the overall throughput.
+"""
+
+
+# 説明文のプロファイル（DIVE_DEEP_DESCRIPTION_PROFILE）。fullは上の説明文をそのまま使い、
+# compactとminimalでは短い説明文の後にGUIDE_NOTEを付けて詳しい使い方をリソースに分ける
+DESCRIPTION_PROFILES = ('full', 'compact', 'minimal')
+
+GUIDE_NOTE = """
+Read the MCP resource dive-deep://guides/{tool_name} (or the tool_guide prompt) once for the full usage guide.
+"""
+
+COMPACT_DESCRIPTIONS = {
+    'deep_thinking_agent': """
+Reviews your structured thought process for a task BEFORE you start working on it.
+- Write your own step-by-step plan first; do not ask this tool for solutions and do not include code.
+- instructions: str (the user's requirements), context: str (your structured thought process).
+- Apply the feedback to your plan and follow the improved plan when implementing the task.
+- Optional: pass the same session_id on related calls so follow-ups only need to send new material.
+""",
+    'enhancement_agent': """
+Reviews code you have already written and suggests improvements. It never writes the solution for you.
+- Submit your complete answer first; never ask questions.
+- Call once per file: code is a list with the complete, raw content of one file (no markdown fences).
+- State the user's constraints (language, versions, formatting) in instructions.
+- Apply the suggestions and verify them yourself; do not repeat the review in the same cycle.
+- Optional: pass the same session_id on related calls so follow-ups only need to send new material.
+- Unchanged files may be sent as "sha256:<hex digest>" references (see known_code_blobs).
+""",
+    'final_review_agent': """
+Final quality gate for code after all enhancement_agent iterations are applied.
+- Call once per modified or created file, with the complete raw content (no markdown fences, no snippets).
+- State the user's constraints in instructions. Never call it again for the same file after the final review.
+- Apply the feedback, then present the final code and explain the changes to the user.
+- Optional: pass session_id and paths (required with session_id) to review only the changes on repeated reviews.
+- Unchanged files may be sent as "sha256:<hex digest>" references (see known_code_blobs).
+""",
+    'dive_deep_pipeline': """
+Runs deep_thinking_agent, enhancement_agent and final_review_agent in one call when you already have your plan and your complete code.
+- instructions: str, context: str (your thought process, or "" to skip thinking), code: list[str] (complete raw files).
+- Review only: create your own plan and solution first, then apply the feedback of every stage.
+""",
+    'batch_review': """
+Reviews many independent files or modules in one call, each job as enhancement_agent or final_review_agent (agent) would.
+- jobs: list of {id (optional), instructions, code: list[str]}; jobs run concurrently and report progress as they finish.
+- A failing job does not affect the others. upstream_batch=True is cheaper but may take a long time.
+""",
+    'known_code_blobs': """
+Reports which "sha256:<hex digest>" code references the server still holds.
+Known references can replace full file contents in code; unknown files must be sent in full.
+""",
+}
+
+MINIMAL_DESCRIPTIONS = {
+    'deep_thinking_agent': "Reviews your own structured plan (instructions, context) before you start a task.",
+    'enhancement_agent': "Reviews one complete file of code you already wrote and suggests improvements.",
+    'final_review_agent': "Final review of one complete modified file after applying enhancement_agent feedback.",
+    'dive_deep_pipeline': "Runs thinking, enhancement and final review of your plan and code in one call.",
+    'batch_review': "Reviews many independent files or modules concurrently in one call.",
+    'known_code_blobs': "Reports which sha256 code references the server still holds.",
+}
@@ -0,0 +1,231 @@
+"""レスポンスキャッシュモジュール
+
+ツール名・モデル・システムプロンプト・温度パラメータ・コンテンツのハッシュを
+キーとして、生成結果をメモリ(LRU)とディスクの2階層にキャッシュします。
+"""
+
+import asyncio
+import hashlib
+import json
+import os
+import threading
+import time
+from collections import OrderedDict
+from dataclasses import dataclass
+from typing import Any, Dict, Optional
+
+
+def _sha256(text: str) -> str:
+    return hashlib.sha256(text.encode("utf-8")).hexdigest()
+
+
+def make_cache_key(
+    tool_name: str,
+    model: str,
+    system_prompt: str,
+    temperature: Optional[float],
+    content: str,
+    max_output_tokens: Optional[int] = None
+) -> str:
+    """リクエストの内容からキャッシュキーを生成します
+
+    出力トークン数の上限が異なるリクエストは、応答の長さが変わるため別のキーになります
+    （上限がない場合のキーは上限を導入する前と同じです）。
+    """
+    parts = [tool_name, model, _sha256(system_prompt), temperature, _sha256(content)]
+    if max_output_tokens is not None:
+        parts.append(max_output_tokens)
+    return _sha256(json.dumps(parts, ensure_ascii=False))
+
+
+@dataclass
+class CacheEntry:
+    """キャッシュされた生成結果"""
+    text: str
+    created_at: float
+    latency: float
+
+
+class ResponseCache:
+    """TTLとサイズ上限を持つ2階層のレスポンスキャッシュ
+
+    メモリ階層はエントリ数で、ディスク階層は合計バイト数で上限を管理し、
+    上限を超えた場合は最も古いエントリから削除します。
+    """
+
+    def __init__(
+        self,
+        max_entries: int = 256,
+        ttl_seconds: float = 3600,
+        disk_dir: Optional[str] = None,
+        max_disk_bytes: int = 100 * 1024 * 1024
+    ):
+        self.max_entries = max_entries
+        self.ttl_seconds = ttl_seconds
+        self.disk_dir = disk_dir
+        self.max_disk_bytes = max_disk_bytes
+        self._memory: "OrderedDict[str, CacheEntry]" = OrderedDict()
+        self._lock = threading.Lock()
+        self._disk_bytes = 0
+        self.memory_hits = 0
+        self.disk_hits = 0
+        self.misses = 0
+        self.saved_seconds = 0.0
+        if self.disk_dir:
+            os.makedirs(self.disk_dir, exist_ok=True)
+            self._disk_bytes = sum(size for _, size, _ in self._disk_files())
+
+    def get(self, key: str) -> Optional[CacheEntry]:
+        """キャッシュを検索し、有効なエントリがあれば返します"""
+        entry = self._get_memory(key)
+        if entry is not None:
+            return entry
+        return self._get_disk(key)
+
+    async def get_async(self, key: str) -> Optional[CacheEntry]:
+        """getの非同期版です（ディスク階層の読み込みはイベントループを止めないようスレッドで行います）"""
+        entry = self._get_memory(key)
+        if entry is not None:
+            return entry
+        if not self.disk_dir:
+            return self._get_disk(key)
+        return await asyncio.to_thread(self._get_disk, key)
+
+    def set(self, key: str, text: str, latency: float) -> None:
+        """生成結果をキャッシュに保存します"""
+        entry = self._set_memory(key, text, latency)
+        self._write_disk(key, entry)
+
+    async def set_async(self, key: str, text: str, latency: float) -> None:
+        """setの非同期版です（ディスク階層への書き込みはスレッドで行います）"""
+        entry = self._set_memory(key, text, latency)
+        if self.disk_dir:
+            await asyncio.to_thread(self._write_disk, key, entry)
+
+    def clear(self) -> None:
+        """メモリ階層とディスク階層のすべてのエントリを削除します"""
+        with self._lock:
+            self._memory.clear()
+        for path, _, _ in self._disk_files():
+            self._remove_file(path)
+
+    def stats(self) -> Dict[str, Any]:
+        """ヒット・ミスの集計値を返します"""
+        with self._lock:
+            hits = self.memory_hits + self.disk_hits
+            total = hits + self.misses
+            return {
+                'hits': hits,
+                'memory_hits': self.memory_hits,
+                'disk_hits': self.disk_hits,
+                'misses': self.misses,
+                'hit_rate': hits / total if total else 0.0,
+                'saved_seconds': round(self.saved_seconds, 3),
+                'memory_entries': len(self._memory),
+                'disk_bytes': self._disk_bytes,
+            }
+
+    def _get_memory(self, key: str) -> Optional[CacheEntry]:
+        with self._lock:
+            entry = self._memory.get(key)
+            if entry is not None and self._is_expired(entry):
+                del self._memory[key]
+                entry = None
+            if entry is not None:
+                self._memory.move_to_end(key)
+                self.memory_hits += 1
+                self.saved_seconds += entry.latency
+            return entry
+
+    def _get_disk(self, key: str) -> Optional[CacheEntry]:
+        entry = self._read_disk(key)
+        with self._lock:
+            if entry is None:
+                self.misses += 1
+                return None
+            self.disk_hits += 1
+            self.saved_seconds += entry.latency
+            self._store_memory(key, entry)
+            return entry
+
+    def _set_memory(self, key: str, text: str, latency: float) -> CacheEntry:
+        entry = CacheEntry(text=text, created_at=time.time(), latency=latency)
+        with self._lock:
+            self._store_memory(key, entry)
+        return entry
+
+    def _is_expired(self, entry: CacheEntry) -> bool:
+        return time.time() - entry.created_at > self.ttl_seconds
+
+    def _store_memory(self, key: str, entry: CacheEntry) -> None:
+        self._memory[key] = entry
+        self._memory.move_to_end(key)
+        while len(self._memory) > self.max_entries:
+            self._memory.popitem(last=False)
+
+    def _disk_path(self, key: str) -> str:
+        return os.path.join(self.disk_dir, f"{key}.json")
+
+    def _disk_files(self):
+        """ディスク上のキャッシュファイルを(パス, サイズ, 更新時刻)で列挙します"""
+        if not self.disk_dir:
+            return []
+        files = []
+        for name in os.listdir(self.disk_dir):
+            if not name.endswith(".json"):
+                continue
+            path = os.path.join(self.disk_dir, name)
+            try:
+                stat = os.stat(path)
+            except OSError:
+                continue
+            files.append((path, stat.st_size, stat.st_mtime))
+        return files
+
+    def _read_disk(self, key: str) -> Optional[CacheEntry]:
+        if not self.disk_dir:
+            return None
+        path = self._disk_path(key)
+        try:
+            with open(path, encoding="utf-8") as f:
+                entry = CacheEntry(**json.load(f))
+        except (OSError, ValueError, TypeError):
+            return None
+        if self._is_expired(entry):
+            self._remove_file(path)
+            return None
+        return entry
+
+    def _write_disk(self, key: str, entry: CacheEntry) -> None:
+        if not self.disk_dir:
+            return
+        path = self._disk_path(key)
+        data = json.dumps(entry.__dict__, ensure_ascii=False).encode("utf-8")
+        tmp_path = f"{path}.tmp"
+        try:
+            previous = os.path.getsize(path) if os.path.exists(path) else 0
+            with open(tmp_path, "wb") as f:
+                f.write(data)
+            os.replace(tmp_path, path)
+        except OSError:
+            return
+        with self._lock:
+            self._disk_bytes += len(data) - previous
+        if self._disk_bytes > self.max_disk_bytes:
+            self._evict_disk()
+
+    def _evict_disk(self) -> None:
+        """ディスク階層の合計サイズが上限以下になるまで古いファイルを削除します"""
+        for path, _, _ in sorted(self._disk_files(), key=lambda f: f[2]):
+            if self._disk_bytes <= self.max_disk_bytes:
+                break
+            self._remove_file(path)
+
+    def _remove_file(self, path: str) -> None:
+        try:
+            size = os.path.getsize(path)
+            os.remove(path)
+        except OSError:
+            return
+        with self._lock:
+            self._disk_bytes -= size
@@ -0,0 +1,202 @@
+"""リクエストスケジューラモジュール
+
+モデルごとのRPM/TPMトークンバケットと同時実行数の上限でリクエストを待機させ、
+レート制限や一時的なエラーはジッター付き指数バックオフで再試行します。
+"""
+
+import asyncio
+import email.utils
+import random
+import re
+import time
+from dataclasses import dataclass
+from typing import Any, Awaitable, Callable, Dict, Iterable, Optional
+
+from loguru import logger
+
+# 再試行の対象とするHTTPステータスコード
+RETRYABLE_STATUS_CODES = (429, 500, 502, 503, 504)
+
+
+@dataclass
+class ModelQuota:
+    """モデルごとのレート制限（0またはNoneは無制限）"""
+    rpm: Optional[float] = None
+    tpm: Optional[float] = None
+
+
+class TokenBucket:
+    """1分あたりの補充量を持つ非同期トークンバケット
+
+    取得要求は到着順に処理され、トークンが不足している場合は補充されるまで待機します。
+    容量を超える要求はバケットが満杯になった時点で許可されます。
+    """
+
+    def __init__(self, per_minute: float, capacity: Optional[float] = None):
+        self.rate = per_minute / 60.0
+        self.capacity = capacity if capacity is not None else per_minute
+        self.tokens = self.capacity
+        self.updated_at = time.monotonic()
+        self._lock = asyncio.Lock()
+
+    def _refill(self) -> None:
+        now = time.monotonic()
+        self.tokens = min(self.capacity, self.tokens + (now - self.updated_at) * self.rate)
+        self.updated_at = now
+
+    async def acquire(self, amount: float = 1.0) -> float:
+        """トークンを取得し、待機した秒数を返します"""
+        amount = min(amount, self.capacity)
+        waited = 0.0
+        async with self._lock:
+            self._refill()
+            while self.tokens < amount:
+                delay = (amount - self.tokens) / self.rate
+                await asyncio.sleep(delay)
+                waited += delay
+                self._refill()
+            self.tokens -= amount
+        return waited
+
+
+def get_status_code(error: BaseException) -> Optional[int]:
+    """例外からHTTPステータスコードを取り出します"""
+    for attr in ('code', 'status_code'):
+        value = getattr(error, attr, None)
+        if isinstance(value, int):
+            return value
+    response = getattr(error, 'response', None)
+    value = getattr(response, 'status_code', None)
+    return value if isinstance(value, int) else None
+
+
+def get_retry_after(error: BaseException) -> Optional[float]:
+    """Retry-Afterヘッダーまたはエラー詳細のretryDelayから待機秒数を取り出します"""
+    headers = getattr(getattr(error, 'response', None), 'headers', None) or {}
+    value = headers.get('retry-after') if hasattr(headers, 'get') else None
+    if value:
+        try:
+            return max(0.0, float(value))
+        except ValueError:
+            pass
+        try:
+            parsed = email.utils.parsedate_to_datetime(value)
+            return max(0.0, parsed.timestamp() - time.time())
+        except (TypeError, ValueError):
+            pass
+
+    # Gemini APIは google.rpc.RetryInfo の retryDelay（例: "17s"）で待機時間を返す
+    match = re.search(r"retryDelay'?\"?\s*[:=]\s*'?\"?([\d.]+)s", str(getattr(error, 'details', '')))
+    if match:
+        return float(match.group(1))
+    return None
+
+
+class RequestScheduler:
+    """すべての上流リクエストを通す中央スケジューラ
+
+    リクエストはモデルごとのトークンバケットと同時実行数の上限に従って待機し、
+    失敗せずにキューイングされます。再試行対象のエラーは、Retry-Afterが
+    指定されていればその時間、なければジッター付き指数バックオフで待ってから
+    再試行します。
+    """
+
+    def __init__(
+        self,
+        max_concurrency: int = 8,
+        quotas: Optional[Dict[str, ModelQuota]] = None,
+        default_quota: Optional[ModelQuota] = None,
+        max_retries: int = 5,
+        base_delay: float = 1.0,
+        max_delay: float = 60.0,
+        retryable_status_codes: Iterable[int] = RETRYABLE_STATUS_CODES
+    ):
+        self.max_concurrency = max_concurrency
+        self.quotas = quotas or {}
+        self.default_quota = default_quota or ModelQuota()
+        self.max_retries = max_retries
+        self.base_delay = base_delay
+        self.max_delay = max_delay
+        self.retryable_status_codes = set(retryable_status_codes)
+        self._semaphore = asyncio.Semaphore(max_concurrency)
+        self._request_buckets: Dict[str, Optional[TokenBucket]] = {}
+        self._token_buckets: Dict[str, Optional[TokenBucket]] = {}
+        self.waiting = 0
+        self.running = 0
+        self.completed = 0
+        self.failed = 0
+        self.retries = 0
+        self.throttled_seconds = 0.0
+
+    def _buckets(self, model: str):
+        if model not in self._request_buckets:
+            quota = self.quotas.get(model, self.default_quota)
+            self._request_buckets[model] = TokenBucket(quota.rpm) if quota.rpm else None
+            self._token_buckets[model] = TokenBucket(quota.tpm) if quota.tpm else None
+        return self._request_buckets[model], self._token_buckets[model]
+
+    def _backoff_delay(self, error: BaseException, attempt: int) -> float:
+        retry_after = get_retry_after(error)
+        if retry_after is not None:
+            # 複数の呼び出しが同時に再開しないよう、指定時間に小さなジッターを加える
+            return retry_after + random.uniform(0, self.base_delay)
+        return random.uniform(0, min(self.max_delay, self.base_delay * 2 ** attempt))
+
+    async def run(
+        self,
+        model: str,
+        estimated_tokens: int,
+        fn: Callable[[], Awaitable[Any]]
+    ) -> Any:
+        """レート制限に従ってfnを実行し、必要に応じて再試行します"""
+        request_bucket, token_bucket = self._buckets(model)
+        attempt = 0
+        while True:
+            self.waiting += 1
+            try:
+                # 待機の前に値を読む「+= await」では同時に待機した呼び出しの加算が失われる
+                if request_bucket is not None:
+                    waited = await request_bucket.acquire(1)
+                    self.throttled_seconds += waited
+                if token_bucket is not None:
+                    waited = await token_bucket.acquire(estimated_tokens)
+                    self.throttled_seconds += waited
+                await self._semaphore.acquire()
+            finally:
+                self.waiting -= 1
+
+            self.running += 1
+            try:
+                result = await fn()
+            except Exception as e:
+                status = get_status_code(e)
+                if status not in self.retryable_status_codes or attempt >= self.max_retries:
+                    self.failed += 1
+                    raise
+                delay = self._backoff_delay(e, attempt)
+            else:
+                self.completed += 1
+                return result
+            finally:
+                self.running -= 1
+                self._semaphore.release()
+
+            attempt += 1
+            self.retries += 1
+            logger.warning(
+                "{} returned {}, retrying in {:.2f}s (attempt {}/{})",
+                model, status, delay, attempt, self.max_retries,
+            )
+            await asyncio.sleep(delay)
+
+    def stats(self) -> Dict[str, Any]:
+        """待機中・実行中のリクエスト数と再試行の集計値を返します"""
+        return {
+            'max_concurrency': self.max_concurrency,
+            'waiting': self.waiting,
+            'running': self.running,
+            'completed': self.completed,
+            'failed': self.failed,
+            'retries': self.retries,
+            'throttled_seconds': round(self.throttled_seconds, 3),
+        }
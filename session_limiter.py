@@ -0,0 +1,82 @@
+"""クライアントセッションごとの同時実行数制限モジュール
+
+HTTPトランスポートでは1つのサーバープロセスを複数のエディタが共有するため、
+1つのクライアントが上流の同時実行枠をすべて占有しないように、
+セッションごとに同時に実行できる上流呼び出しの数を制限します。
+"""
+
+import asyncio
+import weakref
+from contextlib import asynccontextmanager
+from typing import Any, AsyncIterator, Dict, Optional
+
+
+class _SessionState:
+    """1つのクライアントセッションの同時実行数と呼び出し数"""
+
+    def __init__(self, number: int, max_concurrency: int):
+        self.number = number
+        self.semaphore = asyncio.Semaphore(max_concurrency) if max_concurrency > 0 else None
+        self.in_flight = 0
+        self.calls = 0
+        self.waits = 0
+
+
+class SessionLimiter:
+    """セッションごとに同時実行数を制限します
+
+    セッションはMCPのセッションオブジェクトで識別し、弱参照で保持するため
+    切断されたセッションの状態は自動的に破棄されます。
+    max_concurrencyが0の場合は制限せず、呼び出し数の集計だけを行います。
+    """
+
+    def __init__(self, max_concurrency: int = 0):
+        self.max_concurrency = max_concurrency
+        self._sessions: "weakref.WeakKeyDictionary[Any, _SessionState]" = weakref.WeakKeyDictionary()
+        self.total_sessions = 0
+
+    def _state(self, session: Any) -> _SessionState:
+        state = self._sessions.get(session)
+        if state is None:
+            self.total_sessions += 1
+            state = _SessionState(self.total_sessions, self.max_concurrency)
+            self._sessions[session] = state
+        return state
+
+    @asynccontextmanager
+    async def slot(self, session: Optional[Any]) -> AsyncIterator[None]:
+        """セッションの実行枠を1つ確保します（sessionがNoneの場合は制限しません）"""
+        if session is None:
+            yield
+            return
+        state = self._state(session)
+        state.calls += 1
+        if state.semaphore is not None:
+            if state.semaphore.locked():
+                state.waits += 1
+            await state.semaphore.acquire()
+        state.in_flight += 1
+        try:
+            yield
+        finally:
+            state.in_flight -= 1
+            if state.semaphore is not None:
+                state.semaphore.release()
+
+    def stats(self) -> Dict[str, Any]:
+        """接続中のセッション数とセッションごとの実行状況を返します"""
+        sessions = sorted(self._sessions.values(), key=lambda s: s.number)
+        return {
+            'max_concurrency_per_session': self.max_concurrency,
+            'active_sessions': len(sessions),
+            'total_sessions': self.total_sessions,
+            'sessions': [
+                {
+                    'session': state.number,
+                    'in_flight': state.in_flight,
+                    'calls': state.calls,
+                    'waits': state.waits,
+                }
+                for state in sessions
+            ],
+        }
@@ -0,0 +1,198 @@
+"""セッションストアモジュール
+
+クライアントが指定したセッションIDごとに、ツール呼び出しをまたいで保持する状態
+（前回レビューしたファイルの内容とレビュー結果、ツール呼び出しの会話の履歴など）を
+管理します。セッションIDはMCPのクライアントセッションごとに区別されるため、HTTPで
+サーバーを共有するクライアントが同じIDを使っても状態は共有されません。
+一定時間使われなかったセッションと、上限を超えた古いセッションは破棄されます。
+"""
+
+import asyncio
+import hashlib
+import sys
+import threading
+import time
+import weakref
+from collections import OrderedDict
+from dataclasses import dataclass, field
+from typing import Any, Dict, List, Optional, Tuple
+
+
+@dataclass
+class Turn:
+    """会話の1往復（ツールへのリクエストとモデルの回答）"""
+    tool: str
+    request: str
+    response: str
+    tokens: int
+
+
+@dataclass
+class Session:
+    """1つのセッションの状態"""
+    session_id: str
+    created_at: float
+    last_used: float
+    # MCPのクライアントセッションの番号（0はクライアントセッションのない呼び出し）
+    client: int = 0
+    # 前回レビューしたファイルの内容（パス -> 内容）
+    reviewed_files: Dict[str, str] = field(default_factory=dict)
+    # 前回のレビュー結果
+    last_review: Optional[str] = None
+    # 要約していない会話の履歴（古い順）
+    turns: List[Turn] = field(default_factory=list)
+    # 要約済みの古い会話と、その推定トークン数・要約した往復の数
+    summary: Optional[str] = None
+    summary_tokens: int = 0
+    summarized_turns: int = 0
+    # 実行中の要約のタスク
+    summarizing: Optional[Any] = field(default=None, repr=False)
+    # 同じセッションのインクリメンタルレビューを1つずつ実行するためのロック
+    review_lock: asyncio.Lock = field(default_factory=asyncio.Lock, repr=False)
+
+    def add_turn(self, turn: Turn) -> None:
+        self.turns.append(turn)
+
+    def history_tokens(self) -> int:
+        """会話の履歴（要約を含む）の推定トークン数を返します"""
+        return self.summary_tokens + sum(turn.tokens for turn in self.turns)
+
+    def needs_compaction(self, max_turns: int, token_budget: int, keep_turns: int = 0) -> bool:
+        """会話の履歴が往復数またはトークン数の上限を超えているかを返します
+
+        往復数がkeep_turns以下の場合は要約できる古い往復がないため、Falseを返します。
+        """
+        if len(self.turns) <= keep_turns:
+            return False
+        return len(self.turns) > max_turns or self.history_tokens() > token_budget
+
+    def compact(self, count: int, summary: Optional[str], summary_tokens: int) -> None:
+        """古いcount往復を要約で置き換えます（summaryがNoneの場合は要約せずに捨てます）"""
+        del self.turns[:count]
+        self.summarized_turns += count
+        if summary is not None:
+            self.summary = summary
+            self.summary_tokens = summary_tokens
+
+    def save_review(self, files: Dict[str, str], review: str, max_bytes: int) -> bool:
+        """レビューしたファイルと結果を次回の差分の基準として保存します
+
+        ファイルの合計サイズがmax_bytesを超える場合は保存せず（次回は全文をレビューします）、
+        Falseを返します。
+        """
+        size = sum(sys.getsizeof(path) + sys.getsizeof(text) for path, text in files.items())
+        if max_bytes and size > max_bytes:
+            self.reviewed_files = {}
+            self.last_review = None
+            return False
+        self.reviewed_files = files
+        self.last_review = review
+        return True
+
+    def memory_bytes(self) -> int:
+        """セッションが保持している文字列の合計サイズ（バイト）を返します"""
+        size = sum(
+            sys.getsizeof(path) + sys.getsizeof(text) for path, text in self.reviewed_files.items()
+        )
+        size += sum(
+            sys.getsizeof(turn.request) + sys.getsizeof(turn.response) for turn in self.turns
+        )
+        for text in (self.last_review, self.summary):
+            if text is not None:
+                size += sys.getsizeof(text)
+        return size
+
+
+class SessionStore:
+    """アイドル時間と最大数で上限を管理するセッションストア"""
+
+    def __init__(
+        self,
+        max_sessions: int = 128,
+        idle_ttl_seconds: float = 3600,
+        max_review_bytes: int = 8 * 1024 * 1024
+    ):
+        self.max_sessions = max_sessions
+        self.idle_ttl_seconds = idle_ttl_seconds
+        # セッションごとに差分の基準として保持するファイルの合計サイズの上限（0は無制限）
+        self.max_review_bytes = max_review_bytes
+        self._sessions: "OrderedDict[Tuple[int, str], Session]" = OrderedDict()
+        # MCPのクライアントセッション -> 番号（切断されたクライアントは弱参照で破棄される）
+        self._clients: "weakref.WeakKeyDictionary[Any, int]" = weakref.WeakKeyDictionary()
+        self.total_clients = 0
+        self._lock = threading.Lock()
+        self.evictions = 0
+
+    def _evict_idle(self, now: float) -> None:
+        # 最後に使われた順に並んでいるため、先頭から期限切れのものを削除する
+        while self._sessions:
+            session = next(iter(self._sessions.values()))
+            if now - session.last_used <= self.idle_ttl_seconds:
+                break
+            self._sessions.popitem(last=False)
+            self.evictions += 1
+
+    def _client_number(self, client: Optional[Any]) -> int:
+        if client is None:
+            return 0
+        number = self._clients.get(client)
+        if number is None:
+            # 番号は再利用しないため、切断したクライアントのセッションには到達できない
+            self.total_clients += 1
+            number = self._clients[client] = self.total_clients
+        return number
+
+    def get(self, session_id: str, client: Optional[Any] = None) -> Session:
+        """セッションを返します（存在しないか期限切れの場合は新しく作成します）
+
+        clientには呼び出し元のMCPセッションを渡します。同じsession_idでも、
+        クライアントセッションが異なれば別のセッションになります。
+        """
+        now = time.time()
+        with self._lock:
+            self._evict_idle(now)
+            key = (self._client_number(client), session_id)
+            session = self._sessions.get(key)
+            if session is None:
+                session = Session(
+                    session_id=session_id, created_at=now, last_used=now, client=key[0]
+                )
+                self._sessions[key] = session
+                while len(self._sessions) > self.max_sessions:
+                    self._sessions.popitem(last=False)
+                    self.evictions += 1
+            else:
+                session.last_used = now
+                self._sessions.move_to_end(key)
+            return session
+
+    def stats(self) -> Dict[str, Any]:
+        """保持しているセッション数と破棄したセッション数、セッションごとのメモリ使用量を返します
+
+        セッションIDはクライアントが指定した値のため、そのままではなくハッシュの先頭で示します。
+        """
+        now = time.time()
+        with self._lock:
+            self._evict_idle(now)
+            sessions = [
+                {
+                    'session': hashlib.sha256(session.session_id.encode('utf-8')).hexdigest()[:12],
+                    'client': session.client,
+                    'turns': len(session.turns),
+                    'summarized_turns': session.summarized_turns,
+                    'history_tokens': session.history_tokens(),
+                    'reviewed_files': len(session.reviewed_files),
+                    'memory_bytes': session.memory_bytes(),
+                    'idle_seconds': round(now - session.last_used, 1),
+                }
+                for session in self._sessions.values()
+            ]
+            return {
+                'sessions': len(self._sessions),
+                'max_sessions': self.max_sessions,
+                'idle_ttl_seconds': self.idle_ttl_seconds,
+                'max_review_bytes': self.max_review_bytes,
+                'evictions': self.evictions,
+                'memory_bytes': sum(session['memory_bytes'] for session in sessions),
+                'session_details': sorted(sessions, key=lambda s: -s['memory_bytes']),
+            }
@@ -0,0 +1,225 @@
+"""類似リクエストキャッシュモジュール
+
+正規化したリクエストのテキストからMinHashの署名を計算し、過去のリクエストのうち
+推定したJaccard類似度が閾値以上のものの生成結果を返します。わずかな語句の違いしか
+ないリクエストも、外部のサービスを使わずにキャッシュから応答できます。
+
+署名は1回のハッシュで計算できるone permutation hashingで作り、検索には署名を
+バンドに分けたLSHを使います。いずれかのバンドが一致したエントリだけを候補として
+比較するため、エントリ数が増えても検索時間はほとんど変わりません。
+"""
+
+import re
+import threading
+import time
+from array import array
+from collections import OrderedDict
+from dataclasses import dataclass
+from typing import Any, Dict, List, Optional, Tuple, Union
+
+# 署名の要素数（ハッシュ値を振り分けるビンの数）
+SIGNATURE_SIZE = 64
+
+# 英数字の単語とCJK文字を正規化後のトークンとして扱う（記号と空白は無視する）
+_WORD_PATTERN = re.compile(r"[a-z0-9_]+|[\u3040-\u30ff\u3400-\u4dbf\u4e00-\u9fff\uac00-\ud7af]")
+# 連続するトークン数（シングル）の長さ
+_SHINGLE_SIZE = 3
+_BIN_BITS = SIGNATURE_SIZE.bit_length() - 1
+_EMPTY = 0xFFFFFFFF
+
+
+def signature(text: str) -> Optional[array]:
+    """テキストのMinHash署名を返します
+
+    小文字化したトークンの連続（シングル）をそれぞれハッシュし、下位ビットで
+    選んだビンごとに残りのビットの最小値を記録します。シングルが割り当てられ
+    なかったビンは右隣のビンの値で埋めます。署名はプロセス内でのみ比較できます。
+    トークンを含まないテキスト（空や記号だけ）は互いに区別できないため、Noneを返します。
+    """
+    words = _WORD_PATTERN.findall(text.lower())
+    if not words:
+        return None
+    shingles = {
+        ' '.join(words[i:i + _SHINGLE_SIZE])
+        for i in range(max(1, len(words) - _SHINGLE_SIZE + 1))
+    }
+    mins = [_EMPTY] * SIGNATURE_SIZE
+    for shingle in shingles:
+        value = hash(shingle) & 0xFFFFFFFFFFFFFFFF
+        index = value & (SIGNATURE_SIZE - 1)
+        value = (value >> _BIN_BITS) & 0xFFFFFFFF
+        if value < mins[index]:
+            mins[index] = value
+    if _EMPTY in mins:
+        filled = [i for i, value in enumerate(mins) if value != _EMPTY]
+        for index in range(SIGNATURE_SIZE):
+            if mins[index] == _EMPTY:
+                source = next((i for i in filled if i > index), filled[0])
+                mins[index] = (mins[source] + (source - index) % SIGNATURE_SIZE) & 0xFFFFFFFF
+    return array('I', mins)
+
+
+def similarity(a: array, b: array) -> float:
+    """2つの署名から推定したJaccard類似度を返します"""
+    return sum(x == y for x, y in zip(a, b)) / SIGNATURE_SIZE
+
+
+def _rows_per_band(threshold: float) -> int:
+    """閾値ちょうどの類似度のエントリが98%以上の確率で候補になる最大のバンド幅を返します"""
+    for rows in (8, 4, 2):
+        if 1 - (1 - threshold ** rows) ** (SIGNATURE_SIZE // rows) >= 0.98:
+            return rows
+    return 1
+
+
+@dataclass(slots=True)
+class _Entry:
+    scope: str
+    signature: array
+    text: str
+    size: int
+    created_at: float
+
+
+class SimilarityCache:
+    """エントリ数・合計サイズ・TTLで上限を管理するMinHashの類似キャッシュ
+
+    エントリはスコープ（ツール・モデル・システムプロンプト・温度の組み合わせ）ごとに
+    検索され、異なるスコープの結果は返されません。上限を超えた場合は最も長く
+    参照されていないエントリから削除します。
+    """
+
+    def __init__(
+        self,
+        threshold: float = 0.9,
+        max_entries: int = 10000,
+        max_bytes: int = 64 * 1024 * 1024,
+        ttl_seconds: float = 3600
+    ):
+        if not 0 < threshold <= 1:
+            raise ValueError(f"threshold must be in (0, 1]: {threshold}")
+        self.threshold = threshold
+        self.max_entries = max_entries
+        self.max_bytes = max_bytes
+        self.ttl_seconds = ttl_seconds
+        self.rows = _rows_per_band(threshold)
+        self._entries: "OrderedDict[int, _Entry]" = OrderedDict()
+        # バンドのハッシュ -> エントリID（複数ある場合はリスト）
+        self._buckets: Dict[int, Union[int, List[int]]] = {}
+        self._next_id = 0
+        self._bytes = 0
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self.candidates = 0
+        self.skipped = 0
+
+    def _band_keys(self, scope: str, sig: array):
+        rows = self.rows
+        for start in range(0, SIGNATURE_SIZE, rows):
+            yield hash((scope, start, sig[start:start + rows].tobytes()))
+
+    def lookup(self, scope: str, text: str) -> Optional[Tuple[str, float]]:
+        """類似度が閾値以上の過去の生成結果と類似度を返します（ない場合はNone）
+
+        署名を計算できないテキストは検索せずにNoneを返します。
+        """
+        sig = signature(text)
+        if sig is None:
+            with self._lock:
+                self.skipped += 1
+            return None
+        return self.lookup_signature(scope, sig)
+
+    def lookup_signature(self, scope: str, sig: array) -> Optional[Tuple[str, float]]:
+        """計算済みの署名で検索します"""
+        now = time.time()
+        with self._lock:
+            candidates = set()
+            for key in self._band_keys(scope, sig):
+                bucket = self._buckets.get(key)
+                if bucket is None:
+                    continue
+                if isinstance(bucket, int):
+                    candidates.add(bucket)
+                else:
+                    candidates.update(bucket)
+            self.candidates += len(candidates)
+            best: Optional[int] = None
+            best_similarity = self.threshold
+            for entry_id in candidates:
+                entry = self._entries[entry_id]
+                if entry.scope != scope:
+                    continue
+                score = similarity(sig, entry.signature)
+                if score >= best_similarity:
+                    best, best_similarity = entry_id, score
+            if best is not None and now - self._entries[best].created_at > self.ttl_seconds:
+                self._remove(best)
+                best = None
+            if best is None:
+                self.misses += 1
+                return None
+            self._entries.move_to_end(best)
+            self.hits += 1
+            return self._entries[best].text, best_similarity
+
+    def add(self, scope: str, text: str, response: str) -> None:
+        """リクエストのテキストと生成結果を登録します（署名を計算できない場合は登録しません）"""
+        sig = signature(text)
+        if sig is not None:
+            self.add_signature(scope, sig, response)
+
+    def add_signature(self, scope: str, sig: array, response: str) -> None:
+        """計算済みの署名で登録します"""
+        size = len(response.encode("utf-8"))
+        if size > self.max_bytes:
+            return
+        with self._lock:
+            entry_id = self._next_id
+            self._next_id += 1
+            self._entries[entry_id] = _Entry(scope, sig, response, size, time.time())
+            self._bytes += size
+            for key in self._band_keys(scope, sig):
+                bucket = self._buckets.get(key)
+                if bucket is None:
+                    self._buckets[key] = entry_id
+                elif isinstance(bucket, int):
+                    self._buckets[key] = [bucket, entry_id]
+                else:
+                    bucket.append(entry_id)
+            while len(self._entries) > self.max_entries or self._bytes > self.max_bytes:
+                self._remove(next(iter(self._entries)))
+                self.evictions += 1
+
+    def _remove(self, entry_id: int) -> None:
+        entry = self._entries.pop(entry_id)
+        self._bytes -= entry.size
+        for key in self._band_keys(entry.scope, entry.signature):
+            bucket = self._buckets.get(key)
+            if bucket == entry_id:
+                del self._buckets[key]
+            elif isinstance(bucket, list):
+                bucket.remove(entry_id)
+                if len(bucket) == 1:
+                    self._buckets[key] = bucket[0]
+
+    def stats(self) -> Dict[str, Any]:
+        """エントリ数・サイズとヒット・ミスの集計値を返します"""
+        with self._lock:
+            lookups = self.hits + self.misses
+            return {
+                'entries': len(self._entries),
+                'bytes': self._bytes,
+                'max_entries': self.max_entries,
+                'max_bytes': self.max_bytes,
+                'threshold': self.threshold,
+                'bands': SIGNATURE_SIZE // self.rows,
+                'hits': self.hits,
+                'misses': self.misses,
+                'hit_rate': self.hits / lookups if lookups else 0.0,
+                'mean_candidates': self.candidates / lookups if lookups else 0.0,
+                'evictions': self.evictions,
+                'skipped': self.skipped,
+            }
@@ -0,0 +1,71 @@
+"""リクエスト合流モジュール
+
+同じキーを持つ実行中の呼び出しに後続の呼び出しを合流させ、
+上流へのリクエストを1回にまとめます。
+"""
+
+import asyncio
+from typing import Any, Awaitable, Callable, Dict, Tuple
+
+
+class _Call:
+    """実行中の呼び出しと、その結果を待っている呼び出し元の数"""
+
+    def __init__(self, task: "asyncio.Future[Any]"):
+        self.task = task
+        self.waiters = 0
+
+
+class SingleFlight:
+    """キーごとに実行中の呼び出しを1つに制限します
+
+    同じキーの呼び出しが実行中の場合、後続の呼び出しは新たに実行せずに
+    その結果（または例外）を共有します。待っている呼び出し元がすべて
+    キャンセルされた場合は、実行中の呼び出しもキャンセルします。
+    """
+
+    def __init__(self):
+        self._inflight: Dict[str, _Call] = {}
+        self.upstream_calls = 0
+        self.saved_calls = 0
+        self.cancelled_calls = 0
+
+    async def do(self, key: str, fn: Callable[[], Awaitable[Any]]) -> Tuple[Any, bool]:
+        """fnを実行するか実行中の呼び出しに合流し、(結果, 合流したか)を返します"""
+        call = self._inflight.get(key)
+        coalesced = call is not None
+        if call is None:
+            self.upstream_calls += 1
+            call = _Call(asyncio.ensure_future(fn()))
+            self._inflight[key] = call
+
+            def done(_: "asyncio.Future[Any]", call: _Call = call) -> None:
+                if self._inflight.get(key) is call:
+                    del self._inflight[key]
+
+            call.task.add_done_callback(done)
+        else:
+            self.saved_calls += 1
+
+        call.waiters += 1
+        try:
+            return await asyncio.shield(call.task), coalesced
+        except asyncio.CancelledError:
+            # 最後の呼び出し元がキャンセルされた場合は、結果を待つ相手がいないため上流も止める
+            if call.waiters == 1 and not call.task.done():
+                call.task.cancel()
+                self.cancelled_calls += 1
+                if self._inflight.get(key) is call:
+                    del self._inflight[key]
+            raise
+        finally:
+            call.waiters -= 1
+
+    def stats(self) -> Dict[str, int]:
+        """上流への呼び出し数と合流によって省略された呼び出し数を返します"""
+        return {
+            'upstream_calls': self.upstream_calls,
+            'saved_calls': self.saved_calls,
+            'cancelled_calls': self.cancelled_calls,
+            'inflight': len(self._inflight),
+        }
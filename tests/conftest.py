@@ -0,0 +1,13 @@
+import os
+import sys
+
+ROOT_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+if ROOT_DIR not in sys.path:
+    sys.path.insert(0, ROOT_DIR)
+
+# サーバーはインポート時に環境変数を読むため、インポートより前にフェイクバックエンドを設定する
+os.environ.update({
+    'DIVE_DEEP_BACKEND': 'fake',
+    'DIVE_DEEP_LOG_LEVEL': 'WARNING',
+    'DIVE_DEEP_TRACE_DIR': '',
+})
@@ -0,0 +1,136 @@
+import asyncio
+import json
+
+import pytest
+
+from backends import FakeBackend
+from session_limiter import SessionLimiter
+
+
+class ShortBatchBackend(FakeBackend):
+    """上流のバッチが送ったリクエストより少ない結果を返すフェイクバックエンド"""
+
+    async def generate_batch(self, model, requests, poll_interval=30.0, timeout=None):
+        results = await super().generate_batch(model, requests, poll_interval, timeout)
+        return results[:-1]
+
+
+class ConcurrencyBackend(FakeBackend):
+    """同時に実行中の呼び出し数の最大値を記録するフェイクバックエンド"""
+
+    def __init__(self, **options):
+        super().__init__(**options)
+        self.running = 0
+        self.max_running = 0
+
+    async def generate(self, *args, **kwargs):
+        self.running += 1
+        self.max_running = max(self.max_running, self.running)
+        try:
+            return await super().generate(*args, **kwargs)
+        finally:
+            self.running -= 1
+
+
+class ClientSession:
+    """MCPのクライアントセッションの代わりに弱参照で保持できるオブジェクト"""
+
+
+class RecordingContext:
+    def __init__(self):
+        self.session = ClientSession()
+        self.messages = []
+
+    async def report_progress(self, progress, total=None, message=None):
+        self.messages.append(json.loads(message))
+
+
+@pytest.fixture
+def server(monkeypatch):
+    import dive_deep_server as server
+
+    monkeypatch.setattr(server, 'CACHE_ENABLED', False)
+    return server
+
+
+def _jobs(count):
+    return [{'id': f"job{i}", 'instructions': "review", 'code': [f"x = {i}"]} for i in range(count)]
+
+
+def test_missing_upstream_batch_results_fail_only_those_jobs(server, monkeypatch):
+    monkeypatch.setattr(
+        server, 'backend', ShortBatchBackend(latency=0.01, tokens_per_second=1e6, output_tokens=10)
+    )
+
+    result = asyncio.run(server.batch_review(jobs=_jobs(3), upstream_batch=True))
+
+    jobs = result['metadata']['jobs']
+    assert [job['ok'] for job in jobs] == [True, True, False]
+    assert "2 results for 3 requests" in jobs[2]['error']
+    assert not result['isError']
+
+
+def test_unexpected_errors_are_returned_as_tool_errors(server, monkeypatch):
+    monkeypatch.setattr(
+        server, 'backend', FakeBackend(latency=0.01, tokens_per_second=1e6, output_tokens=10)
+    )
+
+    # 辞書でないジョブからはidを取り出せず、ジョブごとのエラー処理の外で例外になる
+    result = asyncio.run(server.batch_review(jobs=["not a job"]))
+
+    assert result['isError']
+    assert result['content'][0]['text'].startswith("Error in content generation")
+
+
+def test_progress_messages_include_the_job_text(server, monkeypatch):
+    monkeypatch.setattr(
+        server, 'backend', FakeBackend(latency=0.01, tokens_per_second=1e6, output_tokens=10)
+    )
+    ctx = RecordingContext()
+
+    result = asyncio.run(server.batch_review(jobs=_jobs(2), ctx=ctx))
+
+    text = result['content'][0]['text']
+    assert sorted(message['id'] for message in ctx.messages) == ['job0', 'job1']
+    for message in ctx.messages:
+        assert message['ok'] and not message['truncated']
+        assert message['text'] and message['text'] in text
+
+
+def test_progress_text_is_truncated(server, monkeypatch):
+    monkeypatch.setattr(
+        server, 'backend', FakeBackend(latency=0.01, tokens_per_second=1e6, output_tokens=50)
+    )
+    monkeypatch.setattr(server, 'BATCH_PROGRESS_CHARS', 20)
+    ctx = RecordingContext()
+
+    asyncio.run(server.batch_review(jobs=_jobs(1), ctx=ctx))
+
+    assert len(ctx.messages[0]['text']) == 20
+    assert ctx.messages[0]['truncated']
+
+
+def test_concurrency_is_capped_by_the_server_setting(server, monkeypatch):
+    fake = ConcurrencyBackend(latency=0.05, tokens_per_second=1e6, output_tokens=10)
+    monkeypatch.setattr(server, 'backend', fake)
+    monkeypatch.setattr(server, 'BATCH_CONCURRENCY', 2)
+
+    result = asyncio.run(server.batch_review(jobs=_jobs(6), concurrency=100))
+
+    assert all(job['ok'] for job in result['metadata']['jobs'])
+    assert fake.max_running == 2
+
+
+def test_jobs_are_limited_by_the_callers_session(server, monkeypatch):
+    fake = ConcurrencyBackend(latency=0.05, tokens_per_second=1e6, output_tokens=10)
+    monkeypatch.setattr(server, 'backend', fake)
+    monkeypatch.setattr(server, 'session_limiter', SessionLimiter(1))
+    ctx = RecordingContext()
+
+    result = asyncio.run(server.batch_review(jobs=_jobs(4), concurrency=4, ctx=ctx))
+
+    assert all(job['ok'] for job in result['metadata']['jobs'])
+    assert fake.max_running == 1
+    sessions = server.session_limiter.stats()['sessions']
+    assert sessions[0]['calls'] == 4
+    assert sessions[0]['in_flight'] == 0
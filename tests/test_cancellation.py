@@ -0,0 +1,112 @@
+import asyncio
+import json
+import time
+
+import pytest
+
+from backends import FakeBackend
+from scheduler import RequestScheduler
+from session_limiter import SessionLimiter
+from singleflight import SingleFlight
+
+TOOLS = ['deep_thinking_agent', 'enhancement_agent', 'final_review_agent']
+
+
+@pytest.fixture
+def server(monkeypatch):
+    import dive_deep_server as server
+
+    # 上流の呼び出しはキャンセルか期限切れになるまで終わらない
+    monkeypatch.setattr(
+        server, 'backend', FakeBackend(latency=30.0, tokens_per_second=1e6, output_tokens=10)
+    )
+    # キャッシュは使わず、上流の呼び出しは合流の管理下で実行する
+    monkeypatch.setattr(server, 'CACHE_ENABLED', False)
+    monkeypatch.setattr(server, 'COALESCING_ENABLED', True)
+    monkeypatch.setattr(server, 'scheduler', RequestScheduler(max_concurrency=8))
+    monkeypatch.setattr(server, 'request_coalescer', SingleFlight())
+    monkeypatch.setattr(server, 'session_limiter', SessionLimiter(2))
+    return server
+
+
+def _arguments(tool, index):
+    arguments = {'instructions': f"question {index}"}
+    if tool == 'deep_thinking_agent':
+        arguments['context'] = "context"
+    else:
+        arguments['code'] = [f"x = {index}"]
+    return arguments
+
+
+def _in_flight(server):
+    """スケジューラ・合流中の呼び出し・セッションが保持している実行枠の数を返します"""
+    sessions = server.session_limiter.stats()['sessions']
+    return (
+        server.scheduler.running,
+        server.request_coalescer.stats()['inflight'],
+        sum(session['in_flight'] for session in sessions),
+    )
+
+
+async def _wait_until(predicate, timeout=5.0):
+    started = time.perf_counter()
+    while not predicate():
+        assert time.perf_counter() - started < timeout, "condition was not met"
+        await asyncio.sleep(0.001)
+
+
+async def _with_client(server, run):
+    from mcp.shared.memory import create_connected_server_and_client_session
+
+    async with create_connected_server_and_client_session(server.mcp._mcp_server) as client:
+        return await run(client)
+
+
+@pytest.mark.parametrize('tool', TOOLS)
+def test_client_cancellation_releases_every_slot(server, tool):
+    from mcp import types
+
+    async def run(client):
+        tasks = []
+        request_ids = []
+        for index in range(2):
+            request_id = client._request_id
+            tasks.append(asyncio.create_task(client.call_tool(tool, _arguments(tool, index))))
+            await _wait_until(lambda: client._request_id > request_id)
+            request_ids.append(request_id)
+        await _wait_until(lambda: server.scheduler.running == 2)
+        running = _in_flight(server)
+
+        for request_id in request_ids:
+            await client.send_notification(types.ClientNotification(types.CancelledNotification(
+                params=types.CancelledNotificationParams(requestId=request_id, reason='test'),
+            )))
+        await _wait_until(lambda: _in_flight(server) == (0, 0, 0))
+        for task in tasks:
+            task.cancel()
+        await asyncio.gather(*tasks, return_exceptions=True)
+        return running
+
+    assert asyncio.run(_with_client(server, run)) == (2, 2, 2)
+    assert _in_flight(server) == (0, 0, 0)
+    assert server.request_coalescer.stats()['cancelled_calls'] == 2
+
+
+@pytest.mark.parametrize('tool', TOOLS)
+def test_expired_deadline_releases_every_slot(server, tool):
+    async def run(client):
+        results = await asyncio.gather(*[
+            client.call_tool(tool, {**_arguments(tool, index), 'timeout_seconds': 0.2})
+            for index in range(2)
+        ])
+        return [json.loads(result.content[0].text) for result in results]
+
+    started = time.perf_counter()
+    results = asyncio.run(_with_client(server, run))
+
+    assert time.perf_counter() - started < 5.0
+    for result in results:
+        assert result['isError']
+        assert "Deadline of 0.2s exceeded" in result['content'][0]['text']
+    assert _in_flight(server) == (0, 0, 0)
+    assert server.request_coalescer.stats()['cancelled_calls'] == 2
@@ -0,0 +1,42 @@
+import asyncio
+
+from backends import FakeBackend
+
+
+def _run_pair(server, bypass_cache):
+    async def run():
+        return await asyncio.gather(
+            server.deep_thinking_agent(instructions="same question", context="context"),
+            server.deep_thinking_agent(
+                instructions="same question", context="context", bypass_cache=bypass_cache,
+            ),
+        )
+
+    return asyncio.run(run())
+
+
+def test_identical_in_flight_calls_share_one_upstream_call(monkeypatch):
+    import dive_deep_server as server
+
+    fake = FakeBackend(latency=0.1, tokens_per_second=1e6, output_tokens=10)
+    monkeypatch.setattr(server, 'backend', fake)
+    monkeypatch.setattr(server, 'CACHE_ENABLED', False)
+
+    first, second = _run_pair(server, bypass_cache=False)
+
+    assert fake.call_count == 1
+    assert second['metadata'].get('coalesced')
+    assert first['content'] == second['content']
+
+
+def test_bypass_cache_call_does_not_join_an_in_flight_call(monkeypatch):
+    import dive_deep_server as server
+
+    fake = FakeBackend(latency=0.1, tokens_per_second=1e6, output_tokens=10)
+    monkeypatch.setattr(server, 'backend', fake)
+    monkeypatch.setattr(server, 'CACHE_ENABLED', False)
+
+    _, bypassed = _run_pair(server, bypass_cache=True)
+
+    assert fake.call_count == 2
+    assert not bypassed['metadata'].get('coalesced')
@@ -0,0 +1,43 @@
+import asyncio
+
+from code_encoding import minify
+
+
+def test_minify_keeps_code_after_a_block_comment():
+    lines = minify("int a;\n/* c\n c */ int b = 1;\n", "c")
+
+    assert [line.strip() for _, line in lines] == ["int a;", "int b = 1;"]
+    assert lines[-1][0] == 3
+
+
+def test_minify_keeps_comment_like_lines_inside_strings():
+    python = minify('x = 1\n"""\n# keep me\n\n"""\n# drop\n', "python")
+    javascript = minify("const s = `\n// keep me\n`;\n// drop\n", "javascript")
+
+    assert [line for _, line in python] == ['x = 1', '"""', '# keep me', '', '"""']
+    assert [line for _, line in javascript] == ['const s = `', '// keep me', '`;']
+
+
+def test_map_reduce_chunks_keep_file_paths(monkeypatch):
+    import dive_deep_server as server
+
+    contents = []
+
+    async def generate_content(**kwargs):
+        contents.append(kwargs['content'])
+        return "finding", {}
+
+    monkeypatch.setattr(server, '_generate_content', generate_content)
+    monkeypatch.setattr(server, 'CHUNK_TOKEN_BUDGET', 50)
+
+    code = ["a = 1\n" * 20, "let b = 2;\n" * 20]
+    asyncio.run(server._analyze_code(
+        'final_review_agent', 'system', 'review', code, None, 0.0, True, None, None, True,
+        paths=["src/a.py", "web/b.js"],
+    ))
+
+    map_contents = contents[:-1]
+    assert len(map_contents) > 2
+    assert any("path=src/a.py language=python" in content for content in map_contents)
+    assert any("path=web/b.js language=javascript" in content for content in map_contents)
+    assert all("path=" in content for content in map_contents)
@@ -0,0 +1,31 @@
+import asyncio
+import time
+
+from backends import FakeBackend
+
+LATENCY = 0.3
+CALLS = 6
+
+
+def test_overlapping_tool_calls_finish_in_about_one_latency(monkeypatch):
+    import dive_deep_server as server
+
+    fake = FakeBackend(latency=LATENCY, tokens_per_second=1e6, output_tokens=10)
+    monkeypatch.setattr(server, 'backend', fake)
+
+    async def run():
+        started = time.perf_counter()
+        results = await asyncio.gather(*(
+            server.deep_thinking_agent(
+                instructions=f"question {i}", context="context", bypass_cache=True,
+            )
+            for i in range(CALLS)
+        ))
+        return time.perf_counter() - started, results
+
+    elapsed, results = asyncio.run(run())
+
+    assert not any(result.get('isError') for result in results)
+    assert fake.call_count == CALLS
+    # 直列に実行された場合はLATENCY * CALLS秒かかる
+    assert elapsed < LATENCY * 2
@@ -0,0 +1,58 @@
+import asyncio
+
+from backends import FakeBackend
+from context_cache import ContextCacheManager
+
+
+def _setup(monkeypatch):
+    import dive_deep_server as server
+
+    fake = FakeBackend(latency=0.01, tokens_per_second=1e6, output_tokens=10)
+    monkeypatch.setattr(server, 'backend', fake)
+    monkeypatch.setattr(server, 'context_cache', ContextCacheManager(fake))
+    monkeypatch.setattr(server, 'CONTEXT_CACHE_ENABLED', True)
+    return server, fake
+
+
+def _call(server, instructions):
+    return asyncio.run(server.deep_thinking_agent(
+        instructions=instructions, context="context", bypass_cache=True,
+    ))
+
+
+def _generate_calls(fake):
+    return [call for call in fake.calls if call['method'] == 'generate']
+
+
+def test_handle_is_registered_once_and_reused(monkeypatch):
+    server, fake = _setup(monkeypatch)
+
+    first = _call(server, "first question")
+    second = _call(server, "second question")
+
+    registrations = [call for call in fake.calls if call['method'] == 'create_cached_content']
+    assert len(registrations) == 1
+    handles = [call['cached_content'] for call in _generate_calls(fake)]
+    assert handles == ["cachedContents/fake-1"] * 2
+    assert first['metadata']['context_cache'] and second['metadata']['context_cache']
+
+
+def test_rejected_handle_falls_back_inline_and_is_re_registered(monkeypatch):
+    server, fake = _setup(monkeypatch)
+    _call(server, "first question")
+    # 上流でキャッシュ済みコンテンツが削除された状態にする
+    fake._cached_contents.clear()
+
+    fallback = _call(server, "second question")
+    after = _call(server, "third question")
+
+    handles = [call['cached_content'] for call in _generate_calls(fake)]
+    # 2回目はハンドル付きで404になり、インラインのプロンプトで再試行する
+    assert handles[:3] == ["cachedContents/fake-1", "cachedContents/fake-1", None]
+    # 破棄したハンドルは次の呼び出しで登録し直される
+    registrations = [call for call in fake.calls if call['method'] == 'create_cached_content']
+    assert len(registrations) == 2
+    assert handles[3] is not None
+    assert not fallback.get('isError')
+    assert fallback['metadata']['context_cache'] is False
+    assert after['metadata']['context_cache'] is True
@@ -0,0 +1,82 @@
+import asyncio
+
+import pytest
+
+from backends import FakeBackend
+from sessions import SessionStore
+
+
+@pytest.fixture
+def server(monkeypatch):
+    import dive_deep_server as server
+
+    monkeypatch.setattr(
+        server, 'backend', FakeBackend(latency=0.01, tokens_per_second=1e6, output_tokens=10)
+    )
+    monkeypatch.setattr(server, 'session_store', SessionStore())
+    return server
+
+
+def test_oversized_kept_turns_are_trimmed_without_summarizing(server, monkeypatch):
+    monkeypatch.setattr(server, 'CONVERSATION_KEEP_TURNS', 2)
+    monkeypatch.setattr(server, 'CONVERSATION_TOKEN_BUDGET', 500)
+    monkeypatch.setattr(server, 'CONVERSATION_TURN_TOKENS', 200)
+    session = server.session_store.get("session")
+
+    async def run():
+        for i in range(2):
+            server._record_turn(
+                session, 'deep_thinking_agent', f"question {i}\n" * 500, "answer\n" * 500, None,
+            )
+            assert session.summarizing is None
+
+    asyncio.run(run())
+
+    assert [turn.tokens <= 200 for turn in session.turns] == [True, True]
+    assert session.history_tokens() <= 500
+    assert "trimmed" in session.turns[0].request
+
+
+def test_code_turns_keep_a_file_list_instead_of_contents(server):
+    code = ["def handler():\n    return 'payload'\n" * 200]
+
+    result = asyncio.run(server.enhancement_agent(
+        instructions="review", code=code, paths=["app/handler.py"], session_id="session",
+        bypass_cache=True,
+    ))
+
+    request = server.session_store.get("session").turns[-1].request
+    assert not result.get('isError')
+    assert "app/handler.py (400 lines)" in request
+    assert "payload" not in request
+
+
+def test_clients_with_the_same_session_id_are_isolated(server):
+    import json
+
+    from mcp.shared.memory import create_connected_server_and_client_session
+
+    async def review(client, code):
+        result = await client.call_tool('final_review_agent', {
+            'instructions': "review", 'code': [code], 'paths': ["a.py"],
+            'session_id': "shared", 'bypass_cache': True,
+        })
+        return json.loads(result.content[0].text)['metadata']
+
+    async def run():
+        mcp_server = server.mcp._mcp_server
+        async with create_connected_server_and_client_session(mcp_server) as first, \
+                create_connected_server_and_client_session(mcp_server) as second:
+            first_full = await review(first, "secret = 1\n" * 40)
+            second_full = await review(second, "other = 2\n" * 40)
+            first_diff = await review(first, "secret = 1\n" * 39 + "secret = 3\n")
+            return first_full, second_full, first_diff
+
+    first_full, second_full, first_diff = asyncio.run(run())
+
+    assert first_full['incremental']['mode'] == 'full'
+    assert second_full['incremental']['mode'] == 'full'
+    assert first_diff['incremental']['mode'] == 'diff'
+    assert first_diff['incremental']['files'] == {'modified': 1}
+    assert second_full['conversation']['turns'] == 1
+    assert server.session_store.stats()['sessions'] == 2
@@ -0,0 +1,60 @@
+import asyncio
+
+import pytest
+
+from backends import FakeBackend
+from sessions import SessionStore
+
+
+@pytest.fixture
+def server(monkeypatch):
+    import dive_deep_server as server
+
+    monkeypatch.setattr(
+        server, 'backend', FakeBackend(latency=0.05, tokens_per_second=1e6, output_tokens=10)
+    )
+    monkeypatch.setattr(server, 'session_store', SessionStore())
+    return server
+
+
+def _review(server, code, paths, session_id="session"):
+    return server.final_review_agent(
+        instructions="review", code=code, paths=paths, session_id=session_id, bypass_cache=True,
+    )
+
+
+def test_paths_are_required_with_session_id(server):
+    result = asyncio.run(_review(server, ["x = 1"], None))
+
+    assert result['isError']
+    assert "paths is required" in result['content'][0]['text']
+
+
+def test_concurrent_reviews_of_one_session_run_one_at_a_time(server):
+    before = "".join(f"line_{i} = {i}\n" for i in range(40))
+    after = before.replace("line_20 = 20", "line_20 = 21")
+
+    async def run():
+        return await asyncio.gather(
+            _review(server, [before], ["a.py"]),
+            _review(server, [after], ["a.py"]),
+        )
+
+    first, second = asyncio.run(run())
+
+    assert first['metadata']['incremental']['mode'] == 'full'
+    # 2回目は1回目の完了を待ち、その結果を基準に差分をレビューする
+    assert second['metadata']['incremental']['mode'] == 'diff'
+    assert second['metadata']['incremental']['files'] == {'modified': 1}
+
+
+def test_files_over_the_session_limit_are_not_retained(server, monkeypatch):
+    monkeypatch.setattr(server, 'session_store', SessionStore(max_review_bytes=1024))
+    large = "x = 1\n" * 1000
+
+    first = asyncio.run(_review(server, [large], ["a.py"]))
+    second = asyncio.run(_review(server, [large], ["a.py"]))
+
+    assert first['metadata']['incremental']['retained'] is False
+    assert second['metadata']['incremental']['mode'] == 'full'
+    assert server.session_store.get("session").reviewed_files == {}
@@ -0,0 +1,45 @@
+import os
+import threading
+from datetime import datetime, timedelta
+
+from logger_config import BackgroundStream, DailyLogFile
+
+
+class RecordingLogFile(DailyLogFile):
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        self.threads = set()
+
+    def write(self, message):
+        self.threads.add(threading.current_thread())
+        super().write(message)
+
+
+def test_file_sink_is_written_by_the_background_thread(tmp_path):
+    log_file = RecordingLogFile(str(tmp_path), "app")
+    stream = BackgroundStream(log_file, close_on_stop=True)
+
+    for i in range(100):
+        stream.write(f"line {i}\n")
+    stream.stop()
+
+    assert threading.main_thread() not in log_file.threads
+    path = tmp_path / f"app_{datetime.now():%Y%m%d}.log"
+    assert path.read_text(encoding="utf-8").splitlines() == [f"line {i}" for i in range(100)]
+
+
+def test_files_older_than_the_retention_are_removed(tmp_path):
+    now = datetime.now()
+    old = tmp_path / f"app_{now - timedelta(days=31):%Y%m%d}.log"
+    recent = tmp_path / f"app_{now - timedelta(days=3):%Y%m%d}.log"
+    other = tmp_path / f"other_{now - timedelta(days=31):%Y%m%d}.log"
+    for path in (old, recent, other):
+        path.write_text("x", encoding="utf-8")
+
+    log_file = DailyLogFile(str(tmp_path), "app", retention_days=30)
+    log_file.write("line\n")
+    log_file.close()
+
+    assert sorted(os.listdir(tmp_path)) == sorted(
+        [recent.name, other.name, f"app_{now:%Y%m%d}.log"]
+    )
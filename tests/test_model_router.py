@@ -0,0 +1,70 @@
+import asyncio
+
+import pytest
+
+from model_router import HEDGE_WINDOW, MIN_HEDGE_SAMPLES, ModelRouter, Route, hedged_call, load_routes
+
+
+def test_concurrent_slow_requests_respect_max_hedge_ratio():
+    route = Route('slow', 'primary', hedge_model='fast', hedge_after=0.01, max_hedge_ratio=0.1)
+    router = ModelRouter([route], 'default')
+
+    async def primary():
+        await asyncio.sleep(0.1)
+        return 'primary'
+
+    async def hedge():
+        await asyncio.sleep(0.2)
+        return 'hedge'
+
+    async def call():
+        _, winner, hedged = await hedged_call(
+            primary, hedge, router.start(route), lambda: router.reserve_hedge(route)
+        )
+        router.record(route, 0.1, winner, 0.1)
+        return hedged
+
+    async def run():
+        return await asyncio.gather(*(call() for _ in range(30)))
+
+    hedged = asyncio.run(run())
+
+    assert sum(hedged) <= 3
+    assert router.stats()['routes'][0]['hedged'] == sum(hedged)
+
+
+def test_hedge_delay_follows_recent_latency():
+    route = Route('slow', 'primary', hedge_model='fast', hedge_quantile=0.5, max_hedge_ratio=1.0)
+    router = ModelRouter([route], 'default')
+    for _ in range(MIN_HEDGE_SAMPLES):
+        router.start(route)
+        router.record(route, 5.0, 'primary', 5.0)
+    assert router.hedge_delay(route) == 5.0
+
+    for _ in range(HEDGE_WINDOW):
+        router.start(route)
+        router.record(route, 1.0, 'primary', 1.0)
+    assert router.hedge_delay(route) == 1.0
+
+
+@pytest.mark.parametrize('raw, message', [
+    ('[{"name": "a", "model": "m"', 'invalid JSON'),
+    ('{"name": "a", "model": "m"}', 'expected a list'),
+    ('[{"name": "a", "model": "m", "hedge_modle": "x"}]', 'unknown keys: hedge_modle'),
+    ('[{"name": "a"}]', "'model'"),
+    ('[{"name": "a", "model": "m", "max_hedge_ratio": 2}]', "'max_hedge_ratio'"),
+    ('[{"name": "a", "model": "m"}, {"name": "a", "model": "n"}]', 'duplicate route names: a'),
+])
+def test_invalid_routes_are_reported(raw, message):
+    with pytest.raises(ValueError, match=message):
+        load_routes(raw)
+
+
+def test_server_ignores_invalid_routes(monkeypatch):
+    import dive_deep_server as server
+
+    monkeypatch.setenv('DIVE_DEEP_MODEL_ROUTES', '[{"name": "a", "model": "m", "bogus": 1}]')
+    assert server._load_model_routes() == []
+
+    monkeypatch.setenv('DIVE_DEEP_MODEL_ROUTES', '[{"name": "a", "model": "m", "tools": ["x"]}]')
+    assert server._load_model_routes() == [Route('a', 'm', tools=['x'])]
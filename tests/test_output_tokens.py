@@ -0,0 +1,107 @@
+import asyncio
+
+from backends import FakeBackend
+
+
+class RecordingBackend(FakeBackend):
+    """呼び出しごとのコンテンツと出力トークン数の上限を記録するフェイクバックエンド"""
+
+    def __init__(self, **options):
+        super().__init__(**options)
+        self.requests = []
+
+    async def generate(self, model, contents, system_instruction=None, temperature=None,
+                       cached_content=None, max_output_tokens=None):
+        self.requests.append((contents, max_output_tokens))
+        return await super().generate(
+            model, contents, system_instruction, temperature, cached_content, max_output_tokens
+        )
+
+
+def test_output_is_not_capped_by_default(monkeypatch):
+    import dive_deep_server as server
+
+    fake = FakeBackend(latency=0.01, tokens_per_second=1e6, output_tokens=10)
+    monkeypatch.setattr(server, 'backend', fake)
+
+    result = asyncio.run(server.deep_thinking_agent(
+        instructions="question", context="context", bypass_cache=True,
+    ))
+
+    metadata = result['metadata']
+    assert metadata['preflight']['max_output_tokens'] is None
+    assert metadata['finish_reason'] == 'STOP'
+    assert metadata['output_tokens'] == 10
+
+
+def test_truncated_response_reports_max_tokens(monkeypatch):
+    import dive_deep_server as server
+
+    fake = FakeBackend(latency=0.01, tokens_per_second=1e6, output_tokens=10)
+    monkeypatch.setattr(server, 'backend', fake)
+    monkeypatch.setattr(server, 'MAX_OUTPUT_TOKENS', 4)
+    monkeypatch.setattr(server, 'MIN_OUTPUT_TOKENS', 1)
+
+    result = asyncio.run(server.deep_thinking_agent(
+        instructions="question", context="context", bypass_cache=True, stream=True,
+    ))
+
+    metadata = result['metadata']
+    assert metadata['preflight']['max_output_tokens'] == 4
+    assert metadata['finish_reason'] == 'MAX_TOKENS'
+    assert metadata['output_tokens'] == 4
+
+
+def test_truncated_response_is_not_served_from_the_cache(monkeypatch):
+    import dive_deep_server as server
+    from response_cache import ResponseCache
+
+    fake = FakeBackend(latency=0.01, tokens_per_second=1e6, output_tokens=10)
+    monkeypatch.setattr(server, 'backend', fake)
+    monkeypatch.setattr(server, 'response_cache', ResponseCache())
+    monkeypatch.setattr(server, 'CACHE_ENABLED', True)
+    monkeypatch.setattr(server, 'MIN_OUTPUT_TOKENS', 1)
+
+    def ask():
+        return asyncio.run(server.deep_thinking_agent(instructions="question", context="context"))
+
+    monkeypatch.setattr(server, 'MAX_OUTPUT_TOKENS', 4)
+    capped = ask()
+    monkeypatch.setattr(server, 'MAX_OUTPUT_TOKENS', 0)
+    uncapped = ask()
+    repeated = ask()
+
+    assert capped['metadata']['finish_reason'] == 'MAX_TOKENS'
+    assert uncapped['metadata']['cached'] is False
+    assert uncapped['metadata']['output_tokens'] == 10
+    assert repeated['metadata']['cached'] is True
+    assert repeated['content'][0]['text'] == uncapped['content'][0]['text']
+    assert fake.call_count == 2
+
+
+def test_map_reduce_calls_are_preflighted_and_capped(monkeypatch):
+    import dive_deep_server as server
+    from preflight import estimate_tokens
+
+    fake = RecordingBackend(latency=0.01, tokens_per_second=1e6, output_tokens=400)
+    monkeypatch.setattr(server, 'backend', fake)
+    monkeypatch.setattr(server, 'CACHE_ENABLED', False)
+    monkeypatch.setattr(server, 'CHUNK_TOKEN_BUDGET', 60)
+    monkeypatch.setattr(server, 'TOKEN_BUDGET', 1500)
+    monkeypatch.setattr(server, 'MAX_OUTPUT_TOKENS', 500)
+    monkeypatch.setattr(server, 'MIN_OUTPUT_TOKENS', 500)
+
+    # 3つのチャンクの部分的な結果の合計は、reduceの呼び出しの予算を超える
+    code = [f"value_{i} = {i}\n" * 12 for i in range(3)]
+    result = asyncio.run(server.enhancement_agent(
+        instructions="review", code=code, map_reduce=True, bypass_cache=True,
+    ))
+
+    metadata = result['metadata']
+    assert metadata['map_reduce']['chunks'] == 3
+    assert [cap for _, cap in fake.requests] == [500] * 4
+    reduce_content = fake.requests[-1][0]
+    assert "partial findings" in reduce_content
+    assert estimate_tokens(reduce_content) <= 1500
+    assert len(metadata['preflight']['trimmed']) > 0
+    assert metadata['preflight']['max_output_tokens'] == 500
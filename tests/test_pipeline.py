@@ -0,0 +1,86 @@
+import asyncio
+import time
+
+from backends import FakeBackend, FakeBackendError
+from prompts import ADVANCED_ANALYSIS_PROMPT
+from session_limiter import SessionLimiter
+
+
+class FailingEnhancementBackend(FakeBackend):
+    """改善分析の段階だけを失敗させ、思考の深化の段階は長く実行するフェイクバックエンド"""
+
+    def __init__(self, **options):
+        super().__init__(**options)
+        self.thinking_cancelled = False
+
+    async def generate(self, model, contents, system_instruction=None, *args, **kwargs):
+        if system_instruction == ADVANCED_ANALYSIS_PROMPT:
+            await asyncio.sleep(0.05)
+            raise FakeBackendError(400, "INVALID_ARGUMENT")
+        try:
+            await asyncio.sleep(5)
+        except asyncio.CancelledError:
+            self.thinking_cancelled = True
+            raise
+        return await super().generate(model, contents, system_instruction, *args, **kwargs)
+
+
+class ClientSession:
+    """MCPのクライアントセッションの代わりに弱参照で保持できるオブジェクト"""
+
+
+class RecordingContext:
+    def __init__(self):
+        self.session = ClientSession()
+        self.progress = []
+
+    async def report_progress(self, progress, total=None, message=None):
+        self.progress.append((progress, total, message))
+
+
+def test_failed_stage_cancels_the_sibling_stage(monkeypatch):
+    import dive_deep_server as server
+
+    fake = FailingEnhancementBackend(latency=0.01, tokens_per_second=1e6, output_tokens=10)
+    monkeypatch.setattr(server, 'backend', fake)
+
+    async def run():
+        started = time.perf_counter()
+        result = await server.dive_deep_pipeline(
+            instructions="review", code=["x = 1"], context="context", bypass_cache=True,
+        )
+        elapsed = time.perf_counter() - started
+        # キャンセルされた段階が後始末を終えるまで待つ（イベントループの終了時のキャンセルと区別する）
+        await asyncio.sleep(0.05)
+        return elapsed, result, fake.thinking_cancelled, server.scheduler.stats()['running']
+
+    elapsed, result, thinking_cancelled, running = asyncio.run(run())
+
+    assert result['isError']
+    assert elapsed < 1
+    assert thinking_cancelled
+    assert running == 0
+
+
+def test_stages_use_the_callers_session_and_report_progress(monkeypatch):
+    import dive_deep_server as server
+
+    monkeypatch.setattr(
+        server, 'backend', FakeBackend(latency=0.01, tokens_per_second=1e6, output_tokens=10)
+    )
+    monkeypatch.setattr(server, 'session_limiter', SessionLimiter(1))
+    ctx = RecordingContext()
+
+    result = asyncio.run(server.dive_deep_pipeline(
+        instructions="review", code=["x = 1"], context="context",
+        bypass_cache=True, stream=False, ctx=ctx,
+    ))
+
+    assert not result.get('isError')
+    sessions = server.session_limiter.stats()['sessions']
+    assert [(s['calls'], s['waits'], s['in_flight']) for s in sessions] == [(3, 1, 0)]
+    assert [(progress, total) for progress, total, _ in ctx.progress] == [(1, 3), (2, 3), (3, 3)]
+    assert ctx.progress[-1][2].startswith("final_review_agent finished")
+    assert {message.split()[0] for _, _, message in ctx.progress} == {
+        'deep_thinking_agent', 'enhancement_agent', 'final_review_agent',
+    }
@@ -0,0 +1,32 @@
+import asyncio
+import threading
+
+from response_cache import ResponseCache
+
+
+def test_disk_tier_is_read_and_written_off_the_event_loop(tmp_path, monkeypatch):
+    threads = []
+    read_disk = ResponseCache._read_disk
+    write_disk = ResponseCache._write_disk
+
+    def record_read(self, key):
+        threads.append(threading.current_thread())
+        return read_disk(self, key)
+
+    def record_write(self, key, entry):
+        threads.append(threading.current_thread())
+        return write_disk(self, key, entry)
+
+    monkeypatch.setattr(ResponseCache, '_read_disk', record_read)
+    monkeypatch.setattr(ResponseCache, '_write_disk', record_write)
+
+    async def run():
+        await ResponseCache(disk_dir=str(tmp_path)).set_async('key', 'text', 1.5)
+        # 新しいインスタンスはメモリ階層が空のため、ディスク階層から読む
+        return await ResponseCache(disk_dir=str(tmp_path)).get_async('key')
+
+    entry = asyncio.run(run())
+
+    assert entry is not None and entry.text == 'text'
+    assert len(threads) == 2
+    assert all(thread is not threading.main_thread() for thread in threads)
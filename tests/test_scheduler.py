@@ -0,0 +1,84 @@
+import asyncio
+import time
+from types import SimpleNamespace
+
+import pytest
+
+from scheduler import ModelQuota, RequestScheduler
+
+RATE = 20.0  # 1秒あたりのリクエスト数
+RETRY_AFTER = 0.1
+
+
+class RateLimited(Exception):
+    """Retry-Afterヘッダー付きの429"""
+
+    code = 429
+
+    def __init__(self, retry_after: float):
+        super().__init__("429 RESOURCE_EXHAUSTED")
+        self.response = SimpleNamespace(headers={'retry-after': str(retry_after)})
+
+
+class ScriptedBackend:
+    """決められた順番の呼び出しで429を返すスタブ"""
+
+    def __init__(self, fail_on):
+        self.fail_on = set(fail_on)
+        self.attempts = []
+
+    async def call(self):
+        self.attempts.append(time.monotonic())
+        if len(self.attempts) in self.fail_on:
+            raise RateLimited(RETRY_AFTER)
+        return 'ok'
+
+
+def _scheduler(**options):
+    scheduler = RequestScheduler(
+        default_quota=ModelQuota(rpm=RATE * 60), base_delay=0.01, **options
+    )
+    # クォータを使い切った状態から始め、バケットの補充速度だけで流れるようにする
+    bucket, _ = scheduler._buckets('model')
+    bucket.tokens = 0
+    return scheduler
+
+
+def test_retries_429s_and_stays_within_the_bucket_rate():
+    backend = ScriptedBackend(fail_on={1, 3})
+    scheduler = _scheduler()
+
+    async def run():
+        started = time.monotonic()
+        results = await asyncio.gather(*(
+            scheduler.run('model', 100, backend.call) for _ in range(6)
+        ))
+        return started, results
+
+    started, results = asyncio.run(run())
+
+    assert results == ['ok'] * 6
+    stats = scheduler.stats()
+    assert stats['retries'] == 2
+    assert stats['completed'] == 6 and stats['failed'] == 0
+    # 再試行を含む8回の試行がそれぞれ1/RATE秒ずつバケットの補充を待つ
+    attempts = len(backend.attempts)
+    assert attempts == 8
+    assert stats['throttled_seconds'] == pytest.approx(attempts / RATE, abs=0.05)
+    for k, at in enumerate(sorted(backend.attempts), start=1):
+        assert at - started >= k / RATE - 0.005
+
+
+def test_gives_up_after_max_retries():
+    backend = ScriptedBackend(fail_on=range(1, 100))
+    scheduler = _scheduler(max_retries=2)
+
+    with pytest.raises(RateLimited):
+        asyncio.run(scheduler.run('model', 100, backend.call))
+
+    assert len(backend.attempts) == 3
+    assert scheduler.stats()['retries'] == 2
+    assert scheduler.stats()['failed'] == 1
+    # 再試行はRetry-Afterの秒数以上待ってから行う
+    gaps = [b - a for a, b in zip(backend.attempts, backend.attempts[1:])]
+    assert all(gap >= RETRY_AFTER for gap in gaps)
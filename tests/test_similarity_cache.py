@@ -0,0 +1,38 @@
+import asyncio
+
+from backends import FakeBackend
+from similarity_cache import SimilarityCache, signature
+
+
+def test_texts_without_words_are_not_cached():
+    cache = SimilarityCache(threshold=0.9)
+    cache.add('scope', '!!!', 'answer for symbols')
+
+    assert signature('') is None
+    assert cache.lookup('scope', '???  ...') is None
+    assert cache.stats()['entries'] == 0
+    assert cache.stats()['skipped'] == 1
+
+
+def test_similarity_hits_respect_cache_enabled(monkeypatch):
+    import dive_deep_server as server
+
+    fake = FakeBackend(latency=0.01, tokens_per_second=1e6, output_tokens=10)
+    monkeypatch.setattr(server, 'backend', fake)
+    monkeypatch.setattr(server, 'similarity_cache', SimilarityCache(threshold=0.5))
+    monkeypatch.setattr(server, 'SIMILARITY_CACHE_ENABLED', True)
+    monkeypatch.setattr(server, 'SIMILARITY_CACHE_TOOLS', {'deep_thinking_agent'})
+    question = "how should the scheduler share the rate limit between all of the models"
+
+    async def ask(suffix):
+        return await server.deep_thinking_agent(instructions=question + suffix, context="context")
+
+    monkeypatch.setattr(server, 'CACHE_ENABLED', True)
+    asyncio.run(ask(""))
+    approximate = asyncio.run(ask(" please"))
+    monkeypatch.setattr(server, 'CACHE_ENABLED', False)
+    disabled = asyncio.run(ask(" now"))
+
+    assert approximate['metadata'].get('approximate') is True
+    assert disabled['metadata']['cached'] is False
+    assert fake.call_count == 2
@@ -0,0 +1,49 @@
+import asyncio
+
+from backends import FakeBackend, FakeBackendError
+from scheduler import RequestScheduler
+
+
+class FlakyStreamBackend(FakeBackend):
+    """最初のストリームだけ途中で503を返すフェイクバックエンド"""
+
+    def __init__(self, **options):
+        super().__init__(**options)
+        self.failed = False
+
+    async def generate_stream(self, *args, **kwargs):
+        sent = 0
+        async for chunk in super().generate_stream(*args, **kwargs):
+            yield chunk
+            sent += 1
+            if not self.failed and sent == 3:
+                self.failed = True
+                raise FakeBackendError(503, "UNAVAILABLE")
+
+
+class RecordingContext:
+    session = None
+
+    def __init__(self):
+        self.progress = []
+
+    async def report_progress(self, progress, total=None, message=None):
+        self.progress.append(progress)
+
+
+def test_progress_does_not_go_backwards_when_a_stream_is_retried(monkeypatch):
+    import dive_deep_server as server
+
+    fake = FlakyStreamBackend(latency=0.01, tokens_per_second=1e6, output_tokens=200)
+    monkeypatch.setattr(server, 'backend', fake)
+    monkeypatch.setattr(server, 'scheduler', RequestScheduler(base_delay=0.01))
+    ctx = RecordingContext()
+
+    result = asyncio.run(server.deep_thinking_agent(
+        instructions="question", context="context", bypass_cache=True, stream=True, ctx=ctx,
+    ))
+
+    assert not result.get('isError')
+    assert fake.failed and server.scheduler.retries == 1
+    assert ctx.progress == sorted(set(ctx.progress))
+    assert ctx.progress[-1] == len(result['content'][0]['text'])
@@ -0,0 +1,85 @@
+"""トークン見積もりモジュール
+
+外部のトークナイザを使わずに入力のトークン数を概算し、
+コードのリストをトークン予算内のチャンクに分割します。
+"""
+
+import re
+from typing import List, Optional, Tuple
+
+# 英数字の連続、CJK文字、その他の記号をそれぞれトークン候補として数える
+_TOKEN_PATTERN = re.compile(
+    r"[A-Za-z0-9_]+|[\u3040-\u30ff\u3400-\u4dbf\u4e00-\u9fff\uac00-\ud7af]|[^\sA-Za-z0-9_]"
+)
+# 長い英単語はおよそ4文字で1トークンに分割されるものとみなす
+_CHARS_PER_WORD_TOKEN = 4
+
+
+def estimate_tokens(text: str) -> int:
+    """テキストのトークン数を概算します"""
+    count = 0
+    for match in _TOKEN_PATTERN.finditer(text):
+        length = match.end() - match.start()
+        count += 1 if length <= _CHARS_PER_WORD_TOKEN else -(-length // _CHARS_PER_WORD_TOKEN)
+    return count
+
+
+def _split_file(text: str, budget: int) -> List[str]:
+    """予算を超えるファイルを行単位で分割します"""
+    parts: List[str] = []
+    current: List[str] = []
+    current_tokens = 0
+    for line in text.splitlines(keepends=True):
+        line_tokens = estimate_tokens(line)
+        if current and current_tokens + line_tokens > budget:
+            parts.append(''.join(current))
+            current, current_tokens = [], 0
+        current.append(line)
+        current_tokens += line_tokens
+    if current:
+        parts.append(''.join(current))
+    return parts
+
+
+def chunk_code(code: List[str], budget: int) -> List[List[str]]:
+    """コードのリストを、各チャンクの推定トークン数が予算内に収まるように分割します
+
+    ファイルは元の順序のままチャンクに詰められます。単独で予算を超えるファイルは
+    行単位で分割され、各部分が独立した要素としてチャンクに含まれます。
+    """
+    return [chunk for chunk, _ in chunk_files(code, None, budget)]
+
+
+def chunk_files(
+    code: List[str],
+    paths: Optional[List[str]],
+    budget: int
+) -> List[Tuple[List[str], List[Optional[str]]]]:
+    """chunk_codeと同様に分割し、各チャンクの要素に対応するパスのリストも返します
+
+    分割されたファイルの各部分には元のファイルのパスが対応します。
+    """
+    chunks: List[Tuple[List[str], List[Optional[str]]]] = []
+    current: List[str] = []
+    current_paths: List[Optional[str]] = []
+    current_tokens = 0
+    for index, text in enumerate(code):
+        path = paths[index] if paths and index < len(paths) else None
+        tokens = estimate_tokens(text)
+        if tokens > budget:
+            pieces = _split_file(text, budget)
+            total = len(pieces)
+            pieces = [f"(part {i + 1}/{total})\n{piece}" for i, piece in enumerate(pieces)]
+        else:
+            pieces = [text]
+        for piece in pieces:
+            piece_tokens = tokens if len(pieces) == 1 else estimate_tokens(piece)
+            if current and current_tokens + piece_tokens > budget:
+                chunks.append((current, current_paths))
+                current, current_paths, current_tokens = [], [], 0
+            current.append(piece)
+            current_paths.append(path)
+            current_tokens += piece_tokens
+    if current:
+        chunks.append((current, current_paths))
+    return chunks
@@ -0,0 +1,294 @@
+"""トレースストアモジュール
+
+ツール呼び出しごとの入力・出力・所要時間・トークン数をレコードとして、
+圧縮したセグメントファイルに追記します。レコードはまとめて1つのブロックとして
+zlibで圧縮し、ブロックごとの時間範囲とツールごとのレコード数をインデックス
+（index.jsonl）に記録します。検索ではインデックスで条件に合うブロックだけを
+展開します。合計サイズが上限を超えた場合は古いセグメントから削除します。
+
+書き込みはバックグラウンドのスレッドで行うため、ツール呼び出しは圧縮や
+ディスクへの書き込みを待ちません。
+"""
+
+import json
+import os
+import queue
+import threading
+import time
+import zlib
+from dataclasses import asdict, dataclass
+from typing import Any, Dict, Iterator, List, Optional
+
+INDEX_FILE = "index.jsonl"
+_SEGMENT_PREFIX = "segment-"
+_SEGMENT_SUFFIX = ".zlib"
+
+
+@dataclass(slots=True)
+class Block:
+    """セグメント内の圧縮されたブロック1つ分のインデックス"""
+    segment: str
+    offset: int
+    length: int
+    start: float
+    end: float
+    count: int
+    tools: Dict[str, int]
+
+    def matches(self, start: Optional[float], end: Optional[float], tool: Optional[str]) -> bool:
+        if start is not None and self.end < start:
+            return False
+        if end is not None and self.start > end:
+            return False
+        return tool is None or tool in self.tools
+
+
+def token_usage(metadata: Any) -> Dict[str, int]:
+    """メタデータ（ネストしたステージやジョブを含む）の入出力トークン数を合計します"""
+    usage = {'input_tokens': 0, 'output_tokens': 0}
+    stack = [metadata]
+    while stack:
+        value = stack.pop()
+        if isinstance(value, dict):
+            for key, item in value.items():
+                if key in usage and isinstance(item, int):
+                    usage[key] += item
+                else:
+                    stack.append(item)
+        elif isinstance(value, list):
+            stack.extend(value)
+    return usage
+
+
+def load_index(directory: str) -> List[Block]:
+    """インデックスを読み込み、存在するセグメントのブロックを古い順に返します"""
+    blocks: List[Block] = []
+    try:
+        with open(os.path.join(directory, INDEX_FILE), encoding="utf-8") as f:
+            for line in f:
+                try:
+                    blocks.append(Block(**json.loads(line)))
+                except (ValueError, TypeError):
+                    # 書き込み途中で終了した最後の行は無視する
+                    continue
+    except OSError:
+        return []
+    segments = {name for name in os.listdir(directory) if name.startswith(_SEGMENT_PREFIX)}
+    return [block for block in blocks if block.segment in segments]
+
+
+def read_traces(
+    directory: str,
+    start: Optional[float] = None,
+    end: Optional[float] = None,
+    tool: Optional[str] = None,
+    blocks: Optional[List[Block]] = None
+) -> Iterator[Dict[str, Any]]:
+    """時間範囲（エポック秒）とツール名に一致するレコードを記録順に返します"""
+    for block in blocks if blocks is not None else load_index(directory):
+        if not block.matches(start, end, tool):
+            continue
+        try:
+            with open(os.path.join(directory, block.segment), "rb") as f:
+                f.seek(block.offset)
+                data = zlib.decompress(f.read(block.length))
+        except (OSError, zlib.error):
+            # 上限を超えて削除されたセグメントや壊れたブロックは読み飛ばす
+            continue
+        for line in data.decode("utf-8").splitlines():
+            record = json.loads(line)
+            if start is not None and record['ts'] < start:
+                continue
+            if end is not None and record['ts'] > end:
+                continue
+            if tool is not None and record['tool'] != tool:
+                continue
+            yield record
+
+
+class TraceStore:
+    """追記専用で合計サイズに上限のあるトレースストア
+
+    レコードはblock_records件たまるか、最初のレコードからflush_interval秒が
+    経過した時点で1つのブロックとして書き込まれます。セグメントがsegment_bytesを
+    超えると新しいセグメントに切り替え、合計サイズがmax_bytesを超えると最も古い
+    セグメントから削除します。書き込み待ちのレコードがmax_pendingを超えた場合は
+    記録せずに捨てます。
+    """
+
+    def __init__(
+        self,
+        directory: str,
+        max_bytes: int = 256 * 1024 * 1024,
+        segment_bytes: int = 8 * 1024 * 1024,
+        block_records: int = 256,
+        flush_interval: float = 1.0,
+        max_pending: int = 10000
+    ):
+        self.directory = directory
+        self.max_bytes = max_bytes
+        self.segment_bytes = segment_bytes
+        self.block_records = block_records
+        self.flush_interval = flush_interval
+        os.makedirs(directory, exist_ok=True)
+        self._lock = threading.Lock()
+        self._blocks = load_index(directory)
+        self._rewrite_index()
+        self._segment: Optional[str] = None
+        self._segment_size = 0
+        self.records = 0
+        self.dropped = 0
+        self.evicted_segments = 0
+        self._queue: "queue.Queue[Optional[Dict[str, Any]]]" = queue.Queue(max_pending)
+        self._thread = threading.Thread(target=self._worker, name='trace-writer', daemon=True)
+        self._thread.start()
+
+    def record(self, record: Dict[str, Any]) -> None:
+        """レコード（tsとtoolを含む辞書）を書き込み待ちに追加します"""
+        try:
+            self._queue.put_nowait(record)
+        except queue.Full:
+            # 書き込みスレッドも更新するため、ロックの中で数える
+            with self._lock:
+                self.dropped += 1
+
+    def close(self) -> None:
+        """書き込み待ちのレコードを書き終えてからスレッドを終了します"""
+        self._queue.put(None)
+        self._thread.join()
+
+    def blocks(self) -> List[Block]:
+        """書き込み済みのブロックのインデックスを返します"""
+        with self._lock:
+            return list(self._blocks)
+
+    def query(
+        self,
+        start: Optional[float] = None,
+        end: Optional[float] = None,
+        tool: Optional[str] = None
+    ) -> Iterator[Dict[str, Any]]:
+        """書き込み済みのレコードから時間範囲とツール名に一致するものを返します"""
+        return read_traces(self.directory, start, end, tool, self.blocks())
+
+    def stats(self) -> Dict[str, Any]:
+        """セグメント・ブロック・レコードの数とディスク使用量を返します"""
+        with self._lock:
+            segments = {block.segment for block in self._blocks}
+            return {
+                'directory': self.directory,
+                'segments': len(segments),
+                'blocks': len(self._blocks),
+                'records': sum(block.count for block in self._blocks),
+                'recorded': self.records,
+                'dropped': self.dropped,
+                'pending': self._queue.qsize(),
+                'bytes': self._disk_bytes(),
+                'max_bytes': self.max_bytes,
+                'evicted_segments': self.evicted_segments,
+            }
+
+    def _worker(self) -> None:
+        pending: List[Dict[str, Any]] = []
+        deadline = 0.0
+        while True:
+            timeout = max(deadline - time.monotonic(), 0) if pending else None
+            try:
+                record = self._queue.get(timeout=timeout)
+            except queue.Empty:
+                # 最初のレコードからflush_interval秒が経過した
+                self._write_block(pending)
+                pending = []
+                continue
+            if record is None:
+                if pending:
+                    self._write_block(pending)
+                return
+            if not pending:
+                deadline = time.monotonic() + self.flush_interval
+            pending.append(record)
+            if len(pending) >= self.block_records or time.monotonic() >= deadline:
+                self._write_block(pending)
+                pending = []
+
+    def _write_block(self, records: List[Dict[str, Any]]) -> None:
+        lines = "\n".join(
+            json.dumps(record, ensure_ascii=False, default=str) for record in records
+        )
+        data = zlib.compress(lines.encode("utf-8"), 6)
+        tools: Dict[str, int] = {}
+        for record in records:
+            tools[record['tool']] = tools.get(record['tool'], 0) + 1
+        try:
+            if self._segment is None or self._segment_size + len(data) > self.segment_bytes:
+                self._segment = f"{_SEGMENT_PREFIX}{time.time_ns()}{_SEGMENT_SUFFIX}"
+                self._segment_size = 0
+            with open(os.path.join(self.directory, self._segment), "ab") as f:
+                f.write(data)
+            block = Block(
+                segment=self._segment,
+                offset=self._segment_size,
+                length=len(data),
+                start=min(record['ts'] for record in records),
+                end=max(record['ts'] for record in records),
+                count=len(records),
+                tools=tools,
+            )
+            self._segment_size += len(data)
+            # ブロックの書き込みが終わってからインデックスに追記する
+            with open(os.path.join(self.directory, INDEX_FILE), "a", encoding="utf-8") as f:
+                f.write(json.dumps(asdict(block)) + "\n")
+        except OSError:
+            with self._lock:
+                self.dropped += len(records)
+            return
+        with self._lock:
+            self._blocks.append(block)
+            self.records += len(records)
+        if self._disk_bytes() > self.max_bytes:
+            self._evict()
+
+    def _segment_sizes(self) -> Dict[str, int]:
+        sizes: Dict[str, int] = {}
+        for name in os.listdir(self.directory):
+            if name.startswith(_SEGMENT_PREFIX):
+                try:
+                    sizes[name] = os.path.getsize(os.path.join(self.directory, name))
+                except OSError:
+                    continue
+        return sizes
+
+    def _disk_bytes(self) -> int:
+        try:
+            index = os.path.getsize(os.path.join(self.directory, INDEX_FILE))
+        except OSError:
+            index = 0
+        return sum(self._segment_sizes().values()) + index
+
+    def _evict(self) -> None:
+        """合計サイズが上限以下になるまで古いセグメントを削除します"""
+        sizes = self._segment_sizes()
+        total = self._disk_bytes()
+        for name in sorted(sizes):
+            if total <= self.max_bytes:
+                break
+            if name == self._segment:
+                # 書き込み中のセグメントは次のブロックから新しいセグメントに切り替える
+                self._segment = None
+            try:
+                os.remove(os.path.join(self.directory, name))
+            except OSError:
+                continue
+            total -= sizes[name]
+            self.evicted_segments += 1
+            with self._lock:
+                self._blocks = [block for block in self._blocks if block.segment != name]
+        self._rewrite_index()
+
+    def _rewrite_index(self) -> None:
+        """削除したセグメントのブロックを除いてインデックスを書き直します"""
+        path = os.path.join(self.directory, INDEX_FILE)
+        with open(f"{path}.tmp", "w", encoding="utf-8") as f:
+            for block in self.blocks():
+                f.write(json.dumps(asdict(block)) + "\n")
+        os.replace(f"{path}.tmp", path)